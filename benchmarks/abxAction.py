@@ -0,0 +1,54 @@
+#--------------------------------------------------------#
+#                     Spas Kaloferov                     #
+#                   www.kaloferov.com                    #
+#--------------------------------------------------------#
+
+  #
+  # [Description] 
+  #   - Loads the ABX action module (casSyncBlueprintToGitlab-py.py) for the benchmarks.
+  #   - The action file name is not a valid module name, so it is loaded from its path.
+  #   - actionInputs() returns the action inputs as configured in casSyncBlueprintToGitlab-py.abx
+  #
+
+
+import os
+import importlib.util
+
+
+actionPath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "casSyncBlueprintToGitlab-py.py")
+
+
+def loadAction (moduleName="casSyncBlueprintToGitlab"):   # Returns a freshly loaded action module
+    spec = importlib.util.spec_from_file_location(moduleName, actionPath)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+    # End Function  
+
+
+
+def actionInputs (**overrides):   # Returns the default action inputs with overrides applied
+    inputs = {
+        'gitProjectIdIn': "1",
+        'runOnPropertyIn': "<Optional>",
+        'blueprintIdABXIn': "<Optional>",
+        'awsSmRegionNameIn': "<Optional>",
+        'cspRefreshTokenIn': "bench-refresh-token",
+        'gitPrivateTokenIn': "bench-git-token",
+        'blueprintNameABXIn': "<Optional>",
+        'gitProjectFolderIn': "blueprints/",
+        'blueprintVersionABXIn': "<Optional>",
+        'runOnBlueprintOptionIn': "<Optional>",
+        'awsSmCspTokenSecretIdIn': "<Optional>",
+        'awsSmGitTokenSecretIdIn': "<Optional>",
+        'runOnPorpertyMatchABXIn': "<Optional>",
+        'actionOptionRunOnPropertyIn': "False",
+        'runOnBlueprintOptionMatchABXIn': "<Optional>",
+        'actionOptionAcceptPayloadInputIn': "True",
+        'actionOptionRunOnBlueprintOptionIn': "False",
+        'actionOptionUseAwsSecretsManagerIn': "False",
+        'secretsProviderIn': "<Optional>",
+    }
+    inputs.update(overrides)
+    return inputs
+    # End Function  
@@ -0,0 +1,420 @@
+#--------------------------------------------------------#
+#                     Spas Kaloferov                     #
+#                   www.kaloferov.com                    #
+#--------------------------------------------------------#
+
+  #
+  # [Description]
+  #   - Local stand-ins for the services the ABX action talks to. One HTTP server emulates:
+  #      - CSP: POST /iaas/api/login, GET /blueprint/api/blueprints[/{id}[/versions[/{version}]]]
+  #      - GitLab v4: projects, repository files (GET / HEAD / DELETE), commits (create / update / delete / move actions), recursive tree
+  #      - AWS Secrets Manager: GetSecretValue and BatchGetSecretValue (JSON protocol, point AWS_ENDPOINT_URL_SECRETS_MANAGER at the stub)
+  #   - Configurable latency and failure injection per service (csp, gitlab, secrets)
+  #   - Counts API calls and bytes transferred per service, and records when the first call arrived
+  # [Usage]
+  #   - stub = StubServer(blueprintCount=50, latencyMs={'gitlab': 40}, failureRate={'gitlab': 0.05}).start()
+  #   - action.cspBaseApiUrl = stub.url ; action.gitBaseUrl = stub.url + "/"
+  #   - stub.stats() / stub.resetStats() / stub.stop()
+  #   - stub.updateBlueprint(blueprintId, name=..., content=...) edits a blueprint and bumps its updatedAt
+  #
+
+
+import base64
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+services = ["csp", "gitlab", "secrets"]
+
+
+def gitBlobSha (contentBytes):   # Git blob sha of the content
+    return hashlib.sha1(b"blob " + str(len(contentBytes)).encode('ascii') + b"\0" + contentBytes).hexdigest()
+    # End Function
+
+
+def stubBearerToken (ttlSeconds=1800):   # JWT shaped bearer token with an exp claim
+    claims = base64.urlsafe_b64encode(json.dumps({'exp': int(time.time()) + ttlSeconds}).encode()).decode().rstrip('=')
+    return "eyJhbGciOiJub25lIn0." + claims + ".stub"
+    # End Function
+
+
+def stubBlueprintContent (blueprintName, blueprintVersion=1, resourceCount=5):   # Cloud Assembly blueprint YAML
+    lines = [
+        "formatVersion: 1",
+        "name: " + blueprintName,
+        "version: " + str(blueprintVersion),
+        "options:",
+        "  gitlabSyncEnable: true",
+        "  gitlabSyncDelete: true",
+        "inputs: {}",
+        "resources:",
+    ]
+    for i in range(resourceCount):
+        lines += [
+            "  Cloud_Machine_" + str(i) + ":",
+            "    type: Cloud.Machine",
+            "    properties:",
+            "      name: machine-" + str(i),
+            "      image: ubuntu",
+            "      flavor: small",
+        ]
+    return "\n".join(lines) + "\n"
+    # End Function
+
+
+class StubState:   # Blueprints, Git files and secrets served by the stub. Shared by all request threads.
+
+    def __init__ (self, blueprintCount, versionsPerBlueprint, secrets):
+        self.lock = threading.Lock()
+        self.blueprints = {}    # id -> {'id', 'name', 'content', 'versions': [...]}
+        for i in range(blueprintCount):
+            blueprintId = "bp-{:04d}".format(i)
+            blueprintName = "Stub Blueprint {:04d}".format(i)
+            self.blueprints[blueprintId] = {
+                'id': blueprintId,
+                'name': blueprintName,
+                'content': stubBlueprintContent(blueprintName, versionsPerBlueprint),
+                'updatedAt': "2020-01-01T00:00:00Z",
+                'versions': [ {
+                    'id': blueprintId + "-v" + str(v),
+                    'blueprintId': blueprintId,
+                    'version': str(v),
+                    'content': stubBlueprintContent(blueprintName, v),
+                    'createdAt': "2020-01-01T00:00:{:02d}Z".format(v % 60),
+                } for v in range(1, versionsPerBlueprint + 1) ],
+            }
+        self.updates = 0    # Blueprint edits made with updateBlueprint
+        self.files = {}    # branch -> {path: {'content': bytes, 'lastCommitId'}}
+        self.commits = []
+        self.secrets = dict(secrets)
+        self.tokens = set()
+    # End Function
+
+
+class StubHttpServer (ThreadingHTTPServer):   # Threading HTTP server with a listen backlog for bursts of concurrent invocations
+    request_queue_size = 128    # The default of 5 resets connections when a burst connects at once
+
+
+class StubServer:   # Runs the stub on a local port
+
+    def __init__ (self, blueprintCount=20, versionsPerBlueprint=3, latencyMs=None, failureRate=None, failureStatus=503, secrets=None):
+        self.state = StubState(blueprintCount, versionsPerBlueprint, secrets or {})
+        self.latencyMs = dict(latencyMs or {})
+        self.failureRate = dict(failureRate or {})
+        self.failureStatus = failureStatus
+        self.random = random.Random(1050)
+        self.resetStats()
+        self.httpServer = StubHttpServer(("127.0.0.1", 0), StubRequestHandler)
+        self.httpServer.stub = self
+        self.url = "http://127.0.0.1:" + str(self.httpServer.server_address[1])
+    # End Function
+
+    def start (self):
+        threading.Thread(target=self.httpServer.serve_forever, daemon=True).start()
+        return self
+    # End Function
+
+    def stop (self):
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+    # End Function
+
+    def updateBlueprint (self, blueprintId, name=None, content=None):   # Edits a blueprint as Assembly would, bumping updatedAt. None leaves a field as is.
+        state = self.state
+        with state.lock:
+            blueprint = state.blueprints[blueprintId]
+            blueprint['name'] = blueprint['name'] if (name is None) else name
+            blueprint['content'] = blueprint['content'] if (content is None) else content
+            state.updates += 1
+            blueprint['updatedAt'] = "2021-01-01T00:00:00.{:06d}Z".format(state.updates)
+    # End Function
+
+    def resetStats (self):
+        self.statsLock = threading.Lock()
+        self.counters = { service: {'calls': 0, 'bytesIn': 0, 'bytesOut': 0, 'failures': 0} for service in services }
+        self.firstCallTime = None    # time.time() when the first request arrived
+    # End Function
+
+    def stats (self):   # Returns a copy of the per service counters
+        with self.statsLock:
+            return json.loads(json.dumps(self.counters))
+    # End Function
+
+    def record (self, service, bytesIn, bytesOut, failed):
+        with self.statsLock:
+            self.counters[service]['calls'] += 1
+            self.counters[service]['bytesIn'] += bytesIn
+            self.counters[service]['bytesOut'] += bytesOut
+            self.counters[service]['failures'] += 1 if failed else 0
+    # End Function
+
+    def injectFailure (self, service):   # True when this call should fail
+        with self.statsLock:
+            return self.random.random() < self.failureRate.get(service, 0.0)
+    # End Function
+
+
+class StubRequestHandler (BaseHTTPRequestHandler):   # Routes requests to the emulated service
+    protocol_version = "HTTP/1.1"    # Keep-alive, like the real services
+
+    def setup (self):
+        BaseHTTPRequestHandler.setup(self)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)    # No Nagle delay between headers and body
+
+    def log_message (self, *args):
+        pass
+
+    def do_GET (self):
+        self.dispatch("GET")
+
+    def do_HEAD (self):
+        self.dispatch("HEAD")
+
+    def do_POST (self):
+        self.dispatch("POST")
+
+    def do_PUT (self):
+        self.dispatch("PUT")
+
+    def do_DELETE (self):
+        self.dispatch("DELETE")
+
+    def dispatch (self, method):
+        stub = self.server.stub
+        if (stub.firstCallTime is None):
+            stub.firstCallTime = time.time()
+        requestBody = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        urlParts = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(urlParts.query))
+        if ('X-Amz-Target' in self.headers):
+            service = "secrets"
+        elif urlParts.path.startswith("/api/v4/"):
+            service = "gitlab"
+        else:
+            service = "csp"
+
+        time.sleep(stub.latencyMs.get(service, 0) / 1000.0)
+        failed = stub.injectFailure(service)
+        if failed:
+            status, headers, body = stub.failureStatus, {}, {'message': "Injected failure"}
+        else:
+            try:
+                route = { "csp": self.routeCsp, "gitlab": self.routeGitlab, "secrets": self.routeSecrets }[service]
+                status, headers, body = route(method, urlParts.path, query, requestBody)
+            except Exception as e:
+                status, headers, body = 500, {}, {'message': "Stub error: " + repr(e)}
+
+        responseBody = b"" if (body is None) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', "application/x-amz-json-1.1" if (service == "secrets") else "application/json")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(responseBody)))
+        self.end_headers()
+        if (method != "HEAD"):
+            self.wfile.write(responseBody)
+        requestBytes = len(self.requestline) + sum(len(k) + len(v) + 4 for k, v in self.headers.items()) + len(requestBody)
+        stub.record(service, requestBytes, len(responseBody) if (method != "HEAD") else 0, failed or (status >= 500))
+    # End Function
+
+
+    # ----- CSP ----- #
+
+    def routeCsp (self, method, path, query, requestBody):
+        state = self.server.stub.state
+        if ((method == "POST") and (path == "/iaas/api/login")):
+            token = stubBearerToken()
+            with state.lock:
+                state.tokens.add(token)
+            return 200, {}, {'tokenType': "Bearer", 'token': token}
+        # End Loop
+
+        authorization = self.headers.get('Authorization', "")
+        if (authorization.replace("Bearer ", "") not in state.tokens):
+            return 401, {}, {'message': "Unauthorized"}
+        pathParts = [ part for part in path.split("/") if part ][3:]    # after /blueprint/api/blueprints
+        if (not path.startswith("/blueprint/api/blueprints")):
+            return 404, {}, {'message': "Not found"}
+
+        top, skip = int(query.get('$top', 20)), int(query.get('$skip', 0))
+        if (len(pathParts) == 0):
+            blueprints = [ {'id': b['id'], 'name': b['name'], 'updatedAt': b['updatedAt']} for b in state.blueprints.values() ]
+            return 200, {}, self.page(blueprints, top, skip)
+        blueprint = state.blueprints.get(pathParts[0])
+        if (blueprint is None):
+            return 404, {}, {'message': "Blueprint not found"}
+        if (len(pathParts) == 1):
+            blueprintJson = {'id': blueprint['id'], 'name': blueprint['name'], 'content': blueprint['content'], 'status': "RELEASED", 'updatedAt': blueprint['updatedAt']}
+            etag = '"' + gitBlobSha(json.dumps(blueprintJson, sort_keys=True).encode()) + '"'
+            if (self.headers.get('If-None-Match') == etag):
+                return 304, {'ETag': etag}, None
+            return 200, {'ETag': etag}, blueprintJson
+        if ((len(pathParts) == 2) and (pathParts[1] == "versions")):
+            versions = blueprint['versions'] if (query.get('$orderby', "").endswith("asc")) else list(reversed(blueprint['versions']))
+            return 200, {}, self.page(versions, top, skip)
+        if ((len(pathParts) == 3) and (pathParts[1] == "versions")):
+            for version in blueprint['versions']:
+                if (version['version'] == pathParts[2]):
+                    return 200, {}, version
+            return 404, {}, {'message': "Version not found"}
+        return 404, {}, {'message': "Not found"}
+    # End Function
+
+    def page (self, items, top, skip):
+        pageItems = items[skip:skip + top]
+        return {'content': pageItems, 'totalElements': len(items), 'numberOfElements': len(pageItems)}
+    # End Function
+
+
+    # ----- GitLab ----- #
+
+    def routeGitlab (self, method, path, query, requestBody):
+        state = self.server.stub.state
+        pathParts = path[len("/api/v4/"):].split("/")
+        if ((len(pathParts) < 2) or (pathParts[0] != "projects")):
+            return 404, {}, {'message': "404 Not Found"}
+        projectId = urllib.parse.unquote(pathParts[1])
+        if (len(pathParts) == 2):
+            return 200, {}, {'id': int(projectId) if projectId.isdigit() else 1, 'path_with_namespace': "stub/" + projectId, 'default_branch': "master"}
+
+        requestJson = json.loads(requestBody or b"{}")
+        ref = query.get('ref') or query.get('branch') or requestJson.get('branch') or "master"
+        with state.lock:
+            branchFiles = state.files.setdefault(ref, {})
+            if ((pathParts[2:4] == ["repository", "files"]) and (len(pathParts) >= 5)):
+                filePath = urllib.parse.unquote("/".join(pathParts[4:]))
+                gitFile = branchFiles.get(filePath)
+                if (method == "DELETE"):
+                    if (gitFile is None):
+                        return 400, {}, {'message': "A file with this name doesn't exist"}
+                    del branchFiles[filePath]
+                    self.commit(requestJson.get('commit_message', ""), ref)
+                    return 204, {}, None
+                if (gitFile is None):
+                    return 404, {}, {'message': "404 File Not Found"}
+                fileHeaders = {
+                    'X-Gitlab-Blob-Id': gitBlobSha(gitFile['content']),
+                    'X-Gitlab-Commit-Id': gitFile['lastCommitId'],
+                    'X-Gitlab-Last-Commit-Id': gitFile['lastCommitId'],
+                    'X-Gitlab-Content-Sha256': hashlib.sha256(gitFile['content']).hexdigest(),
+                    'X-Gitlab-File-Path': filePath,
+                    'X-Gitlab-Ref': ref,
+                    'X-Gitlab-Size': str(len(gitFile['content'])),
+                }
+                if (method == "HEAD"):
+                    return 200, fileHeaders, None
+                return 200, {}, {
+                    'file_name': filePath.split("/")[-1],
+                    'file_path': filePath,
+                    'size': len(gitFile['content']),
+                    'encoding': "base64",
+                    'content': base64.b64encode(gitFile['content']).decode(),
+                    'content_sha256': fileHeaders['X-Gitlab-Content-Sha256'],
+                    'ref': ref,
+                    'blob_id': fileHeaders['X-Gitlab-Blob-Id'],
+                    'commit_id': gitFile['lastCommitId'],
+                    'last_commit_id': gitFile['lastCommitId'],
+                }
+            if ((pathParts[2:4] == ["repository", "tree"]) and (method == "GET")):
+                folder = (query.get('path') or "").rstrip("/")
+                treeItems = [ {
+                    'id': gitBlobSha(gitFile['content']),
+                    'name': filePath.split("/")[-1],
+                    'type': "blob",
+                    'path': filePath,
+                    'mode': "100644",
+                } for filePath, gitFile in sorted(branchFiles.items()) if ((folder == "") or filePath.startswith(folder + "/")) ]
+                return 200, {}, treeItems
+            if ((pathParts[2:4] == ["repository", "commits"]) and (method == "POST")):
+                return self.commitActions(branchFiles, requestJson, ref)
+        # End Loop
+        return 404, {}, {'message': "404 Not Found"}
+    # End Function
+
+    def commitActions (self, branchFiles, requestJson, ref):   # Applies commit actions atomically. Caller holds the state lock.
+        stagedFiles = dict(branchFiles)
+        for action in requestJson.get('actions', []):
+            filePath = action['file_path']
+            content = action.get('content')
+            if ((content is not None) and (action.get('encoding') == "base64")):
+                content = base64.b64decode(content)
+            elif (content is not None):
+                content = content.encode()
+            lastCommitId = action.get('last_commit_id')
+            if (action['action'] == "create"):
+                if (filePath in stagedFiles):
+                    return 400, {}, {'message': "A file with this name already exists"}
+                stagedFiles[filePath] = {'content': content or b"", 'lastCommitId': None}
+            elif (action['action'] in ["update", "delete"]):
+                if (filePath not in stagedFiles):
+                    return 400, {}, {'message': "A file with this name doesn't exist"}
+                if ((lastCommitId is not None) and (lastCommitId != stagedFiles[filePath]['lastCommitId'])):
+                    return 400, {}, {'message': "You are attempting to update a file that has changed since you started editing it."}
+                if (action['action'] == "update"):
+                    stagedFiles[filePath] = {'content': content or b"", 'lastCommitId': None}
+                else:
+                    del stagedFiles[filePath]
+            elif (action['action'] == "move"):
+                previousPath = action['previous_path']
+                if (previousPath not in stagedFiles):
+                    return 400, {}, {'message': "A file with this name doesn't exist"}
+                if ((filePath in stagedFiles) and (filePath != previousPath)):
+                    return 400, {}, {'message': "A file with this name already exists"}
+                movedFile = stagedFiles.pop(previousPath)
+                stagedFiles[filePath] = {'content': movedFile['content'] if (content is None) else content, 'lastCommitId': None}
+            else:
+                return 400, {}, {'message': "Unknown action " + action['action']}
+        # End Loop
+
+        commitId = self.commit(requestJson.get('commit_message', ""), ref)
+        for action in requestJson.get('actions', []):
+            if (action['file_path'] in stagedFiles):
+                stagedFiles[action['file_path']]['lastCommitId'] = commitId
+        branchFiles.clear()
+        branchFiles.update(stagedFiles)
+        return 201, {}, {'id': commitId, 'short_id': commitId[:8], 'title': requestJson.get('commit_message', "")}
+    # End Function
+
+    def commit (self, commitMessage, ref):   # Records a commit. Caller holds the state lock.
+        state = self.server.stub.state
+        commitId = hashlib.sha1((str(len(state.commits)) + commitMessage + ref).encode()).hexdigest()
+        state.commits.append({'id': commitId, 'message': commitMessage, 'ref': ref})
+        return commitId
+    # End Function
+
+
+    # ----- AWS Secrets Manager ----- #
+
+    def routeSecrets (self, method, path, query, requestBody):
+        state = self.server.stub.state
+        target = self.headers['X-Amz-Target'].split(".")[-1]
+        requestJson = json.loads(requestBody or b"{}")
+        if (target == "GetSecretValue"):
+            secretId = requestJson['SecretId']
+            if (secretId not in state.secrets):
+                return 400, {}, {'__type': "ResourceNotFoundException", 'Message': "Secrets Manager can't find the specified secret."}
+            return 200, {}, self.secretValue(secretId)
+        if (target == "BatchGetSecretValue"):
+            secretIds = requestJson.get('SecretIdList', [])
+            return 200, {}, {
+                'SecretValues': [ self.secretValue(secretId) for secretId in secretIds if (secretId in state.secrets) ],
+                'Errors': [ {'SecretId': secretId, 'ErrorCode': "ResourceNotFoundException"} for secretId in secretIds if (secretId not in state.secrets) ],
+            }
+        return 400, {}, {'__type': "InvalidAction", 'Message': target}
+    # End Function
+
+    def secretValue (self, secretId):
+        return {
+            'ARN': "arn:aws:secretsmanager:us-west-2:000000000000:secret:" + secretId,
+            'Name': secretId,
+            'SecretString': self.server.stub.state.secrets[secretId],
+            'VersionId': "stub",
+            'CreatedDate': time.time(),
+        }
+    # End Function
@@ -0,0 +1,149 @@
+#--------------------------------------------------------#
+#                     Spas Kaloferov                     #
+#                   www.kaloferov.com                    #
+#--------------------------------------------------------#
+
+  #
+  # [Description]
+  #   - Throughput benchmark of blueprintRewrite on multi-MB synthetic blueprints.
+  #   - Compares blueprintRewrite with the former split / while loop / join rewrite.
+  #   - Checks blueprintRewrite correctness first (nested name: keys, multi-line values, CRLF, extra fields, blueprintExtraFieldsIn parsing) and exits on failure.
+  # [Usage]
+  #   - python benchmarks/benchBlueprintRewrite.py [--sizes 1,4,16] [--iterations 5] [--check]
+  #      - --sizes: blueprint sizes in MB
+  #      - --check: run the correctness checks only. Takes under a second. Run it before committing changes to blueprintRewrite or the action inputs.
+  #
+
+
+import argparse
+import sys
+import timeit
+
+from abxAction import loadAction
+
+
+def legacyRewrite (blueprint, blueprintVersion, blueprintName):   # version / name override as myActionFunction did it before blueprintRewrite
+    str_list = blueprint.split('\n')
+    length = len(str_list)
+    i = 0
+    while ((blueprintVersion is not None) and (i < length)):
+        if ("version: " in str_list[i]):
+            str_list[i] = "version: " + blueprintVersion + "    # Value overridden by ABX Action"
+            break
+        else:
+            i += 1
+    # End Loop
+    i = 0
+    while i < length:
+        if ("name: " in str_list[i]):
+            str_list[i] = "name: " + blueprintName + "    # Value overridden by ABX Action"
+            break
+        else:
+            i += 1
+    # End Loop
+    return "\n".join(str_list)
+    # End Function
+
+
+def syntheticBlueprint (sizeBytes):   # Blueprint of about sizeBytes. Inputs and resources with nested name: keys come before the top-level name / version.
+    header = "formatVersion: 1\ninputs:\n  name:\n    type: string\n    title: \"name: of the machine\"\n"
+    resources = []
+    resourcesSize = 0
+    i = 0
+    while (resourcesSize < sizeBytes):
+        resource = (
+            "  Cloud_Machine_"+str(i)+":\n"
+            "    type: Cloud.Machine\n"
+            "    properties:\n"
+            "      name: machine-"+str(i)+"\n"
+            "      image: ubuntu\n"
+            "      flavor: small\n"
+            "      tags:\n"
+            "        - key: version\n"
+            "          value: \"version: "+str(i)+"\"\n"
+        )
+        resources.append(resource)
+        resourcesSize += len(resource)
+        i += 1
+    # End Loop
+    return header + "resources:\n" + "".join(resources) + "name: Synthetic Blueprint\nversion: 0.1\ndescription: >\n  Multi-line\n  description\n"
+    # End Function
+
+
+def checkRewrite (action):   # Correctness checks. Returns a list of failures.
+    yaml = action.lazyImport("yaml")
+    failures = []
+    def check (label, condition):
+        if (not condition):
+            failures.append(label)
+    # End Function
+
+    blueprint = syntheticBlueprint(4096)
+    rewritten = action.blueprintRewrite(blueprint, "2.0", "Renamed", {'syncedBy': "ABX", 'syncEpoch': 3})
+    parsed = yaml.safe_load(rewritten)
+    check("top-level name overridden", parsed['name'] == "Renamed")
+    check("top-level version overridden", str(parsed['version']) == "2.0")
+    check("nested input name: untouched", parsed['inputs']['name']['title'] == "name: of the machine")
+    check("nested resource name: untouched", parsed['resources']['Cloud_Machine_0']['properties']['name'] == "machine-0")
+    check("nested version: untouched", parsed['resources']['Cloud_Machine_0']['properties']['tags'][0]['value'] == "version: 0")
+    check("extra fields added", (parsed.get('syncedBy') == "ABX") and (parsed.get('syncEpoch') == 3))
+    check("other fields kept", (parsed['formatVersion'] == 1) and (parsed['description'] == "Multi-line description\n"))
+    check("idempotent", action.blueprintRewrite(rewritten, "2.0", "Renamed", {'syncedBy': "ABX", 'syncEpoch': 3}) == rewritten)
+    check("None version leaves version", str(yaml.safe_load(action.blueprintRewrite(blueprint, None, "Renamed"))['version']) == "0.1")
+
+    multiLine = "formatVersion: 1\nname: >\n  Folded\n\n  name\nversion: 1\nresources: {}\n"
+    parsed = yaml.safe_load(action.blueprintRewrite(multiLine, "3", "Plain"))
+    check("multi-line name replaced", (parsed['name'] == "Plain") and (str(parsed['version']) == "3") and (parsed['resources'] == {}))
+
+    crlf = "formatVersion: 1\r\nname: Old\r\nversion: 1\r\nresources:\r\n  VM:\r\n    name: vm\r\n"
+    rewrittenCrlf = action.blueprintRewrite(crlf, "2", "New", {'syncedBy': "ABX"})
+    check("CRLF line breaks kept", (rewrittenCrlf.count("\r\n") == crlf.count("\r\n") + 1) and ("\n" not in rewrittenCrlf.replace("\r\n", "")))
+    check("CRLF values replaced", yaml.safe_load(rewrittenCrlf)['name'] == "New")
+
+    noFields = "---\nformatVersion: 1\nresources: {}\n"
+    parsed = yaml.safe_load(action.blueprintRewrite(noFields, "1", "Added", {'syncedBy': "ABX"}))
+    check("extra fields added without top-level name", (parsed.get('syncedBy') == "ABX") and (parsed['resources'] == {}))
+
+    def extraFields (inputValue):   # blueprintExtraFields as the entrypoints read them, or the error raised
+        try:
+            return action.actionInputsRead({'blueprintExtraFieldsIn': inputValue, 'actionOptionUseAwsSecretsManagerIn': "False", 'awsSmCspTokenSecretIdIn': "", 'awsSmGitTokenSecretIdIn': "", 'awsSmRegionNameIn': "", 'cspRefreshTokenIn': "token", 'gitPrivateTokenIn': "token"}, {})['blueprintExtraFields']
+        except ValueError as e:
+            return e
+    # End Function
+    check("extra fields input with empty values kept", extraFields('{"syncedBy": "", "note": "empty"}') == {'syncedBy': "", 'note': "empty"})
+    check("extra fields input placeholder ignored", (extraFields("<Optional>") == {}) and (extraFields("") == {}))
+    check("extra fields input invalid JSON rejected", isinstance(extraFields('{"syncedBy": '), ValueError))
+    check("extra fields input list ignored", extraFields('["syncedBy"]') == {})
+    return failures
+    # End Function
+
+
+def main ():
+    parser = argparse.ArgumentParser(description="Throughput benchmark of blueprintRewrite")
+    parser.add_argument('--sizes', default="1,4,16")
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+
+    action = loadAction()
+    failures = checkRewrite(action)
+    if (len(failures) > 0):
+        print("blueprintRewrite check FAILED: " + ", ".join(failures))
+        sys.exit(1)
+    print("blueprintRewrite checks passed")
+    if (args.check):
+        return
+
+    for sizeMb in [ float(size) for size in args.sizes.split(",") ]:
+        blueprint = syntheticBlueprint(int(sizeMb * 1024 * 1024))
+        print("{:.1f} MB blueprint, {} lines".format(len(blueprint) / 1048576, blueprint.count("\n")))
+        print("  legacy overrides top-level name: " + str("\nname: Synthetic Blueprint\n" not in legacyRewrite(blueprint, "2.0", "Renamed")))
+        for label, function in [("legacy split / join", lambda: legacyRewrite(blueprint, "2.0", "Renamed")), ("blueprintRewrite", lambda: action.blueprintRewrite(blueprint, "2.0", "Renamed"))]:
+            seconds = min(timeit.repeat(function, number=1, repeat=args.iterations))
+            print("  {:<22} {:>9.2f} ms  {:>8.1f} MB/s".format(label, seconds * 1000, len(blueprint) / 1048576 / seconds))
+    # End Loop
+    # End Function
+
+
+if __name__ == "__main__":
+    main()
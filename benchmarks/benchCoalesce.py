@@ -0,0 +1,125 @@
+#--------------------------------------------------------#
+#                     Spas Kaloferov                     #
+#                   www.kaloferov.com                    #
+#--------------------------------------------------------#
+
+  #
+  # [Description]
+  #   - Burst benchmark of event coalescing. Fires bursts of CREATE_BLUEPRINT_VERSION events (several versions per blueprint, a few ms apart) at handler, with and without actionOptionCoalesceIn.
+  #   - Every event runs on its own thread with its own action module, like concurrent ABX invocations in separate containers. With coalescing they share one file spool, as containers mounting the same file system (e.g. EFS) would.
+  #      - The spool is in the temp folder, which the action refuses as container-local. storageLocalFolders is cleared, as here all "containers" are one process.
+  #      - Results only hold for a spool on shared storage. With a container-local spool the action syncs without coalescing.
+  #   - Reports GitLab commits and calls, failed events, and lost updates (blueprints whose manifest entry is not the latest version).
+  # [Usage]
+  #   - python benchmarks/benchCoalesce.py [--blueprints 5] [--versions 5] [--spacing 100] [--window 1] [--latency gitlab=40]
+  #      - --spacing: ms between the versions of a blueprint
+  #      - --window: coalescing window in seconds
+  #
+
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+from abxAction import loadAction, actionInputs
+from abxStubs import StubServer, services
+from benchHandler import parseServiceValues, payloadsDir
+
+
+def runBurst (args, coalesce):   # Runs one burst against a fresh stub. Returns the burst results.
+    stub = StubServer(blueprintCount=args.blueprints, versionsPerBlueprint=args.versions, latencyMs=parseServiceValues(args.latency, float)).start()
+    with open(os.path.join(payloadsDir, "createBlueprintVersion.json")) as payloadFile:
+        payload = json.load(payloadFile)
+    spoolDir = tempfile.mkdtemp(prefix="abx-bench-spool-")
+    inputOverrides = {
+        'actionOptionCoalesceIn': str(coalesce),
+        'coalesceWindowSecondsIn': str(args.window),
+        'coalesceSpoolPathIn': os.path.join(spoolDir, "spool.json"),
+    }
+    errors = []
+    statuses = {}
+    resultsLock = threading.Lock()
+
+    def runEvent (blueprint, blueprintVersion):
+        action = loadAction()
+        action.storageLocalFolders = []    # The temp folder stands in for shared storage
+        action.cspBaseApiUrl = stub.url
+        action.gitBaseUrl = stub.url + "/"
+        event = copy.deepcopy(payload)
+        event.update({'blueprintId': blueprint['id'], 'blueprintName': blueprint['name'], 'version': str(blueprintVersion)})
+        event.update(actionInputs(**inputOverrides))
+        try:
+            outputs = action.handler(None, event)
+            status = outputs['resp_myActionFunction']['gitSyncStatus']
+        except Exception as e:
+            status = "error"
+            with resultsLock:
+                errors.append(type(e).__name__ + ": " + str(e)[:80])
+        with resultsLock:
+            statuses[status] = statuses.get(status, 0) + 1
+    # End Function
+
+    blueprints = list(stub.state.blueprints.values())
+    threads = []
+    tStart = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):    # Once for all threads. sys.stdout is process wide.
+        for blueprintVersion in range(1, args.versions + 1):
+            for blueprint in blueprints:
+                thread = threading.Thread(target=runEvent, args=(blueprint, blueprintVersion))
+                thread.start()
+                threads.append(thread)
+            time.sleep(args.spacing / 1000)
+        # End Loop
+        for thread in threads:
+            thread.join()
+    # End Loop
+    elapsedSeconds = time.perf_counter() - tStart
+
+    stats = stub.stats()
+    gitFiles = stub.state.files.get("master", {})
+    manifestRecords = { blueprint['id']: json.loads(gitFiles[recordPath]['content']) for blueprint in blueprints for recordPath in ["blueprints/.abx-sync/" + blueprint['id'] + ".json"] if (recordPath in gitFiles) }
+    lostUpdates = [ blueprint['id'] for blueprint in blueprints if ((manifestRecords.get(blueprint['id']) or {}).get('blueprint', {}).get('version') != str(args.versions)) ]
+    stub.stop()
+    return {
+        'seconds': elapsedSeconds,
+        'commits': len(stub.state.commits),
+        'calls': { service: stats[service]['calls'] for service in services },
+        'statuses': statuses,
+        'errors': errors,
+        'lostUpdates': lostUpdates,
+    }
+    # End Function
+
+
+def main ():
+    parser = argparse.ArgumentParser(description="Burst benchmark of event coalescing")
+    parser.add_argument('--blueprints', type=int, default=5)
+    parser.add_argument('--versions', type=int, default=5, help="versions per blueprint in the burst")
+    parser.add_argument('--spacing', type=float, default=100)
+    parser.add_argument('--window', type=float, default=1)
+    parser.add_argument('--latency', default="gitlab=40")
+    args = parser.parse_args()
+
+    print("coalesce benchmark: "+str(args.blueprints)+" blueprints x "+str(args.versions)+" versions, "+str(args.spacing)+" ms apart, window "+str(args.window)+"s, latency ms "+json.dumps(parseServiceValues(args.latency, float)))
+    for coalesce in [False, True]:
+        result = runBurst(args, coalesce)
+        print("coalescing " + ("on" if coalesce else "off"))
+        print("  burst seconds:      {:.2f}".format(result['seconds']))
+        print("  GitLab commits:     " + str(result['commits']))
+        print("  API calls:          " + "  ".join("{} {}".format(service, result['calls'][service]) for service in services))
+        print("  gitSyncStatus:      " + json.dumps(result['statuses'], sort_keys=True))
+        print("  lost updates:       " + str(len(result['lostUpdates'])) + " " + json.dumps(result['lostUpdates']))
+        if (len(result['errors']) > 0):
+            print("  errors:             " + str(len(result['errors'])) + " (" + "; ".join(sorted(set(result['errors']))[:3]) + ")")
+    # End Loop
+    # End Function
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#--------------------------------------------------------#
+#                     Spas Kaloferov                     #
+#                   www.kaloferov.com                    #
+#--------------------------------------------------------#
+
+  #
+  # [Description] 
+  #   - Cold-start benchmark of the ABX action module. Every run is a fresh interpreter.
+  #   - Reports module import time, max RSS, time-to-first-API-call and which heavy dependencies got loaded.
+  #   - API calls go to the local stubs in abxStubs.py. Nothing leaves the machine.
+  # [Scenarios]
+  #   - skipped: event skipped by runOnProperty. Expected to make no API call and load no heavy dependency.
+  #   - sync: TEST event using action inputs. First API call is the CSP login.
+  # [Usage]
+  #   - python benchmarks/benchColdStart.py [--runs 10]
+  #
+
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from abxStubs import StubServer
+
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+heavyModules = ["yaml", "boto3", "requests", "gitlab"]
+
+childScript = """
+import json, resource, sys, time
+t0 = time.time()
+sys.path.insert(0, {benchDir!r})
+from abxAction import loadAction, actionInputs
+action = loadAction()
+tImport = time.time()
+rssImportKb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+action.cspBaseApiUrl = {stubUrl!r}
+action.gitBaseUrl = {stubUrl!r} + "/"
+error = ""
+try:
+    action.handler(None, actionInputs(**{inputs!r}))
+except Exception as e:
+    error = type(e).__name__
+tEnd = time.time()
+print(json.dumps({{
+    "t0": t0,
+    "importMs": (tImport - t0) * 1000,
+    "handlerMs": (tEnd - tImport) * 1000,
+    "rssImportKb": rssImportKb,
+    "rssEndKb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modulesLoaded": [ m for m in {heavyModules!r} if m in sys.modules ],
+    "error": error,
+}}))
+"""
+
+scenarios = {
+    'skipped': {
+        'actionOptionRunOnPropertyIn': "True",
+        'runOnPropertyIn': "env: prod",
+        'eventType': "CREATE_BLUEPRINT_VERSION",
+        'blueprintId': "bench-blueprint",
+        'version': "1",
+        'blueprintName': "Bench",
+        '__metadata': {'eventTopicId': "blueprint.version.configuration", 'userName': "bench"},
+        'customProperties': {'env': "dev"},
+    },
+    'sync': {
+        'actionOptionAcceptPayloadInputIn': "False",
+        'blueprintIdABXIn': "bp-0000",
+        'blueprintNameABXIn': "Stub Blueprint 0000",
+        'blueprintVersionABXIn': "1",
+    },
+}
+
+
+def runOnce (scenario, stub):   # Runs one scenario in a fresh interpreter. Returns its measurements.
+    stub.resetStats()
+    script = childScript.format(benchDir=benchDir, stubUrl=stub.url, inputs=scenarios[scenario], heavyModules=heavyModules)
+    completed = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['firstApiCallMs'] = ((stub.firstCallTime - result['t0']) * 1000) if (stub.firstCallTime is not None) else None
+    return result
+    # End Function  
+
+
+def main ():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark of the ABX action module")
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    
+    stub = StubServer().start()
+    
+    for scenario in scenarios:
+        results = [ runOnce(scenario, stub) for run in range(args.runs) ]
+        firstApiCalls = [ result['firstApiCallMs'] for result in results if (result['firstApiCallMs'] is not None) ]
+        print(scenario+" ("+str(args.runs)+" runs)")
+        print("  import time (ms):         median {:.1f}  max {:.1f}".format(statistics.median(r['importMs'] for r in results), max(r['importMs'] for r in results)))
+        print("  max RSS after import (MB): {:.1f}".format(statistics.median(r['rssImportKb'] for r in results) / 1024))
+        print("  max RSS after run (MB):    {:.1f}".format(statistics.median(r['rssEndKb'] for r in results) / 1024))
+        print("  handler time (ms):        median {:.1f}".format(statistics.median(r['handlerMs'] for r in results)))
+        if (len(firstApiCalls) > 0):
+            print("  time to first API call (ms): median {:.1f}".format(statistics.median(firstApiCalls)))
+        else:
+            print("  time to first API call (ms): no API call")
+        print("  heavy modules loaded:     "+(", ".join(results[-1]['modulesLoaded']) or "none"))
+        if (results[-1]['error'] != ""):
+            print("  handler raised:           "+results[-1]['error'])
+    # End Loop
+    stub.stop()
+    # End Function  
+
+
+if __name__ == "__main__":
+    main()
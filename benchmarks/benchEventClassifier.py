@@ -0,0 +1,81 @@
+#--------------------------------------------------------#
+#                     Spas Kaloferov                     #
+#                   www.kaloferov.com                    #
+#--------------------------------------------------------#
+
+  #
+  # [Description] 
+  #   - Micro-benchmark of the event classifier on large synthetic payloads.
+  #   - Compares eventClassify with the former str(inputs).count(...) scanning.
+  # [Usage]
+  #   - python benchmarks/benchEventClassifier.py [--properties 5000] [--iterations 200]
+  #
+
+
+import argparse
+import timeit
+
+from abxAction import loadAction
+
+
+def legacyClassify (inputs):   # eventType / eventTopicId detection as handler did it before eventClassify
+    if (str(inputs).count('CREATE_BLUEPRINT_VERSION') == 1):
+        eventType = "CREATE_BLUEPRINT_VERSION"
+    elif (str(inputs).count('DELETE_BLUEPRINT') == 1):
+        eventType = "DELETE_BLUEPRINT"
+    elif (str(inputs).count("eventType") == 0):
+        eventType = "TEST"
+    else:
+        eventType = "UNSUPPORTED"
+    if (str(inputs).count('blueprint.version.configuration') == 1):
+        eventTopicId = "blueprint.version.configuration"
+    elif (str(inputs).count("blueprint.configuration") == 1):
+        eventTopicId = "blueprint.configuration"
+    elif (str(inputs).count("eventTopicId") == 0):
+        eventTopicId = "TEST"
+    else:
+        eventTopicId = "UNSUPPORTED"
+    return eventType, eventTopicId
+    # End Function  
+
+
+def syntheticPayload (eventType, propertyCount):   # Event payload with propertyCount custom properties
+    inputs = {
+        'eventType': eventType,
+        'blueprintId': "3f0c6d1e-7c4b-4bb3-a2b9-0d3b1e0c9f11",
+        'id': "3f0c6d1e-7c4b-4bb3-a2b9-0d3b1e0c9f11",
+        'version': "1.0.0",
+        'blueprintName': "Benchmark Blueprint",
+        'name': "Benchmark Blueprint",
+        'description': "Mentions DELETE_BLUEPRINT in free text",
+        '__metadata': {
+            'eventTopicId': "blueprint.version.configuration" if (eventType == "CREATE_BLUEPRINT_VERSION") else "blueprint.configuration",
+            'userName': "bench@example.com",
+        },
+        'customProperties': { "property"+str(i): "value-"+str(i)*4 for i in range(propertyCount) },
+    }
+    return inputs
+    # End Function  
+
+
+def main ():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--properties', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+    
+    action = loadAction()
+    for eventType in ["CREATE_BLUEPRINT_VERSION", "DELETE_BLUEPRINT"]:
+        inputs = syntheticPayload(eventType, args.properties)
+        print(eventType+" payload, "+str(args.properties)+" custom properties, "+str(len(str(inputs)))+" bytes")
+        print("  legacy str(inputs) scan: "+str(legacyClassify(inputs)))
+        print("  eventClassify:           "+str(action.eventClassify(inputs)))
+        for label, function in [("legacy str(inputs) scan", legacyClassify), ("eventClassify", action.eventClassify)]:
+            seconds = timeit.timeit(lambda: function(inputs), number=args.iterations)
+            print("  {:<24} {:>12.3f} us/event".format(label, seconds / args.iterations * 1e6))
+    # End Loop
+    # End Function  
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#--------------------------------------------------------#
+#                     Spas Kaloferov                     #
+#                   www.kaloferov.com                    #
+#--------------------------------------------------------#
+
+  #
+  # [Description]
+  #   - Offline benchmark of handler. Replays the recorded payloads in benchmarks/payloads through handler against the local stubs in abxStubs.py.
+  #   - Reports p50 / p99 latency, API calls per event, bytes transferred per event and time per phase (from the action metrics output), per event type.
+  # [Usage]
+  #   - python benchmarks/benchHandler.py [--events 50] [--blueprints 20] [--latency csp=20,gitlab=40,secrets=10] [--failure gitlab=0.05] [--secrets aws] [--cold] [--write-behind]
+  #      - --latency: added latency per service in ms
+  #      - --failure: share of calls per service that fail with --failure-status (default 503)
+  #      - --secrets aws: get the tokens from the Secrets Manager stub instead of action inputs
+  #      - --cold: load a fresh action module for every event (no warm caches)
+  #      - --write-behind: journal the Git writes (actionOptionWriteBehindIn) and drain the journal with drainHandler after the events
+  #
+
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import math
+import os
+import statistics
+import tempfile
+import time
+
+from abxAction import loadAction, actionInputs
+from abxStubs import StubServer, services
+
+
+payloadsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+
+
+def parseServiceValues (value, valueType):   # Parses "csp=20,gitlab=40" into {'csp': 20, 'gitlab': 40}
+    serviceValues = {}
+    for term in [ term for term in (value or "").split(",") if term ]:
+        service, serviceValue = term.split("=")
+        serviceValues[service.strip()] = valueType(serviceValue)
+    return serviceValues
+    # End Function
+
+
+def loadPayloads ():   # Returns {eventType: payload} of the recorded payloads
+    payloads = {}
+    for fileName in sorted(os.listdir(payloadsDir)):
+        with open(os.path.join(payloadsDir, fileName)) as payloadFile:
+            payload = json.load(payloadFile)
+        payloads[payload['eventType']] = payload
+    return payloads
+    # End Function
+
+
+def eventFor (payload, blueprint):   # Points a recorded payload at a stub blueprint
+    event = copy.deepcopy(payload)
+    if (event['eventType'] == "CREATE_BLUEPRINT_VERSION"):
+        event['blueprintId'] = blueprint['id']
+        event['blueprintName'] = blueprint['name']
+    else:
+        event['id'] = blueprint['id']
+        event['name'] = blueprint['name']
+    return event
+    # End Function
+
+
+def percentile (values, share):
+    orderedValues = sorted(values)
+    return orderedValues[max(0, int(math.ceil(share * len(orderedValues))) - 1)]
+    # End Function
+
+
+def main ():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the ABX action handler")
+    parser.add_argument('--events', type=int, default=50, help="events per event type")
+    parser.add_argument('--blueprints', type=int, default=20)
+    parser.add_argument('--latency', default="")
+    parser.add_argument('--failure', default="")
+    parser.add_argument('--failure-status', type=int, default=503)
+    parser.add_argument('--secrets', choices=["inputs", "aws"], default="inputs")
+    parser.add_argument('--cold', action="store_true")
+    parser.add_argument('--write-behind', action="store_true")
+    parser.add_argument('--verbose', action="store_true", help="show the action output")
+    args = parser.parse_args()
+
+    stubSecrets = {'bench-csp-token': json.dumps({'bench-csp-token': "bench-refresh-token"}), 'bench-git-token': json.dumps({'bench-git-token': "bench-git-token"})}
+    stub = StubServer(blueprintCount=args.blueprints, latencyMs=parseServiceValues(args.latency, float), failureRate=parseServiceValues(args.failure, float), failureStatus=args.failure_status, secrets=stubSecrets).start()
+    inputOverrides = {}
+    if (args.secrets == "aws"):
+        os.environ['AWS_ENDPOINT_URL_SECRETS_MANAGER'] = stub.url
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', "bench")
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', "bench")
+        inputOverrides = {
+            'actionOptionUseAwsSecretsManagerIn': "True",
+            'awsSmRegionNameIn': "us-west-2",
+            'awsSmCspTokenSecretIdIn': "bench-csp-token",
+            'awsSmGitTokenSecretIdIn': "bench-git-token",
+        }
+    if (args.write_behind):
+        inputOverrides['actionOptionWriteBehindIn'] = "True"
+        inputOverrides['writeBehindJournalPathIn'] = os.path.join(tempfile.mkdtemp(prefix="abx-bench-journal-"), "journal.jsonl")
+
+    payloads = loadPayloads()
+    blueprints = list(stub.state.blueprints.values())
+    results = { eventType: [] for eventType in payloads }
+    action = None
+    for n in range(args.events):
+        for eventType in ["CREATE_BLUEPRINT_VERSION", "DELETE_BLUEPRINT"]:
+            if ((action is None) or args.cold):
+                action = loadAction()
+                action.storageLocalFolders = []    # The temp folder journal stands in for shared storage
+                action.cspBaseApiUrl = stub.url
+                action.gitBaseUrl = stub.url + "/"
+            event = eventFor(payloads[eventType], blueprints[n % len(blueprints)])
+            event.update(actionInputs(**inputOverrides))
+            statsBefore = stub.stats()
+            error = ""
+            tStart = time.perf_counter()
+            try:
+                with (contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())):
+                    outputs = action.handler(None, event)
+            except Exception as e:
+                error = type(e).__name__
+                outputs = {}
+            elapsedMs = (time.perf_counter() - tStart) * 1000
+            statsAfter = stub.stats()
+            results[eventType].append({
+                'ms': elapsedMs,
+                'error': error,
+                'status': (outputs.get('resp_myActionFunction') or {}).get('gitSyncStatus', "") if isinstance(outputs.get('resp_myActionFunction'), dict) else "",
+                'calls': { service: statsAfter[service]['calls'] - statsBefore[service]['calls'] for service in services },
+                'phasesMs': (outputs.get('metrics') or {}).get('phasesMs', {}),
+                'bytes': sum((statsAfter[service]['bytesIn'] + statsAfter[service]['bytesOut']) - (statsBefore[service]['bytesIn'] + statsBefore[service]['bytesOut']) for service in services),
+            })
+    # End Loop
+    if (args.write_behind):
+        tStart = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            drainOutputs = action.drainHandler(None, actionInputs(**inputOverrides))
+        drainMs = (time.perf_counter() - tStart) * 1000
+    stub.stop()
+
+    print("handler benchmark: "+str(args.events)+" events per type, "+("cold" if args.cold else "warm")+" module, secrets from "+args.secrets+(", write-behind" if args.write_behind else ""))
+    print("  latency ms "+json.dumps(stub.latencyMs)+", failure rate "+json.dumps(stub.failureRate))
+    for eventType, eventResults in results.items():
+        latencies = [ result['ms'] for result in eventResults ]
+        errors = [ result['error'] for result in eventResults if result['error'] ]
+        statuses = {}
+        for result in eventResults:
+            statuses[result['status'] or "-"] = statuses.get(result['status'] or "-", 0) + 1
+        print(eventType)
+        print("  latency ms:         p50 {:.1f}  p99 {:.1f}  mean {:.1f}".format(percentile(latencies, 0.50), percentile(latencies, 0.99), statistics.mean(latencies)))
+        print("  API calls / event:  " + "  ".join("{} {:.2f}".format(service, statistics.mean(result['calls'][service] for result in eventResults)) for service in services))
+        print("  bytes / event:      {:.0f}".format(statistics.mean(result['bytes'] for result in eventResults)))
+        print("  gitSyncStatus:      " + json.dumps(statuses))
+        phaseNames = sorted(set(phaseName for result in eventResults for phaseName in result['phasesMs']))
+        print("  phase ms / event:   " + "  ".join("{} {:.1f}".format(phaseName, statistics.mean(result['phasesMs'].get(phaseName, 0.0) for result in eventResults)) for phaseName in phaseNames))
+        if (len(errors) > 0):
+            print("  errors:             " + str(len(errors)) + " (" + ", ".join(sorted(set(errors))) + ")")
+    # End Loop
+    if (args.write_behind):
+        print("drainHandler")
+        print("  drain ms:           {:.1f}".format(drainMs))
+        print("  drain result:       " + json.dumps({ key: value for key, value in drainOutputs['resp_drainHandler'].items() if (key != "errors") }, sort_keys=True))
+    # End Function
+
+
+if __name__ == "__main__":
+    main()
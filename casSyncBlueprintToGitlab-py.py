@@ -14,8 +14,68 @@
   #      - Syncs when blueprints are versioned or deleted.
   #      - Upon Assembly deletion blueprint can be deleted in Git or preserved by setting blueprint option bluepirnt option blueprintOptionGitDelete
   #      - All blueprints can be synchronized or only selected once by setting blueprint option gitlabSyncEnable
-  #      - Renaming a blueprint in Assembly creates a new blueprint in Git 
+  #      - Renaming a blueprint in Assembly renames (moves) the blueprint in Git 
   #   - Allows secrets and passwords to be provided via action inputs or AWS Secrets Manager secrets  
+  #   - CSP bearer token is cached across warm invocations and refreshed before it expires or when the API returns 401
+  #   - HTTP connections and GitLab project handles are pooled and reused across warm invocations
+  #   - CSP and GitLab calls share a deadline-aware transport:
+  #      - Every call gets a timeout out of the time left before the action timeout (180s)
+  #      - Idempotent calls are retried on connection errors, timeouts and 502 / 503 / 504, and all calls on 429, with jittered backoff within a per invocation retry budget
+  #      - Retry-After and GitLab RateLimit-* headers are honored
+  #      - A per host circuit breaker fails fast during outages
+  #   - Blueprint files are created or updated with a single commit. File existence is checked with a HEAD request.
+  #   - A sync manifest (one record per blueprint, .abx-sync/<blueprintId>.json in gitProjectFolder) maps blueprint ids to path, name, version, content sha and the gitlabSyncDelete / gitlabSyncEnable options
+  #      - Updated in the same commit as each sync. Concurrent syncs of the same blueprint are detected with the record last commit id and retried. Syncs of different blueprints write different records and do not conflict.
+  #      - Deletes are decided from the manifest without downloading the blueprint file. Renamed blueprints are moved instead of creating a new file.
+  #   - Independent calls overlap: the GitLab connect and manifest read run while the CSP login and blueprint fetch are in flight. Delete events skip the CSP login.
+  #      - Not with actionOptionRunOnBlueprintOptionIn=True: the GitLab connect and manifest read wait for the blueprint options, so events skipped by runOnBlueprintOption make no Git call. Matched events pay the connect and manifest read after the blueprint fetch.
+  #   - Blueprints are fetched and parsed once per invocation and revalidated with ETag / If-None-Match across warm invocations
+  #      - Up to 8 MB of blueprints are kept across warm invocations, oldest evicted first. Parsed content is only kept for the current invocation, and bulkHandler and reconcileHandler do not keep it.
+  #   - Outputs include metrics: time per phase (secretFetch, cspLogin, optionsFetch, blueprintFetch, gitConnect, gitManifestRead, gitExistenceCheck, gitWrite, coalesceWait, journalWrite), HTTP calls and bytes (every attempt, retried ones included) and retries. Overlapping phases can add up to more than totalMs.
+  #      - actionOptionMetricsLogIn (Boolean): Also write the metrics as one JSON log line. Default False
+  #   - Blueprint version and name are overridden in the top-level fields only, in a single pass. Nested name: keys (e.g. resource names) are left as is.
+  #      - blueprintExtraFieldsIn (String): JSON object of top-level fields to set or add in synced blueprints e.g. {"syncedBy": "ABX"}. Default none. Invalid JSON fails the action before any API call.
+  #   - Writes are skipped when the blueprint content matches the Git blob sha (reported as gitSyncStatus: unchanged)
+  #   - Full-tenant bulk sync: set the action entrypoint to bulkHandler to sync all blueprints in one (chunked) multi-file commit
+  #      - bulkMaxWorkersIn (Integer): Concurrent blueprint fetches. Default 8
+  #      - bulkCommitChunkSizeIn (Integer): Max files per commit. Default 100
+  #   - Drift reconciliation: set the action entrypoint to reconcileHandler and run it periodically to repair missed or failed events
+  #      - Git files and blob shas come from one recursive tree listing. Blueprint blob shas are computed locally.
+  #      - Only blueprints updated in Assembly since their manifest entry, or whose file changed in Git, are fetched
+  #      - Only creates, updates, moves and deletes are committed, in batched multi-file commits. Blueprints removed from Assembly are deleted if their manifest entry has gitlabSyncDelete set. Deletes are only planned when the blueprint listing read every page and its count matches totalElements (outputs blueprintsDeleteCheck).
+  #      - Takes the same inputs as bulkHandler
+  #   - Event coalescing: bursts of version events of the same blueprint are written once, with the latest version
+  #      - actionOptionCoalesceIn (Boolean): Spool CREATE_BLUEPRINT_VERSION events by blueprint id and flush the due events of all blueprints in one commit. Default False
+  #      - coalesceWindowSecondsIn (Float): Each event waits this long for newer events of the same blueprint. Bursts are held back for at most 10s. Default 2
+  #      - coalesceBackendIn (String): Spool backend. file (default, JSON file locked with flock) or memory (in-process stand-in for single process runs and benchmarks. ABX invocations never share it.)
+  #      - coalesceSpoolPathIn (String): Spool file of the file backend. Required: a path on storage mounted by every container of the action (e.g. EFS). Default none
+  #         - Each event waits in its own invocation, which holds its container, so the events of a burst run in separate containers. A spool in the temp folder is never shared and would only add latency.
+  #         - Events are synced without coalescing (and without waiting) if coalesceSpoolPathIn is not set or is in the temp folder
+  #      - Superseded events return gitSyncStatus: coalesced. Failed flushes are put back in the spool.
+  #   - Write-behind: events complete without waiting for GitLab. Git writes are journaled and replayed by drainHandler.
+  #      - actionOptionWriteBehindIn (Boolean): Fetch and rewrite the blueprint, append the Git write to the journal (fsynced) and return gitSyncStatus: journaled. No Git call is made. Default False
+  #      - writeBehindJournalPathIn (String): Append-only journal (one JSON record per line). Required: a path on storage mounted by the handler and drainHandler actions (e.g. EFS). Default none
+  #         - drainHandler runs in other containers, so a journal in the temp folder would never reach Git. Events are written to Git synchronously if writeBehindJournalPathIn is not set or is in the temp folder. drainHandler raises an error in both cases.
+  #      - Set the action entrypoint to drainHandler and run it periodically. It replays the journal in order, in batched commits, and retries until GitLab accepts them or the action times out.
+  #         - drainBatchSizeIn (Integer): Max journal records per commit. Records of a blueprint with the same op in a row are collapsed to the last one. A sync followed by a delete is replayed as two commits. Default 50
+  #         - The replayed offset is kept in a cursor file next to the journal. Replays are idempotent: records already in Git are unchanged and make no commit.
+  #         - A record that fails 5 times with an error a retry can not fix (e.g. 403 or a deleted project), or is malformed (e.g. missing fields), is moved to the rejected journal (.rejected next to the journal), so it does not block later records. Malformed records are moved at once. Outages are retried until GitLab is back.
+  #         - Each rejected line holds the record (record), the error (rejectedError) and rejectedAt. Append the record to the journal to replay it again.
+  #         - Takes the secrets inputs and writeBehindJournalPathIn. Git project and folder come from the journal records.
+  #      - actionOptionCoalesceIn is not used with write-behind. drainHandler coalesces.
+  #   - Version history backfill: set the action entrypoint to backfillHandler to commit the existing version history of blueprints to Git
+  #      - Versions are streamed page by page, oldest first, and each version is committed with the version and name overridden as for version events
+  #      - A cursor per blueprint is kept in the sync manifest and committed with each version. A run stops before the action timeout and the next run continues where it stopped. Run it until backfillStatus is complete. Blueprints whose versions can not be read are listed in blueprintsFailed and stay pending.
+  #      - Versions that change nothing make no commit. The blueprint file ends at the latest version.
+  #      - backfillBlueprintIdsIn (String): Comma separated blueprint ids to backfill. Default all blueprints
+  #      - Takes the secrets, Git and blueprintExtraFieldsIn inputs of handler
+  #   - Multi-target fan-out: sync each blueprint version or delete to several GitLab projects, branches or instances
+  #      - gitTargetsIn (String): JSON list of targets, e.g. [{"projectId": 14854581}, {"url": "https://gitlab.example.com/", "projectId": 42, "branch": "audit", "folder": "blueprints/", "token": "..."}]. A missing field defaults to gitBaseUrl, gitProjectIdIn, master, gitProjectFolderIn and gitPrivateTokenIn. Default the gitProjectIdIn target only
+  #      - The blueprint is fetched and rewritten once and pushed to all targets concurrently over pooled clients
+  #      - outputs.resp_myActionFunction.gitTargets has the result per target (failed targets with their error). The action fails only if every target fails. gitFilepath and gitSyncStatus are those of the first target
+  #      - An empty list is the gitProjectIdIn target only. A list holding anything but objects fails the action before any API call.
+  #      - Coalescing, write-behind, bulkHandler, reconcileHandler, drainHandler and backfillHandler use the gitProjectIdIn target
+  #      - A failed target is only reported. Nothing retries it later, as reconcileHandler, drainHandler and coalescing only write the gitProjectIdIn target. Repair it by syncing the blueprint again (e.g. a new version), or with a bulkHandler or reconcileHandler action whose gitProjectIdIn and gitProjectFolderIn are those of the target (gitBaseUrl and master branch targets only).
   #   - Further guidance can be found here: ABX Action to Sync Blueprints from Assembly to Gitlab (http://kaloferov.com/blog/skkb1050)
   # [Inputs]
   #   - gitProjectIdIn (Integer): Git project folder e.g. 14854581     
@@ -33,6 +93,8 @@
   #         - runOnPropertyIn (String): Custom property key/value to match for when actionOptionRunOnPropertyIn=True ( e.g. cloudZoneProp: cas.cloud.zone.type:aws )
   #         - runOnPorpertyMatchABXIn (String): Custom property key/value to match actionOptionRunOnPropertyIn=True and actionOptionAcceptPayloadInputIn=False. For ABX testing. ( e.g. cloudZoneProp: cas.cloud.zone.type:aws )
   #      - False: Do not check for runOn condition
+  #      - runOn rules are key/value terms (key: value) joined with && (and) or || (or). Keys and values support * ? [] wildcards. e.g. cloudZoneProp: *aws* || env: prod
+  #      - runOnProperty is evaluated before secrets retrieval and CSP login. Skipped events make no API calls.
   #   - actionOptionRunOnBlueprintOptionIn (Boolean): RunOn blueprint option condition
   #      - True: Check for runOn condition
   #         - runOnBlueprintOptionIn (String): Blueprint property key/value to match for when actionOptionRunOnBlueprintOptionIn=True (e.g. gitlabSyncEnable: true)
@@ -43,11 +105,15 @@
   #         - awsSmRegionNameIn (String): AWS Secrets Manager Region Name e.g. us-west-2
   #         - awsSmCspTokenSecretIdIn (String): AWS Secrets Manager CSP Token Secret ID
   #         - awsSmGitTokenSecretIdIn (String): AWS Secrets Manager Git Token Secret ID
+  #         - secretsProviderIn (String): Secrets provider. aws (default), file (JSON file in ABX_SECRETS_FILE) or memory. file and memory are for offline runs.
+  #         - Secrets are cached for 15 minutes across warm invocations. Both secrets are fetched with one BatchGetSecretValue call.
+  #         - JSON secrets are read from the key named after the secret id, or from their only key
   #      - False: Use action inputs for secrets
   #         - cspRefreshTokenIn (String): CSP Token
   #         - gitPrivateTokenIn (String): Git Token
   # [Dependency]
   #   - Requires: requests,pyyaml,boto3,requests,python-gitlab 
+  #   - Dependencies are imported on first use. boto3 is only loaded when AWS Secrets Manager is used, and runs skipped by runOnProperty load none of them.
   # [Subscription]
   #   - Event Topics:
   #      - blueprint.configuration: Subscribe here for blueprint configuration events like create / delete. > Only delete enabled
@@ -65,20 +131,103 @@
 
 
 import json
-import yaml 
 import logging
-import boto3
-import requests
-import gitlab
-import urllib3
-#import base64
+import time
+import base64
+import hashlib
+import threading
+import concurrent.futures
+import uuid
+import re
+import fnmatch
+import itertools
+import os
+import importlib
+import contextlib
+import random
+import email.utils
+import tempfile
+# yaml, boto3, requests, gitlab and urllib3 are imported on first use with lazyImport. Skipped runs never load them.
 
 
 # ----- Global ----- #  
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)   # Warned when making an unverified HTTPS request.
-urllib3.disable_warnings(urllib3.exceptions.DependencyWarning)   # Warned when an attempt is made to import a module with missing optional dependencies. 
+lazyModules = {}    # Heavy dependencies imported on first use
+invocationMetrics = {}    # Phase timings and HTTP counters of the current invocation. Reset by metricsStart.
+invocationMetricsLock = threading.Lock()
 cspBaseApiUrl = "https://api.mgmt.cloud.vmware.com"    # CSP portal base url
+cspTokenCache = {}    # CSP bearer tokens keyed by refresh token hash. Module scope so it survives warm invocations.
+cspTokenSafetyMarginSeconds = 300    # Bearer tokens are refreshed this long before they expire
+cspTokenDefaultTtlSeconds = 1800    # Bearer token lifetime assumed when the expiry can not be read from the token
+gitBaseUrl = "https://gitlab.com/"   # Git URL
+gitDefaultBranch = "master"    # Git branch blueprints are synced to
+gitCommitChunkSize = 100    # Max file actions per commit for multi-file commits
+bulkMaxWorkers = 8    # Concurrent blueprint fetches in bulkHandler
+bulkCommitChunkSize = gitCommitChunkSize    # Max file actions per commit in bulkHandler
+blueprintCache = {}    # Blueprint JSON, ETag and response size per blueprint id. Module scope so it survives warm invocations.
+blueprintCacheMaxBytes = 8 * 1024 * 1024    # Response bytes kept by blueprintCache. Oldest blueprints are evicted beyond this.
+blueprintCacheSize = {'bytes': 0}    # Response bytes held by blueprintCache
+blueprintCacheLock = threading.Lock()
+blueprintYamlCache = {'invocationId': None, 'yaml': {}}    # Parsed blueprint content per blueprint id, of the current invocation only. Parsed trees are several times the size of the text.
+secretCache = {}    # Secrets per (provider, region, secret id). Module scope so it survives warm invocations.
+secretCacheTtlSeconds = 900    # Secrets are fetched again after this
+secretProviders = {}    # Secrets providers. Populated with secretRegisterProvider.
+memorySecrets = {}    # Secrets for the memory provider. Used for offline runs and benchmarks.
+awsSmClients = {}    # Secrets Manager clients per region
+blueprintFieldPatterns = {}    # Compiled blueprintRewrite patterns per field key tuple
+runOnRuleCache = {}    # Compiled runOn rules per rule string. Module scope so rules are compiled once per container.
+eventHandlers = {}    # Supported event types. eventType -> {'eventTopicId', 'payload'}. Populated with eventRegisterHandler.
+gitManifestFolder = ".abx-sync/"    # Sync manifest folder in gitProjectFolder. One record per blueprint (<blueprintId>.json) with its entry (path, name, version, contentSha, gitlabSyncDelete, gitlabSyncEnable) and backfill cursor
+gitManifestCache = {}    # Manifest record blob sha, last commit id and content per (project, branch, record path). Module scope so it survives warm invocations.
+gitManifestMaxAgeSeconds = 5    # A manifest record revalidated this recently is reused without a HEAD request for the first commit attempt
+gitManifestCommitAttempts = 3    # Commits are retried on fresh manifest records when another sync of the same blueprint changed them first
+gitCommitMessages = {    # Commit message per sync status
+    'created': 'Created by {userName}',
+    'updated': 'Updated by www.kaloferov.com',
+    'moved': 'Renamed by {userName}',
+    'deleted': 'Deleted by {userName}',
+    'coalesced': 'Synced by {userName}',
+    'drained': 'Synced by {userName}',
+    'backfilled': 'Backfilled version {version} ({createdAt}) by {userName}',
+    'backfillCursor': 'Backfill cursor saved by {userName}',
+}
+coalesceWindowSeconds = 2    # Version events of a blueprint within this window are coalesced into one write of the latest version
+coalesceMaxDelaySeconds = 10    # Max time an event stays spooled while newer events of the same blueprint keep arriving
+coalesceBatchSize = 20    # Max blueprints flushed in one commit
+coalesceBatchAheadShare = 0.25    # Events due within this share of the window are flushed with the due ones, so bursts on several blueprints share a commit
+coalesceSpoolPath = ""    # Spool of the file backend. No default: it must be on storage shared by all containers of the action.
+storageLocalFolders = [tempfile.gettempdir()]    # Container-local folders. Spool and journal paths in them are refused, as other containers can not read them.
+journalPath = ""    # Write-behind journal. Append-only, one JSON record per line. The cursor is kept next to it in .cursor. No default: it must be on storage shared with the drainHandler action.
+journalDrainBatchSize = 50    # Max journal records replayed in one commit
+journalReplayAttempts = 5    # Failed replays (errors a retry can not fix) of a batch before its records are replayed one by one, and of a record before it is moved to the rejected journal
+backfillPageSize = 20    # Blueprint versions per page. Only one page is held in memory.
+backfillStopSeconds = 30    # backfillHandler stops this long before the deadline and saves its cursor
+spoolBackends = {}    # Coalescing spool backends. Populated with spoolRegisterBackend.
+memorySpool = {}    # Spool of the memory backend. Used for single process runs and benchmarks.
+memorySpoolLock = threading.Lock()
+httpPoolConnections = 8    # Number of host connection pools kept by the shared HTTP session. CSP plus every GitLab instance of gitTargetsIn.
+httpPoolMaxSize = 16    # Keep-alive connections kept per host
+clientRegistry = {    # Pooled HTTP session and GitLab clients. Module scope so they survive warm invocations.
+    'httpSession': None,
+    'gitlabProjects': {},
+    'gitlabProjectLocks': {},    # One lock per GitLab project handle, so slow connects do not hold up other projects
+}
+clientRegistryLock = threading.Lock()
+actionTimeoutSeconds = 180    # Invocation deadline. Keep in line with timeoutSeconds in casSyncBlueprintToGitlab-py.abx
+actionDeadlineMarginSeconds = 5    # Kept back from the deadline to return the outputs
+httpConnectTimeoutSeconds = 5    # Max connect timeout per HTTP call
+httpReadTimeoutSeconds = 30    # Max read timeout per HTTP call. Both are clamped to the time left before the deadline.
+httpRetryAttempts = 4    # Attempts per HTTP call, including the first
+httpRetryBudget = 20    # Retries per invocation across all HTTP calls. Keeps bursts from turning into retry storms.
+httpRetryBackoffSeconds = 0.5    # Base of the jittered exponential backoff
+httpRetryBackoffMaxSeconds = 8    # Max backoff before jitter
+httpRetryStatuses = [429, 502, 503, 504]    # Retried for idempotent methods. 429 is retried for all methods.
+httpIdempotentMethods = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"]
+httpCircuitFailureThreshold = 5    # Consecutive failures (connection errors, timeouts, 5xx) that open a host circuit
+httpCircuitOpenSeconds = 30    # Open circuits fail fast for this long, then let one trial call through
+invocationDeadline = {'deadline': None, 'retriesLeft': httpRetryBudget}    # Set per invocation by deadlineStart
+httpHosts = {}    # Circuit breaker and rate limit state per host. Module scope so outages are remembered across warm invocations.
+httpTransportLock = threading.Lock()
 
 
 # ----- Functions  ----- # 
@@ -86,6 +235,8 @@ cspBaseApiUrl = "https://api.mgmt.cloud.vmware.com"    # CSP portal base url
 def handler(context, inputs):   # Action entry function.
 
     fn = "handler -"    # Funciton name 
+    metricsStart()    # Call function
+    deadlineStart()    # Call function
     print("[ABX] "+fn+" Action started.")
     print("[ABX] "+fn+" Function started.")
     
@@ -121,27 +272,8 @@ def handler(context, inputs):   # Action entry function.
     userName = ""   # Username of who triggered the action
 
 
-    # eventType 
-    if (str(inputs).count('CREATE_BLUEPRINT_VERSION') == 1):
-        eventType = "CREATE_BLUEPRINT_VERSION"
-    elif (str(inputs).count('DELETE_BLUEPRINT') == 1):
-        eventType = "DELETE_BLUEPRINT"
-    elif (str(inputs).count("eventType") == 0):
-        eventType = "TEST"
-    else:
-        eventType = "UNSUPPORTED"
-    # End Loop
-    
-    # eventTopicId 
-    if (str(inputs).count('blueprint.version.configuration') == 1):
-        eventTopicId = "blueprint.version.configuration"
-    elif (str(inputs).count("blueprint.configuration") == 1):
-        eventTopicId = "blueprint.configuration"
-    elif (str(inputs).count("eventTopicId") == 0):
-        eventTopicId = "TEST"
-    else:
-        eventTopicId = "UNSUPPORTED"
-    # End Loop
+    # eventType / eventTopicId
+    eventType, eventTopicId = eventClassify(inputs)    # Call function
     
 
     # actionInputs Hashtable
@@ -153,12 +285,21 @@ def handler(context, inputs):   # Action entry function.
     actionInputs['awsSmCspTokenSecretId'] = awsSmCspTokenSecretId 
     actionInputs['awsSmGitTokenSecretId'] = awsSmGitTokenSecretId 
     actionInputs['awsSmRegionName'] = awsSmRegionName 
+    actionInputs['secretsProvider'] = inputs.get('secretsProviderIn', "aws")
+    actionInputs['actionOptionMetricsLog'] = inputs.get('actionOptionMetricsLogIn', "False").lower()
+    actionInputs['actionOptionCoalesce'] = inputs.get('actionOptionCoalesceIn', "False").lower()
+    actionInputs['coalesceWindowSeconds'] = inputs.get('coalesceWindowSecondsIn', "")
+    actionInputs['coalesceBackend'] = inputs.get('coalesceBackendIn', "")
+    actionInputs['coalesceSpoolPath'] = inputs.get('coalesceSpoolPathIn', "")
+    actionInputs['actionOptionWriteBehind'] = inputs.get('actionOptionWriteBehindIn', "False").lower()
+    actionInputs['writeBehindJournalPath'] = inputs.get('writeBehindJournalPathIn', "")
     actionInputs['runOnProperty'] = runOnProperty 
     actionInputs['runOnBlueprintOption'] = runOnBlueprintOption
     actionInputs['cspRefreshToken'] = cspRefreshToken
     actionInputs['gitPrivateToken'] = gitPrivateToken
     actionInputs['eventType'] = eventType
     actionInputs['eventTopicId'] = eventTopicId
+    actionInputs['invocationId'] = uuid.uuid4().hex    # Scopes the blueprint cache to this invocation
     actionInputs['gitProjectFolder'] = gitProjectFolder
     actionInputs['gitProjectId'] = gitProjectId
     actionInputs['blueprintVersion'] = blueprintVersion
@@ -166,114 +307,54 @@ def handler(context, inputs):   # Action entry function.
     actionInputs['userName'] = userName
 
 
-    # ----- AWS Secrets Manager  ----- #     
-    
-    # Get AWS Secrets Manager Secrets
-    if (actionInputs['actionOptionUseAwsSecretsManager'] == "true"):
-        print("[ABX] "+fn+" Auth/Secrets source: AWS Secrets Manager")
-        awsRegionName = awsSmRegionName
-        awsSecretId_csp = awsSmCspTokenSecretId
-        awsSecretId_git = awsSmGitTokenSecretId
-        awsSecrets = awsSessionManagerGetSecret (context, inputs, awsSecretId_csp, awsSecretId_git, awsRegionName)  # Call function
-        cspRefreshToken = awsSecrets['awsSecret_csp']
-        gitPrivateToken = awsSecrets['awsSecret_git']
-        actionInputs['cspRefreshToken'] = cspRefreshToken
-        actionInputs['gitPrivateToken'] = gitPrivateToken
-    else:
-        # use action inputs
-        print("[ABX] "+fn+" Auth/Secrets source: Action Inputs")
-
-
-    # ----- CSP Token  ----- #     
-    
-    # Get Token
-    getRefreshToken_apiUrl = cspBaseApiUrl + "/iaas/api/login"  # Set API URL
-    body = {    # Set call body
-        "refreshToken": actionInputs['cspRefreshToken']
-    }
-    print("[ABX] "+fn+" Getting CSP Bearer Token.")
-    getRefreshToken_postCall = requests.post(url = getRefreshToken_apiUrl, data=json.dumps(body))   # Call 
-    getRefreshToken_responseJson = json.loads(getRefreshToken_postCall.text)    # Get call response
-    bearerToken = getRefreshToken_responseJson["token"]   # Set response
-    requestsHeaders= {
-        'Accept':'application/json',
-        'Content-Type':'application/json',
-        'Authorization': 'Bearer {}'.format(bearerToken),
-        # 'encoding': 'utf-8'
-    }
-    
-    actionInputs['cspBearerToken'] = bearerToken
-    actionInputs['cspRequestsHeaders'] = requestsHeaders
-    
-    
-    
-    # replace any emptry , optional, "" or '' inputs with empty value 
-    for key, value in actionInputs.items(): 
-        if (("Optional".lower() in str(value).lower()) or ("empty".lower() in str(value).lower()) or ('""' in str(value).lower())  or ("''" in str(value).lower())):
-            actionInputs[key] = ""
-        else:
-            print('')
+    actionInputsRead(inputs, actionInputs)    # Call function. Replaces empty values and parses blueprintExtraFieldsIn.
+    actionInputs['coalesceWindowSeconds'] = float(actionInputs['coalesceWindowSeconds'] or coalesceWindowSeconds)
+    actionInputs['coalesceBackend'] = actionInputs['coalesceBackend'] or "file"
+    actionInputs['coalesceSpoolPath'] = actionInputs['coalesceSpoolPath'] or coalesceSpoolPath
+    actionInputs['writeBehindJournalPath'] = actionInputs['writeBehindJournalPath'] or journalPath
+    if ((actionInputs['actionOptionWriteBehind'] == "true") and (storagePathShared(actionInputs['writeBehindJournalPath']) == False)):    # drainHandler runs in other containers and would never see a container-local journal
+        print("[ABX] "+fn+" writeBehindJournalPathIn is not set or is not on storage shared with drainHandler. Writing to Git synchronously.")
+        actionInputs['actionOptionWriteBehind'] = "false"
     # End Loop
+    if ((actionInputs['actionOptionCoalesce'] == "true") and (actionInputs['coalesceBackend'] == "file") and (storagePathShared(actionInputs['coalesceSpoolPath']) == False)):    # A container-local spool never sees the other events of a burst
+        print("[ABX] "+fn+" coalesceSpoolPathIn is not set or is not on storage shared by the action containers. Syncing without coalescing.")
+        actionInputs['actionOptionCoalesce'] = "false"
+    # End Loop
+    actionInputs['gitTargets'] = gitTargetsParse(actionInputs, actionInputsJson(inputs, 'gitTargetsIn', list))    # Git targets synced concurrently
     
 
     if (actionInputs['actionOptionAcceptPayloadInput'] == 'true'):     # Loop. If Payload exists and Accept Payload input action option is set to True , accept payload inputs . Else except action inputs.
         print("[ABX] "+fn+" Using PAYLOAD inputs based on actionOptionAcceptPayloadInputIn action option")
         
         # blueprintId / blueprintVersion / blueprintName / userName
-        if (inputs['eventType'] == "CREATE_BLUEPRINT_VERSION"):
-            blueprintId = inputs['blueprintId']
-            blueprintVersion = inputs['version']
-            blueprintName = inputs['blueprintName']
-            userName = inputs['__metadata']['userName']
-        elif (inputs['eventType'] == "TEST"):
-            # use action inputs
-            print('')
-        else:  # (inputs['eventType'] == "DELETE_BLUEPRINT")
-            blueprintId = inputs['id']    
-            blueprintVersion = ""
-            blueprintName = inputs['name']
-            userName = inputs['__metadata']['userName']
+        if (actionInputs['eventType'] in eventHandlers):
+            eventPayload = eventHandlers[actionInputs['eventType']]['payload'](inputs)    # Call function. Empty for TEST events, which use action inputs.
+            blueprintId = eventPayload.get('blueprintId', blueprintId)
+            blueprintVersion = eventPayload.get('blueprintVersion', blueprintVersion)
+            blueprintName = eventPayload.get('blueprintName', blueprintName)
+            userName = eventPayload.get('userName', userName)
+        else:
+            print("[ABX] "+fn+" UNSUPPORTED eventType. Using action inputs.")
         # End Loop
         
-
-        # runOn Condition Inputs
-        if (actionInputs['eventTopicId'] != "TEST"):
-            
-            # runOnPorpertyMatch
-            if (actionInputs['actionOptionRunOnProperty'] == "true"):    # Loop. Get property to match against. 
-                runOnPorpertyMatch = (json.dumps(inputs)).replace('"','').lower()
-            else:
-                print('')
-                # Get value from action inputs
-            # End Loop
-    
-            # runOnBlueprintOptionMatch
-            if (actionInputs['actionOptionRunOnBlueprintOption'] == "true"):    # Loop. Get property to match against. 
-                print("[ABX] "+fn+" Using BLUEPRINT for blueprintOptions based on actionOptionRunOnBlueprintOptionIn action option")
-                print("[ABX] "+fn+" Getting blueprintOptions...")
-                body = {}
-                resp_blueprintOptions_callUrl = cspBaseApiUrl + '/blueprint/api/blueprints/'+blueprintId+'?$select=*&apiVersion=2019-09-12'
-                resp_blueprintOptions_call = requests.get(resp_blueprintOptions_callUrl, data=json.dumps(body), verify=False, headers=(actionInputs['cspRequestsHeaders']))
-                #runOnBlueprintOptionMatch = str(json.loads(resp_blueprintOptions_call.text)).lower()
-                runOnBlueprintOptionMatch = json.loads(resp_blueprintOptions_call.text)
-                runOnBlueprintOptionMatch = yaml.safe_load(runOnBlueprintOptionMatch['content'])   # Get the BP Yaml from the Content
-                runOnBlueprintOptionMatch = str(runOnBlueprintOptionMatch['options']).replace("'","").lower()    # Get the options from the BP Yaml
-            else:
-                print('')
-                # Get value from action inputs
-            # End Loop
-            
+        # runOnPorpertyMatch. Matched against the parsed payload.
+        if ((actionInputs['eventTopicId'] != "TEST") and (actionInputs['actionOptionRunOnProperty'] == "true")):
+            runOnPorpertyMatch = inputs
+            actionInputs['runOnPorpertyMatch'] = "payload"
         else:
-            print('')
-            # Get value from action inputs
+            runOnPorpertyMatch = runOnParseMatchString(runOnPorpertyMatch)    # Get value from action inputs
+            actionInputs['runOnPorpertyMatch'] = inputs['runOnPorpertyMatchABXIn']
         # End Loop
 
     elif (actionInputs['actionOptionAcceptPayloadInput'] == 'false'):
         print("[ABX] "+fn+" Using ACTION inputs for ABX action based on actionOptionAcceptPayloadInputIn action option")
         print("[ABX] "+fn+" Using ACTION inputs for blueprintOptions based on actionOptionRunOnBlueprintOptionIn action option")
-        # Get values from action inputs
+        runOnPorpertyMatch = runOnParseMatchString(runOnPorpertyMatch)    # Get value from action inputs
+        actionInputs['runOnPorpertyMatch'] = inputs['runOnPorpertyMatchABXIn']
     else: 
         print("[ABX] "+fn+" INVALID action inputs based on actionOptionAcceptPayloadInputIn action option")
+        runOnPorpertyMatch = runOnParseMatchString(runOnPorpertyMatch)    # Get value from action inputs
+        actionInputs['runOnPorpertyMatch'] = inputs['runOnPorpertyMatchABXIn']
     # End Loop
 
 
@@ -282,57 +363,94 @@ def handler(context, inputs):   # Action entry function.
     actionInputs['blueprintName'] = blueprintName
     actionInputs['userName'] = userName
     
-    actionInputs['runOnPorpertyMatch'] = runOnPorpertyMatch    
-    actionInputs['runOnBlueprintOptionMatch'] = runOnBlueprintOptionMatch
-
-
-    # Print actionInputs
-    for key, value in actionInputs.items(): 
-        if (("cspRefreshToken".lower() in str(key).lower()) or ("cspBearerToken".lower() in str(key).lower()) or ("cspRequestsHeaders".lower() in str(key).lower()) or ("runOnPorpertyMatch".lower() in str(key).lower()) or ("runOnBlueprintOptionMatch".lower() in str(key).lower()) or ("slackToken".lower() in str(key).lower()) or ("gitPrivateToken".lower() in str(key).lower())   ):
-            print("[ABX] "+fn+" actionInputs[] - "+key+": OMITED")
-        else:
-            print("[ABX] "+fn+" actionInputs[] - "+key+": "+str(actionInputs[key]))
-    # End Loop
     
-
     # ----- Evals ----- # 
     
     evals = {}  # Holds evals values
     
-    # runOnProperty eval
-    if ((actionInputs['actionOptionRunOnProperty'] == "true") and (actionInputs['runOnProperty'] in actionInputs['runOnPorpertyMatch'])):   # Loop. RunOn eval.
-        runOnProperty_eval = "true"
-    elif ((actionInputs['actionOptionRunOnProperty'] == "true") and (actionInputs['runOnProperty'] not in actionInputs['runOnPorpertyMatch'])):
-        runOnProperty_eval = "false"
+    # runOnProperty eval. Payload only, so it runs before any secrets retrieval or API call.
+    if (actionInputs['actionOptionRunOnProperty'] == "true"):   # Loop. RunOn eval.
+        runOnProperty_eval = str(runOnEvaluate(actionInputs['runOnProperty'], runOnPorpertyMatch))
     else:
         runOnProperty_eval = "Not Evaluated"
     # End Loop
-
-    # runOnBlueprintOption  eval
-    if ((actionInputs['actionOptionRunOnBlueprintOption'] == 'true') and (actionInputs['runOnBlueprintOption'] in actionInputs['runOnBlueprintOptionMatch'])):     # Loop. RunOn eval.
-        runOnBlueprintOption_eval = "true"
-    elif ((actionInputs['actionOptionRunOnBlueprintOption'] == 'true') and (actionInputs['runOnBlueprintOption'] not in actionInputs['runOnBlueprintOptionMatch'])):  
-        runOnBlueprintOption_eval = "false"
-    else:  
-        runOnBlueprintOption_eval = "Not Evaluated"
-    # End Loop
-
     evals['runOnProperty_eval'] = runOnProperty_eval.lower()
     print("[ABX] "+fn+" runOnProperty_eval: " + evals['runOnProperty_eval'])        
-    evals['runOnBlueprintOption_eval'] = runOnBlueprintOption_eval.lower()
-    print("[ABX] "+fn+" runOnBlueprintOption_eval: " + evals['runOnBlueprintOption_eval'])
-
-
-    # ----- Function Calls  ----- # 
+    evals['runOnBlueprintOption_eval'] = "not evaluated"
     
-    if (evals['runOnProperty_eval'] != 'false' and evals['runOnBlueprintOption_eval'] != 'false'): 
-        print("[ABX] "+fn+" runOnProperty matched or actionOptionRunOnPropertyIn action option disabled.")
-        print("[ABX] "+fn+" runOnBlueprintOption matched or actionOptionRunOnBlueprintOptionIn action option disabled.")
-        print("[ABX] "+fn+" Running myActionFunction...")
-        resp_myActionFunction = myActionFunction (context, inputs, actionInputs, evals)     # Call function
-    else:
-        print("[ABX] "+fn+" runOn condition(s) NOT matched. Skipping action run.")
+    
+    if (actionInputs['eventType'] == "UNSUPPORTED"):
+        print("[ABX] "+fn+" UNSUPPORTED eventType. Skipping action run.")
+        resp_myActionFunction = ""
+    elif (evals['runOnProperty_eval'] == 'false'):
+        print("[ABX] "+fn+" runOnProperty NOT matched. Skipping action run.")
         resp_myActionFunction = ""
+    elif ((actionInputs['actionOptionCoalesce'] == "true") and (actionInputs['actionOptionWriteBehind'] != "true") and (actionInputs['eventType'] == "CREATE_BLUEPRINT_VERSION")):    # Write-behind coalesces in drainHandler
+        print("[ABX] "+fn+" Coalescing version events based on actionOptionCoalesceIn action option. Running coalesceFunction...")
+        resp_myActionFunction = coalesceFunction(context, inputs, actionInputs, evals)    # Call function
+    else:
+        
+        # ----- Secrets / CSP Token / Blueprint / Git  ----- #     
+        
+        # Independent calls overlap. The critical path is secrets > CSP token > blueprint. The Git project and manifest only need the secrets.
+        blueprintNeeded = ((actionInputs['eventType'] == "CREATE_BLUEPRINT_VERSION") or (actionInputs['actionOptionAcceptPayloadInput'] == "false") or ((actionInputs['eventTopicId'] != "TEST") and (actionInputs['actionOptionRunOnBlueprintOption'] == "true")))
+        dagSteps = {
+            'secrets': ([], lambda dagResults: dagStep("secretFetch", actionGetSecrets, context, inputs, actionInputs)),
+        }
+        gitPrefetch = ((actionInputs['actionOptionWriteBehind'] != "true") and (actionInputs['actionOptionRunOnBlueprintOption'] != "true"))    # Write-behind makes no Git call. Events gated by blueprint options connect only once the options matched.
+        for targetIndex, gitTarget in enumerate(actionInputs['gitTargets'] if gitPrefetch else []):
+            dagSteps['gitTarget'+str(targetIndex)] = (['secrets'], lambda dagResults, gitTarget=gitTarget: gitTargetPrefetch(actionInputs, gitTarget))    # Project and manifest are reused by the commit
+        # End Loop
+        if (blueprintNeeded):    # Delete events make no CSP call
+            dagSteps['cspToken'] = (['secrets'], lambda dagResults: dagStep("cspLogin", cspLogin, actionInputs))
+            dagSteps['blueprint'] = (['cspToken'], lambda dagResults: dagStep("blueprintFetch", blueprintGetYaml, actionInputs, blueprintId))    # Fetched and parsed once, cached for myActionFunction
+        # End Loop
+        dagRun(dagSteps)    # Call function
+        
+        
+        # runOnBlueprintOptionMatch. Matched against the parsed blueprint options.
+        if ((actionInputs['actionOptionAcceptPayloadInput'] == 'true') and (actionInputs['eventTopicId'] != "TEST") and (actionInputs['actionOptionRunOnBlueprintOption'] == "true")):
+            print("[ABX] "+fn+" Using BLUEPRINT for blueprintOptions based on actionOptionRunOnBlueprintOptionIn action option")
+            print("[ABX] "+fn+" Getting blueprintOptions...")
+            with metricsSpan("optionsFetch"):
+                runOnBlueprintOptionMatch = blueprintGetYaml(actionInputs, blueprintId).get('options', {})   # Get the options from the BP Yaml. Cached for myActionFunction.
+            actionInputs['runOnBlueprintOptionMatch'] = runOnBlueprintOptionMatch
+        else:
+            actionInputs['runOnBlueprintOptionMatch'] = inputs['runOnBlueprintOptionMatchABXIn']
+            runOnBlueprintOptionMatch = runOnParseMatchString(runOnBlueprintOptionMatch)    # Get value from action inputs
+        # End Loop
+        
+        # runOnBlueprintOption  eval
+        if (actionInputs['actionOptionRunOnBlueprintOption'] == 'true'):     # Loop. RunOn eval.
+            runOnBlueprintOption_eval = str(runOnEvaluate(actionInputs['runOnBlueprintOption'], runOnBlueprintOptionMatch))
+        else:  
+            runOnBlueprintOption_eval = "Not Evaluated"
+        # End Loop
+        evals['runOnBlueprintOption_eval'] = runOnBlueprintOption_eval.lower()
+        print("[ABX] "+fn+" runOnBlueprintOption_eval: " + evals['runOnBlueprintOption_eval'])
+        
+        
+        # Print actionInputs
+        for key, value in actionInputs.items(): 
+            if (("cspRefreshToken".lower() in str(key).lower()) or ("cspBearerToken".lower() in str(key).lower()) or ("cspRequestsHeaders".lower() in str(key).lower()) or ("runOnPorpertyMatch".lower() in str(key).lower()) or ("runOnBlueprintOptionMatch".lower() in str(key).lower()) or ("slackToken".lower() in str(key).lower()) or ("gitPrivateToken".lower() in str(key).lower()) or ("gitTargets".lower() in str(key).lower())   ):
+                print("[ABX] "+fn+" actionInputs[] - "+key+": OMITED")
+            else:
+                print("[ABX] "+fn+" actionInputs[] - "+key+": "+str(actionInputs[key]))
+        # End Loop
+        
+        
+        # ----- Function Calls  ----- # 
+        
+        if (evals['runOnBlueprintOption_eval'] != 'false'): 
+            print("[ABX] "+fn+" runOnProperty matched or actionOptionRunOnPropertyIn action option disabled.")
+            print("[ABX] "+fn+" runOnBlueprintOption matched or actionOptionRunOnBlueprintOptionIn action option disabled.")
+            print("[ABX] "+fn+" Running myActionFunction...")
+            resp_myActionFunction = myActionFunction (context, inputs, actionInputs, evals)     # Call function
+        else:
+            print("[ABX] "+fn+" runOn condition(s) NOT matched. Skipping action run.")
+            resp_myActionFunction = ""
+        # End Loop
+    # End Loop
      
         
     # ----- Outputs ----- #
@@ -344,6 +462,7 @@ def handler(context, inputs):   # Action entry function.
        "actionInputs": actionInputs,
        "resp_handler": resp_handler,
        "resp_myActionFunction": resp_myActionFunction,
+       "metrics": metricsResult(actionInputs),
     }
     print("[ABX] "+fn+" Function return: \n" + json.dumps(resp_handler))    # Write function responce to console  
     print("[ABX] "+fn+" Function completed.")     
@@ -366,175 +485,2446 @@ def myActionFunction (context, inputs, actionInputs, evals):   # Main Function.
     # Get Blueprint
     resp_getBlueprint_json = {}
     if ( (actionInputs['eventType'] == "CREATE_BLUEPRINT_VERSION") or (actionInputs['actionOptionAcceptPayloadInput'] == "false") ):  
-        body = {}
         print("[ABX] "+fn+" Getting Blueprint...")
-        resp_getBlueprint_callUrl = cspBaseApiUrl + '/blueprint/api/blueprints/'+actionInputs['blueprintId']+'?$select=*&apiVersion=2019-09-12'
-        resp_getBlueprint_call = requests.get(resp_getBlueprint_callUrl, data=json.dumps(body), verify=False, headers=(actionInputs['cspRequestsHeaders']) )
-        resp_getBlueprint_json = json.loads(resp_getBlueprint_call.text)
-        #print(resp_getBlueprint_json['content'])
+        with metricsSpan("blueprintFetch"):
+            resp_getBlueprint_json = blueprintGet(actionInputs, actionInputs['blueprintId'])    # Call function. Reuses the blueprint fetched for blueprintOptions.
         blueprint = (resp_getBlueprint_json['content'])
-        #blueprint_yaml = yaml.load(resp_getBlueprint_json['content'])   # Convert blueprint content to yaml
-        
-        # Loop to replace blueprint version value
-        str_list = blueprint.split('\n')
-        length = len(str_list) 
-        i = 0
-        while i < length: 
-            if ("version: " in str_list[i]):
-                str_list[i] = "version: " + actionInputs['blueprintVersion'] + "    # Value overridden by ABX Action"
-                break
-            else:
-                i += 1
-        # End Loop        
-        
-        # Loop to replace blueprint name value
-        i = 0
-        while i < length: 
-            if ("name: " in str_list[i]):
-                str_list[i] = "name: " + actionInputs['blueprintName'] + "    # Value overridden by ABX Action"
-                break
-            else:
-                i += 1
-        # End Loop
         
-        string = "\n".join(str_list)    
-        blueprint = string
+        blueprint = blueprintRewrite(blueprint, actionInputs['blueprintVersion'], actionInputs['blueprintName'], actionInputs['blueprintExtraFields'])    # Call function
     
     else: 
         blueprint = ""  # Used when BP content is not needed. For exmaple for delete events. 
     
+    # Write-behind. The Git write is journaled and replayed by drainHandler.
+    if (actionInputs['actionOptionWriteBehind'] == "true"):
+        print("[ABX] "+fn+" Journaling Git write based on actionOptionWriteBehindIn action option...")
+        with metricsSpan("journalWrite"):
+            gFilepath = journalBlueprint(actionInputs, str(blueprint), resp_getBlueprint_json)    # Call function
+        print("[ABX] "+fn+" Function completed.")   
+        return {"gitFilepath": gFilepath, "gitSyncStatus": "journaled"}
+    # End Loop
+    
+    # Sync to every Git target concurrently. The blueprint is fetched and rewritten once.
+    gitTargetResults = gitSyncTargets(actionInputs, str(blueprint), resp_getBlueprint_json)    # Call function
+
+
+    # ----- Outputs ----- #
+
+    response = {    # Set action outputs
+        # "response": resp_getBlueprint_json
+        "gitFilepath": gitTargetResults[0]['gitFilepath'],    # First target
+        "gitSyncStatus": gitTargetResults[0]['gitSyncStatus'],
+        "gitTargets": gitTargetResults,
+    }
+    #print("[ABX] "+fn+" Function return: \n" + json.dumps(response))    # Write function responce to console  
+    print("[ABX] "+fn+" Function completed.")   
+    
+    return response    # Return response 
+    # End Function    
+
+
+
+def gitSyncTargets (actionInputs, blueprint, blueprintJson):   # Syncs the blueprint (or deletes it) in every Git target concurrently over the pooled clients. Returns one result per target. Raises only if every target failed.
+    fn = "gitSyncTargets -"    # Holds the funciton name. 
+    gitTargets = actionInputs['gitTargets']
+    gitTargetResults = []
+    gitTargetErrors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(gitTargets)) as executor:
+        futures = [ executor.submit(gitSyncTarget, actionInputs, gitTarget, blueprint, blueprintJson) for gitTarget in gitTargets ]
+        for gitTarget, future in zip(gitTargets, futures):
+            gitTargetResult = {'url': gitTarget['url'], 'projectId': gitTarget['projectId'], 'branch': gitTarget['branch'], 'folder': gitTarget['folder']}
+            try:
+                gitTargetResult.update(future.result())
+            except Exception as e:
+                print("[ABX] "+fn+" Git - Target "+gitTarget['url']+" project "+gitTarget['projectId']+" branch "+gitTarget['branch']+" failed: "+str(e)+". Not retried later. Sync the blueprint again to repair it.")
+                gitTargetResult.update({'gitFilepath': gitBlueprintFilepath(gitTarget['folder'], actionInputs['blueprintName']), 'gitSyncStatus': "failed", 'error': type(e).__name__+": "+str(e)})
+                gitTargetErrors.append(e)
+            gitTargetResults.append(gitTargetResult)
+        # End Loop
+    # End Loop
+    if (len(gitTargetErrors) == len(gitTargets)):
+        raise gitTargetErrors[0]
+    
+    return gitTargetResults
+    # End Function  
+
+
+
+def gitSyncTarget (actionInputs, gitTarget, blueprint, resp_getBlueprint_json):   # Syncs the blueprint (or deletes it) in one Git target. Returns gitFilepath and gitSyncStatus.
+    fn = "gitSyncTarget -"    # Holds the funciton name. 
+    
+    
+    # ----- Script ----- #
+    
     # Connect to Git
-    gtUrl = "https://gitlab.com/"   # Git URL
-    gPrivateToken = str(actionInputs['gitPrivateToken'])   # Git private token
-    gl = gitlab.Gitlab(gtUrl, private_token=gPrivateToken, api_version=4)   # Auth to Gitlab
-    gProjectId = actionInputs['gitProjectId']   # Git project ID 
-    gPproject = gl.projects.get(gProjectId)    # Get project
-    gFolder = actionInputs['gitProjectFolder']    # Root repo folder
-    gFilename = "/blueprint.yaml"    # Blueprint name
-    gBlueprintName = actionInputs['blueprintName']
-    gBlueprintNameFolder = gBlueprintName.lower().replace(" ",'-').replace("(",'-').replace(")",'-').replace("{",'-').replace("}",'-').replace("_",'-').replace("=",'-').replace("+",'-').replace(".",'-').replace(",",'-').replace("--",'-').replace("--",'-') # convert to path [a-z\-]
-    gFilepath = gFolder + gBlueprintNameFolder + gFilename    # Entire Filepath 
+    gtUrl = gitTarget['url']   # Git URL
+    gPrivateToken = str(gitTarget['token'] or actionInputs['gitPrivateToken'])   # Git private token
+    gProjectId = gitTarget['projectId']   # Git project ID 
+    gBranch = gitTarget['branch']    # Git branch
+    with metricsSpan("gitConnect"):
+        gPproject = getGitlabProject(gtUrl, gPrivateToken, gProjectId)    # Get project. Cached across warm invocations.
+    gFolder = gitTarget['folder']    # Root repo folder
+    gFilepath = gitBlueprintFilepath(gFolder, actionInputs['blueprintName'])    # Entire Filepath 
+    gitSyncStatus = ""    # created / updated / moved / unchanged / deleted / skipped / notFound
 
     if ( (actionInputs['eventType'] == "CREATE_BLUEPRINT_VERSION") or (actionInputs['eventType'] == "TEST") ):  
 
-        # Check if file exists
-        try:    
-            fileExists = gPproject.files.get(file_path=gFilepath, ref='master')
-            fileExists = "True"
-        except:
-            fileExists = "False"
-
-        if (fileExists == "True"):
-            print("[ABX] "+fn+" Git - File exists")
-            print("[ABX] "+fn+" Git - Updating file...")
-            gFileGet = gPproject.files.get(file_path=gFilepath, ref='master')
-            gFileGet.content = str(blueprint)   
-            gFileGet.save(branch='master', commit_message='Updated by www.kaloferov.com' ) # '+ actionInputs['userName'])' use this to add email
-    
-        elif (fileExists == "False"):
-            print("[ABX] "+fn+" Git - File does not exist")
-            print("[ABX] "+fn+" Git - Creating File...")
-            gFileCreate = gPproject.files.create({
-                'file_path': gFilepath,
-                'branch': 'master',
-                'content': "Created By ABX",
-                'author_email': "www.kaloferov.com", # TODO: replace with actionInputs['userName'] to add email 
-                'author_name': "www.kaloferov.com", # TODO: replace with actionInputs['userName'] to add email 
-                'encoding': 'base64',
-                'commit_message': 'Created by '+ actionInputs['userName']}
-                )
-            print("[ABX] "+fn+" Git - Adding content to file...")
-            gFileGet = gPproject.files.get(file_path=gFilepath, ref='master')
-            gFileGet.content = str(blueprint)   
-            gFileGet.save(branch='master', commit_message='Updated by www.kaloferov.com' ) # TODO: replace with actionInputs['userName'] to add email 
-        else:
-            print("")
-        # End Loop
+        # Create, update or move (renamed) the file and update the manifest in a single commit
+        print("[ABX] "+fn+" Git - Syncing file...")
+        blueprintOptions = (blueprintGetYaml(actionInputs, actionInputs['blueprintId']).get('options') or {}) if resp_getBlueprint_json else {}    # Recorded in the manifest for deletes
+        gManifestEntry = gitManifestEntry(gFilepath, actionInputs['blueprintName'], actionInputs['blueprintVersion'], blueprint, blueprintOptions, resp_getBlueprint_json.get('updatedAt'))    # Call function
+        gitSyncStatus = gitSyncBlueprint(gPproject, gFolder, gBranch, actionInputs['blueprintId'], blueprint, gManifestEntry, actionInputs['userName'])    # Call function
+        print("[ABX] "+fn+" Git - File "+gitSyncStatus+".")
     
     elif (actionInputs['eventType'] == "DELETE_BLUEPRINT"):
         print("[ABX] "+fn+" Git - Preparing for deletion...")
-        # Check if file exists
-        try:    
-            fileExists = gPproject.files.get(file_path=gFilepath, ref='master')
-            fileExists = "True"
-        except:
-            fileExists = "False"
-
-        if (fileExists == "True"):
-            print("[ABX] "+fn+" Git - File exists")
-            gFileDelete = gPproject.files.get(file_path=gFilepath, ref='master')
-            gFileDelete_decoded = str(gFileDelete.decode()).lower()
-            #blueprintOptionGitlabSyncDeleteTrue = "blueprintOptionGitDelete: true"
-            blueprintOptionGitlabSyncDeleteTrue = "gitlabSyncDelete: true"
-            print("[ABX] "+fn+" Git - Checking for blueprint option gitlabSyncDelete is set...")
-            if (blueprintOptionGitlabSyncDeleteTrue.lower() not in gFileDelete_decoded.lower()):
-                print("[ABX] "+fn+" Git - Skipping file deletion based on blueprint option gitlabSyncDelete...")
-            elif (blueprintOptionGitlabSyncDeleteTrue.lower() in gFileDelete_decoded.lower()):
-                gFileDelete.delete(commit_message='Deleted by ' + actionInputs['userName'], branch='master')
-                print("[ABX] "+fn+" Git - File deleted.")
+        # Delete decision from the manifest entry. No file download.
+        gitSyncStatus, gManifestFilepath = gitDeleteBlueprint(gPproject, gFolder, gBranch, actionInputs['blueprintId'], actionInputs['userName'])    # Call function
+        if (gitSyncStatus != "notFound"):
+            gFilepath = gManifestFilepath
+            print("[ABX] "+fn+" Git - Manifest entry found. File "+gitSyncStatus+".")
+        else:
+            # Blueprints synced before the manifest was added. Check the file by name.
+            print("[ABX] "+fn+" Git - Blueprint not in manifest. Checking file...")
+            try:    
+                with metricsSpan("gitExistenceCheck"):
+                    gFileDelete = gPproject.files.get(file_path=gFilepath, ref=gBranch)
+                fileExists = "True"
+            except:
+                fileExists = "False"
+
+            if (fileExists == "True"):
+                print("[ABX] "+fn+" Git - File exists")
+                gFileDelete_decoded = str(gFileDelete.decode()).lower()
+                #blueprintOptionGitlabSyncDeleteTrue = "blueprintOptionGitDelete: true"
+                blueprintOptionGitlabSyncDeleteTrue = "gitlabSyncDelete: true"
+                print("[ABX] "+fn+" Git - Checking for blueprint option gitlabSyncDelete is set...")
+                if (blueprintOptionGitlabSyncDeleteTrue.lower() not in gFileDelete_decoded.lower()):
+                    print("[ABX] "+fn+" Git - Skipping file deletion based on blueprint option gitlabSyncDelete...")
+                    gitSyncStatus = "skipped"
+                elif (blueprintOptionGitlabSyncDeleteTrue.lower() in gFileDelete_decoded.lower()):
+                    with metricsSpan("gitWrite"):
+                        gFileDelete.delete(commit_message='Deleted by ' + actionInputs['userName'], branch=gBranch)
+                    print("[ABX] "+fn+" Git - File deleted.")
+                    gitSyncStatus = "deleted"
+                else:
+                    print("")
+                # End Loop    
+                
+            elif (fileExists == "False"):
+                print("[ABX] "+fn+" Git - File does not exist")
+                gitSyncStatus = "notFound"
             else:
                 print("")
-            # End Loop    
-            
-        elif (fileExists == "False"):
-            print("[ABX] "+fn+" Git - File does not exist")
-        else:
-            print("")
-        # End Loop                
+            # End Loop                
+        # End Loop
 
     else:
         print("")
-    # End Loop    
+    # End Loop
 
 
     # ----- Outputs ----- #
 
+    response = {    # Set function response 
+        "gitFilepath": gFilepath,
+        "gitSyncStatus": gitSyncStatus,
+    }
+    
+    return response    # Return response 
+    # End Function  
+
+
+
+def gitTargetPrefetch (actionInputs, gitTarget):   # Connects to a Git target and reads its manifest ahead of the sync. Failures are left to gitSyncTarget, which reports them per target.
+    fn = "gitTargetPrefetch -"    # Holds the funciton name. 
+    try:
+        with metricsSpan("gitConnect"):
+            gitProject = getGitlabProject(gitTarget['url'], str(gitTarget['token'] or actionInputs['gitPrivateToken']), gitTarget['projectId'])    # Get project. Cached across warm invocations.
+        gitManifestRead(gitProject, gitTarget['folder'], gitTarget['branch'], [actionInputs['blueprintId']])    # Call function
+    except Exception as e:
+        print("[ABX] "+fn+" Git - Prefetch of "+gitTarget['url']+" project "+gitTarget['projectId']+" failed: "+str(e))
+    # End Loop
+    # End Function  
+
+
+
+def gitTargetsParse (actionInputs, gitTargets):   # Returns the Git targets of a list of {url, projectId, branch, folder, token}. Missing fields default to gitBaseUrl, gitProjectIdIn, gitDefaultBranch, gitProjectFolderIn and gitPrivateTokenIn. None or an empty list is the single default target.
+    gitTargets = gitTargets or [{}]
+    if (not all(isinstance(gitTarget, dict) for gitTarget in gitTargets)):
+        raise ValueError("gitTargetsIn must be a JSON list of objects")
+    return [ {
+        'url': gitTarget.get('url') or gitBaseUrl,
+        'projectId': str(gitTarget.get('projectId') or actionInputs['gitProjectId']),
+        'branch': gitTarget.get('branch') or gitDefaultBranch,
+        'folder': actionInputs['gitProjectFolder'] if (gitTarget.get('folder') is None) else gitTarget['folder'],
+        'token': gitTarget.get('token') or "",    # Empty uses gitPrivateToken
+    } for gitTarget in gitTargets ]
+    # End Function  
+
+
+
+def coalesceFunction (context, inputs, actionInputs, evals):   # Coalescing stage for version events. Spools the event, waits out the coalescing window and syncs the due events of all blueprints in one commit.
+    fn = "coalesceFunction -"    # Holds the funciton name. 
+    print("[ABX] "+fn+" Function started.")
+    
+    
+    # ----- Spool ----- #
+    
+    # A newer event of the same blueprint replaces this one. The invocation that wakes up after an event is due writes it.
+    spoolEntry = coalescePut(actionInputs)    # Call function
+    waitSeconds = spoolEntry['dueAt'] - time.time()
+    if (deadlineRemaining() is not None):
+        waitSeconds = min(waitSeconds, deadlineRemaining() - httpReadTimeoutSeconds)    # Leave time to flush
+    print("[ABX] "+fn+" Spooled event "+str(spoolEntry['events'])+" of blueprint "+actionInputs['blueprintId']+". Waiting "+str(round(max(waitSeconds, 0), 2))+"s...")
+    with metricsSpan("coalesceWait"):
+        time.sleep(max(waitSeconds, 0))
+    spoolEntries = coalesceClaim(actionInputs)    # Call function
+    
+    gFilepath = gitBlueprintFilepath(actionInputs['gitProjectFolder'], actionInputs['blueprintName'])
+    if (len(spoolEntries) == 0):
+        print("[ABX] "+fn+" Event coalesced into a newer event. Skipping write.")
+        return {"gitFilepath": gFilepath, "gitSyncStatus": "coalesced"}
+    # End Loop
+    
+    
+    # ----- Flush ----- #
+    
+    print("[ABX] "+fn+" Flushing "+str(sum(spoolEntry['events'] for spoolEntry in spoolEntries))+" event(s) of "+str(len(spoolEntries))+" blueprint(s)...")
+    try:
+        gitSyncStatuses = coalesceFlush(context, inputs, actionInputs, spoolEntries)    # Call function
+    except Exception:
+        coalesceRequeue(actionInputs, spoolEntries)    # Call function. Retried by the next version event or reconcileHandler.
+        raise
+    # End Loop
+    
+    
+    # ----- Outputs ----- #
+    
     response = {    # Set action outputs
-        # "response": resp_getBlueprint_json
+        "gitFilepath": gFilepath,
+        "gitSyncStatus": gitSyncStatuses.get(actionInputs['blueprintId'], "coalesced"),
+        "coalescedEvents": sum(spoolEntry['events'] for spoolEntry in spoolEntries),
+        "blueprintsFlushed": gitSyncStatuses,
     }
-    #print("[ABX] "+fn+" Function return: \n" + json.dumps(response))    # Write function responce to console  
     print("[ABX] "+fn+" Function completed.")   
     
     return response    # Return response 
-    # End Function    
+    # End Function  
 
 
 
-def awsSessionManagerGetSecret (context, inputs, awsSecretId_csp, awsSecretId_git, awsRegionName):  # Retrieves AWS Secrets Manager Secrets
-    # Ref: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/secretsmanager.html
-    fn = "awsSessionManagerGetSecret -"    # Holds the funciton name. 
+def coalesceFlush (context, inputs, actionInputs, spoolEntries):   # Syncs the latest spooled version of several blueprints and their manifest entries in one commit. Returns {blueprintId: created / updated / moved / unchanged / skipped / failed}.
+    fn = "coalesceFlush -"    # Holds the funciton name. 
+    
+    
+    # ----- Secrets / CSP Token / Git  ----- #     
+    
+    gFolder = actionInputs['gitProjectFolder']    # Root repo folder
+    dagResults = dagRun({    # Call function
+        'secrets': ([], lambda dagResults: dagStep("secretFetch", actionGetSecrets, context, inputs, actionInputs)),
+        'cspToken': (['secrets'], lambda dagResults: dagStep("cspLogin", cspLogin, actionInputs)),
+        'gitProject': (['secrets'], lambda dagResults: dagStep("gitConnect", getGitlabProject, gitBaseUrl, str(actionInputs['gitPrivateToken']), actionInputs['gitProjectId'])),
+        'gitManifest': (['gitProject'], lambda dagResults: gitManifestRead(dagResults['gitProject'], gFolder, gitDefaultBranch, [ spoolEntry['blueprintId'] for spoolEntry in spoolEntries ])),    # Reused by the commit
+    })
+    gPproject = dagResults['gitProject']
+    
+    
+    # ----- Script ----- #
+    
+    # Get Blueprints
+    gitSyncStatuses = {}
+    blueprints = {}
+    with metricsSpan("blueprintFetch"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(bulkMaxWorkers, len(spoolEntries))) as executor:
+            futures = { executor.submit(blueprintGet, actionInputs, spoolEntry['blueprintId']): spoolEntry['blueprintId'] for spoolEntry in spoolEntries }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    blueprints[futures[future]] = future.result()
+                except Exception as e:
+                    print("[ABX] "+fn+" Failed to get Blueprint "+futures[future]+": "+str(e))
+                    gitSyncStatuses[futures[future]] = "failed"    # Repaired by reconcileHandler
+        # End Loop
+    # End Loop
+    
+    # Rewrite the latest version of each blueprint
+    blueprintSyncs = []
+    for spoolEntry in spoolEntries:
+        if (spoolEntry['blueprintId'] not in blueprints):
+            continue
+        blueprintOptions = blueprintGetYaml(actionInputs, spoolEntry['blueprintId']).get('options') or {}
+        if ((actionInputs['actionOptionRunOnBlueprintOption'] == "true") and (runOnEvaluate(actionInputs['runOnBlueprintOption'], blueprintOptions) == False)):
+            gitSyncStatuses[spoolEntry['blueprintId']] = "skipped"
+            continue
+        # End Loop
+        blueprint = blueprintRewrite(blueprints[spoolEntry['blueprintId']]['content'], spoolEntry['blueprintVersion'], spoolEntry['blueprintName'], actionInputs['blueprintExtraFields'])    # Call function
+        gManifestEntry = gitManifestEntry(gitBlueprintFilepath(gFolder, spoolEntry['blueprintName']), spoolEntry['blueprintName'], spoolEntry['blueprintVersion'], blueprint, blueprintOptions, blueprints[spoolEntry['blueprintId']].get('updatedAt'))    # Call function
+        blueprintSyncs.append((spoolEntry['blueprintId'], blueprint, gManifestEntry))
+    # End Loop
+    
+    def planBatch (manifest, verifyFiles):   # Returns the file actions of all blueprints. Updates their manifest entries.
+        gitActions = []
+        for blueprintId, blueprint, gManifestEntry in blueprintSyncs:
+            previousEntry = manifest['blueprints'].get(blueprintId)
+            manifest['blueprints'][blueprintId] = gManifestEntry
+            blueprintActions, gitSyncStatuses[blueprintId] = gitPlanBlueprintActions(gPproject, gitDefaultBranch, previousEntry, gManifestEntry, blueprint, verifyFiles)
+            gitActions.extend(blueprintActions)
+        # End Loop
+        return gitActions, "coalesced"
+        # End Function  
+    
+    # Commit
+    userNames = ", ".join(sorted(set(spoolEntry['userName'] for spoolEntry in spoolEntries if spoolEntry['userName'])))
+    print("[ABX] "+fn+" Git - Syncing "+str(len(blueprintSyncs))+" blueprint(s) in one commit...")
+    gitManifestCommit(gPproject, gFolder, gitDefaultBranch, [ blueprintId for blueprintId, blueprint, gManifestEntry in blueprintSyncs ], planBatch, userNames)    # Call function
+    
+    return gitSyncStatuses
+    # End Function  
+
+
+
+def coalescePut (actionInputs):   # Spools a version event. Replaces a pending event of the same blueprint, so only its latest version is written. Returns the spool entry.
+    spoolTime = time.time()
+    
+    def putEvent (spoolEntries):
+        pendingEntry = spoolEntries.get(actionInputs['blueprintId']) or {}
+        queuedAt = pendingEntry.get('queuedAt', spoolTime)
+        spoolEntries[actionInputs['blueprintId']] = {
+            'blueprintId': actionInputs['blueprintId'],
+            'blueprintName': actionInputs['blueprintName'],
+            'blueprintVersion': actionInputs['blueprintVersion'],
+            'userName': actionInputs['userName'],
+            'queuedAt': queuedAt,
+            'dueAt': min(spoolTime + actionInputs['coalesceWindowSeconds'], queuedAt + max(coalesceMaxDelaySeconds, actionInputs['coalesceWindowSeconds'])),    # Bursts can not hold a blueprint back for longer than coalesceMaxDelaySeconds
+            'events': pendingEntry.get('events', 0) + 1,
+        }
+        return dict(spoolEntries[actionInputs['blueprintId']])
+        # End Function  
+    
+    return spoolUpdate(actionInputs, putEvent)    # Call function
+    # End Function  
+
+
+
+def coalesceClaim (actionInputs):   # Takes the due events out of the spool, oldest first and at most coalesceBatchSize. Returns the spool entries.
+    claimTime = time.time() + (actionInputs['coalesceWindowSeconds'] * coalesceBatchAheadShare)    # Also events due soon
+    
+    def claimDue (spoolEntries):
+        dueIds = sorted([ blueprintId for blueprintId, spoolEntry in spoolEntries.items() if (spoolEntry['dueAt'] <= claimTime) ], key=lambda blueprintId: spoolEntries[blueprintId]['queuedAt'])
+        return [ spoolEntries.pop(blueprintId) for blueprintId in dueIds[:coalesceBatchSize] ]
+        # End Function  
+    
+    return spoolUpdate(actionInputs, claimDue)    # Call function
+    # End Function  
+
+
+
+def coalesceRequeue (actionInputs, claimedEntries):   # Puts claimed events back after a failed flush. A newer spooled event of the same blueprint is kept.
+    def requeue (spoolEntries):
+        for claimedEntry in claimedEntries:
+            if (claimedEntry['blueprintId'] in spoolEntries):
+                spoolEntries[claimedEntry['blueprintId']]['events'] += claimedEntry['events']
+            else:
+                spoolEntries[claimedEntry['blueprintId']] = claimedEntry
+        # End Loop
+        # End Function  
+    
+    spoolUpdate(actionInputs, requeue)    # Call function
+    # End Function  
+
+
+
+def drainHandler(context, inputs):   # Action entry function for write-behind. Set as the action entrypoint and run periodically to replay the journal into Git.
+    fn = "drainHandler -"    # Funciton name 
+    metricsStart()    # Call function
+    deadlineStart()    # Call function
+    print("[ABX] "+fn+" Action started.")
     print("[ABX] "+fn+" Function started.")
     
     
+    # ----- Inputs  ----- #     
+    
+    actionInputs = {}  
+    actionInputs['writeBehindJournalPath'] = inputs.get('writeBehindJournalPathIn', "")
+    actionInputs['drainBatchSize'] = inputs.get('drainBatchSizeIn', "")
+    actionInputs['eventType'] = "DRAIN"
+    
+    actionInputsRead(inputs, actionInputs)    # Call function. Adds the secrets inputs and replaces empty values.
+    actionInputs['writeBehindJournalPath'] = actionInputs['writeBehindJournalPath'] or journalPath
+    actionInputs['drainBatchSize'] = int(actionInputs['drainBatchSize'] or journalDrainBatchSize)
+    if (storagePathShared(actionInputs['writeBehindJournalPath']) == False):
+        raise ValueError("writeBehindJournalPathIn must be set to a journal on storage shared with the handler action (e.g. EFS), not to a container-local path: "+str(actionInputs['writeBehindJournalPath']))
+    # End Loop
+    
+    
     # ----- Script ----- #
+    
+    resp_drainHandler = {   # Set function response 
+        "drainStatus": "",    # drained / pending / busy
+        "recordsReplayed": 0,
+        "recordsPending": 0,
+        "recordsRejected": 0,
+        "gitSyncStatuses": {},
+        "gitCommits": 0,
+        "errors": [],
+    }
+    
+    # One drain at a time. Appends go on while the journal drains.
+    fcntl = lazyImport('fcntl')
+    jPath = actionInputs['writeBehindJournalPath']
+    with open(jPath + ".drain.lock", "a") as drainLockFile:
+        try:
+            fcntl.flock(drainLockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            drainLocked = True
+        except BlockingIOError:
+            print("[ABX] "+fn+" Another drain is running. Skipping.")
+            resp_drainHandler['drainStatus'] = "busy"
+            drainLocked = False
+        # End Loop
         
-    # Create a Secrets Manager client
-    print("[ABX] "+fn+" AWS Secrets Manager - Creating session...")
-    session = boto3.session.Session()
-    sm_client = session.client(
-        service_name='secretsmanager',
-        region_name=awsRegionName
-    )
-
-    # Get Secrets
-    print("[ABX] "+fn+" AWS Secrets Manager - Getting secret(s)...")
-    resp_awsSecret_csp = sm_client.get_secret_value(
-            SecretId=awsSecretId_csp
-        )
-    resp_awsSecret_git = sm_client.get_secret_value(
-            SecretId=awsSecretId_git
-        )
-    #print(awsSecret)
-    awsSecret_csp = json.dumps(resp_awsSecret_csp['SecretString']).replace(awsSecretId_csp,'').replace("\\",'').replace('"{"','').replace('"}"','').replace('":"','')   # Cleanup the response to get just the secret
-    awsSecret_git = json.dumps(resp_awsSecret_git['SecretString']).replace(awsSecretId_git,'').replace("\\",'').replace('"{"','').replace('"}"','').replace('":"','')   # Cleanup the response to get just the secret
+        if (drainLocked):
+            with metricsSpan("secretFetch"):
+                actionGetSecrets(context, inputs, actionInputs)    # Call function
+            journalCursor = journalCursorRead(jPath)    # Call function
+            attempt = 0
+            while True:
+                batchSize = 1 if (journalCursor['offset'] < journalCursor['isolateUntil']) else actionInputs['drainBatchSize']    # Records of a batch that kept failing are replayed one by one
+                journalRecords, nextOffset, journalRecordError = journalRead(jPath, journalCursor['offset'], batchSize)    # Call function
+                if (len(journalRecords) == 0):
+                    journalCompact(jPath, journalCursor['offset'])    # Call function
+                    break
+                elif (journalRecordError != ""):    # Can never replay. Moved aside at once, so it does not block later records.
+                    print("[ABX] "+fn+" "+journalRecordError+". Moving it to the rejected journal.")
+                    journalReject(jPath, journalRecords[0], journalRecordError)    # Call function
+                    journalCursor = {'offset': nextOffset, 'failedAttempts': 0, 'isolateUntil': journalCursor['isolateUntil']}
+                    journalCursorWrite(jPath, journalCursor)    # Call function
+                    resp_drainHandler['recordsRejected'] += 1
+                    continue
+                # End Loop
+                try:
+                    gitSyncStatuses, gitCommitIds = journalReplay(actionInputs, journalRecords)    # Call function
+                except Exception as e:
+                    attempt += 1
+                    waitSeconds = httpRetryWait(attempt, {})
+                    print("[ABX] "+fn+" Replay failed ("+type(e).__name__+": "+str(e)+").")
+                    resp_drainHandler['errors'].append(type(e).__name__+": "+str(e))
+                    if (journalReplayErrorPermanent(e)):    # Call function. Outages are retried until GitLab is back. Only errors a retry can not fix are counted.
+                        journalCursor['failedAttempts'] += 1
+                        if ((journalCursor['failedAttempts'] >= journalReplayAttempts) and (len(journalRecords) == 1)):
+                            print("[ABX] "+fn+" Record failed "+str(journalCursor['failedAttempts'])+" times. Moving it to the rejected journal.")
+                            journalReject(jPath, journalRecords[0], type(e).__name__+": "+str(e))    # Call function
+                            journalCursor = {'offset': nextOffset, 'failedAttempts': 0, 'isolateUntil': journalCursor['isolateUntil']}
+                            resp_drainHandler['recordsRejected'] += 1
+                            attempt = 0
+                        elif (journalCursor['failedAttempts'] >= journalReplayAttempts):
+                            print("[ABX] "+fn+" Batch failed "+str(journalCursor['failedAttempts'])+" times. Replaying its records one by one.")
+                            journalCursor = {'offset': journalCursor['offset'], 'failedAttempts': 0, 'isolateUntil': nextOffset}
+                            attempt = 0
+                        # End Loop
+                        journalCursorWrite(jPath, journalCursor)    # Call function. Failed attempts count across drains.
+                        if (journalCursor['failedAttempts'] == 0):    # Rejected or isolated. Go on without waiting.
+                            continue
+                    # End Loop
+                    if ((deadlineRemaining() is not None) and (deadlineRemaining() - waitSeconds < httpReadTimeoutSeconds)):
+                        print("[ABX] "+fn+" Deadline reached. Records are replayed by the next drain.")
+                        break
+                    time.sleep(waitSeconds)
+                    continue
+                # End Loop
+                attempt = 0
+                journalCursor = {'offset': nextOffset, 'failedAttempts': 0, 'isolateUntil': journalCursor['isolateUntil']}
+                journalCursorWrite(jPath, journalCursor)    # Call function. After the commit. A replayed batch is unchanged in Git.
+                resp_drainHandler['recordsReplayed'] += len(journalRecords)
+                resp_drainHandler['gitCommits'] += len(gitCommitIds)
+                for gitSyncStatus in gitSyncStatuses.values():
+                    resp_drainHandler['gitSyncStatuses'][gitSyncStatus] = resp_drainHandler['gitSyncStatuses'].get(gitSyncStatus, 0) + 1
+                # End Loop
+            # End Loop
+            resp_drainHandler['recordsPending'] = journalCount(jPath, journalCursor['offset'])    # Call function
+            resp_drainHandler['drainStatus'] = "drained" if (resp_drainHandler['recordsPending'] == 0) else "pending"
+            fcntl.flock(drainLockFile, fcntl.LOCK_UN)
+        # End Loop
+    # End Loop
+    
     
     # ----- Outputs ----- #
     
-    response = {   # Set action outputs
-        "awsSecret_csp" : str(awsSecret_csp),
-        "awsSecret_git": str(awsSecret_git),
-        }
-    print("[ABX] "+fn+" Function completed.")  
+    outputs = {   # Set action outputs
+       "resp_drainHandler": resp_drainHandler,
+       "metrics": metricsResult(actionInputs),
+    }
+    print("[ABX] "+fn+" Function return: \n" + json.dumps(resp_drainHandler))    # Write function responce to console  
+    print("[ABX] "+fn+" Function completed.")     
+    print("[ABX] "+fn+" Action completed.")     
     
-    return response    # Return response 
+    return outputs    # Return outputs 
+    # End Function  
+
+
+
+def journalBlueprint (actionInputs, blueprint, blueprintJson):   # Appends the Git write of an event to the write-behind journal. Returns the blueprint file path.
+    gFilepath = gitBlueprintFilepath(actionInputs['gitProjectFolder'], actionInputs['blueprintName'])
+    journalRecord = {
+        'journalId': actionInputs['invocationId'],
+        'journaledAt': time.time(),
+        'gitProjectId': str(actionInputs['gitProjectId']),
+        'gitProjectFolder': actionInputs['gitProjectFolder'],
+        'blueprintId': actionInputs['blueprintId'],
+        'userName': actionInputs['userName'],
+    }
+    if (actionInputs['eventType'] == "DELETE_BLUEPRINT"):
+        journalRecord['op'] = "delete"
+        journalRecord['gitFilepath'] = gFilepath    # Checked by name if the blueprint has no manifest entry
+    else:
+        blueprintOptions = (blueprintGetYaml(actionInputs, actionInputs['blueprintId']).get('options') or {}) if blueprintJson else {}
+        journalRecord['op'] = "sync"
+        journalRecord['content'] = blueprint
+        journalRecord['manifestEntry'] = gitManifestEntry(gFilepath, actionInputs['blueprintName'], actionInputs['blueprintVersion'], blueprint, blueprintOptions, blueprintJson.get('updatedAt'))    # Call function
+    # End Loop
+    journalAppend(actionInputs['writeBehindJournalPath'], journalRecord)    # Call function
+    
+    return gFilepath
+    # End Function  
+
+
+
+def journalReplay (actionInputs, journalRecords):   # Replays journal records of one Git project folder. Records of a blueprint with the same op in a row are collapsed to the last one. Returns ({blueprintId: status}, commit ids).
+    gitProjectId = journalRecords[0]['gitProjectId']
+    gitProjectFolder = journalRecords[0]['gitProjectFolder']
+    with metricsSpan("gitConnect"):
+        gPproject = getGitlabProject(gitBaseUrl, str(actionInputs['gitPrivateToken']), gitProjectId)    # Get project. Cached across warm invocations.
+    
+    # A change of op (e.g. sync then delete) starts a new commit, so the delete is planned on the manifest entry the sync wrote
+    replaySegments = [{}]
+    for journalRecord in journalRecords:
+        latestRecord = replaySegments[-1].get(journalRecord['blueprintId'])
+        if ((latestRecord is not None) and (latestRecord['op'] != journalRecord['op'])):
+            replaySegments.append({})
+        replaySegments[-1].pop(journalRecord['blueprintId'], None)    # Keeps the order of the last records
+        replaySegments[-1][journalRecord['blueprintId']] = journalRecord
+    # End Loop
+    gitSyncStatuses = {}
+    gitCommitIds = []
+    
+    for latestRecords in replaySegments:
+        
+        def planJournal (manifest, verifyFiles):   # Returns the file actions of all records. Updates the manifest entries.
+            gitActions = []
+            for blueprintId, journalRecord in latestRecords.items():
+                if (journalRecord['op'] == "delete"):
+                    recordActions, gitSyncStatuses[blueprintId], gFilepath = gitPlanDeleteActions(gPproject, gitDefaultBranch, manifest, blueprintId, verifyFiles)
+                    if ((gitSyncStatuses[blueprintId] == "notFound") and journalRecord.get('gitFilepath')):    # Synced before the manifest was added. Checked by name, as handler does.
+                        recordActions, gitSyncStatuses[blueprintId] = gitPlanDeleteFileActions(gPproject, gitDefaultBranch, journalRecord['gitFilepath'])
+                else:
+                    previousEntry = manifest['blueprints'].get(blueprintId)
+                    manifest['blueprints'][blueprintId] = journalRecord['manifestEntry']
+                    recordActions, gitSyncStatuses[blueprintId] = gitPlanBlueprintActions(gPproject, gitDefaultBranch, previousEntry, journalRecord['manifestEntry'], journalRecord['content'], verifyFiles)
+                gitActions.extend(recordActions)
+            # End Loop
+            return gitActions, "drained"
+            # End Function  
+        
+        userNames = ", ".join(sorted(set(journalRecord['userName'] for journalRecord in latestRecords.values() if journalRecord['userName'])))
+        gitSyncStatus, gitCommitId = gitManifestCommit(gPproject, gitProjectFolder, gitDefaultBranch, list(latestRecords), planJournal, userNames)    # Call function
+        if (gitCommitId is not None):
+            gitCommitIds.append(gitCommitId)
+    # End Loop
+    
+    return gitSyncStatuses, gitCommitIds
     # End Function  
+
+
+
+def journalReplayErrorPermanent (error):   # True for replay errors a retry can not fix (e.g. 403, deleted project, malformed record). Connection errors, timeouts, 5xx, 429 and 401 (token) are not.
+    gitlab = lazyImport('gitlab')
+    requests = lazyImport('requests')
+    if (isinstance(error, requests.exceptions.RequestException)):
+        return False
+    if (isinstance(error, gitlab.exceptions.GitlabError)):
+        return ((error.response_code is not None) and (400 <= error.response_code < 500) and (error.response_code not in [401, 408, 429]))
+    return True
+    # End Function  
+
+
+
+def journalReject (jPath, journalRecord, error):   # Appends a record that kept failing, or is malformed, to the rejected journal (.rejected next to the journal), so later records drain. Append it to the journal again to replay it.
+    journalAppend(jPath + ".rejected", {'record': journalRecord, 'rejectedAt': time.time(), 'rejectedError': error})    # Call function. Wrapped, as a malformed record may not be a JSON object.
+    # End Function  
+
+
+
+def journalAppend (jPath, journalRecord):   # Appends a record to the journal and fsyncs it before returning
+    fcntl = lazyImport('fcntl')
+    journalLine = (json.dumps(journalRecord, sort_keys=True) + "\n").encode('utf-8')
+    journalCreated = not os.path.exists(jPath)
+    with open(jPath, "ab") as journalFile:
+        fcntl.flock(journalFile, fcntl.LOCK_EX)
+        try:
+            journalFile.seek(0, os.SEEK_END)
+            if (journalFile.tell() > 0):
+                with open(jPath, "rb") as journalTail:
+                    journalTail.seek(-1, os.SEEK_END)
+                    if (journalTail.read(1) != b"\n"):    # Torn record of a crashed append. Terminated so it is skipped.
+                        journalLine = b"\n" + journalLine
+            # End Loop
+            journalFile.write(journalLine)
+            journalFile.flush()
+            os.fsync(journalFile.fileno())
+        finally:
+            fcntl.flock(journalFile, fcntl.LOCK_UN)
+        # End Loop
+    # End Loop
+    if (journalCreated):
+        fsyncDirectory(jPath)    # Call function. Makes the new journal file itself durable.
+    # End Function  
+
+
+
+def journalRead (jPath, journalOffset, maxRecords):   # Returns (records, next offset, malformed error) from journalOffset. A batch only holds well-formed records of one Git project folder. A malformed record is returned alone with its error. Unreadable lines are skipped.
+    fn = "journalRead -"    # Holds the funciton name. 
+    journalRecords = []
+    try:
+        journalFile = open(jPath, "rb")
+    except FileNotFoundError:
+        return [], journalOffset
+    # End Loop
+    with journalFile:
+        journalFile.seek(journalOffset)
+        while (len(journalRecords) < maxRecords):
+            journalLine = journalFile.readline()
+            if (not journalLine.endswith(b"\n")):    # End of journal, or a record still being appended
+                break
+            try:
+                journalRecord = json.loads(journalLine)
+            except ValueError:
+                print("[ABX] "+fn+" Skipping unreadable journal record at offset "+str(journalOffset))
+                journalOffset += len(journalLine)
+                continue
+            # End Loop
+            journalRecordError = journalRecordCheck(journalRecord)    # Call function
+            if ((journalRecordError != "") and (len(journalRecords) == 0)):
+                return [journalRecord], journalOffset + len(journalLine), journalRecordError
+            elif (journalRecordError != ""):    # Returned alone by the next read
+                break
+            elif ((len(journalRecords) > 0) and ((journalRecord['gitProjectId'], journalRecord['gitProjectFolder']) != (journalRecords[0]['gitProjectId'], journalRecords[0]['gitProjectFolder']))):
+                break
+            journalRecords.append(journalRecord)
+            journalOffset += len(journalLine)
+        # End Loop
+    # End Loop
+    
+    return journalRecords, journalOffset, ""
+    # End Function  
+
+
+
+def journalRecordCheck (journalRecord):   # Returns why a journal record can not be replayed, or "" if it is well-formed
+    if (not isinstance(journalRecord, dict)):
+        return "Malformed record: not a JSON object"
+    requiredFields = ['op', 'blueprintId', 'gitProjectId', 'gitProjectFolder', 'userName'] + (['content', 'manifestEntry'] if (journalRecord.get('op') == "sync") else [])
+    missingFields = [ requiredField for requiredField in requiredFields if (requiredField not in journalRecord) ]
+    if (len(missingFields) > 0):
+        return "Malformed record: missing "+", ".join(missingFields)
+    elif (journalRecord['op'] not in ["sync", "delete"]):
+        return "Malformed record: unknown op "+str(journalRecord['op'])
+    elif ((journalRecord['op'] == "sync") and ((not isinstance(journalRecord['content'], str)) or (not isinstance(journalRecord['manifestEntry'], dict)) or (len(set(gitManifestEntry("", "", "", "", {})) - set(journalRecord['manifestEntry'])) > 0))):
+        return "Malformed record: invalid content or manifestEntry"
+    # End Loop
+    return ""
+    # End Function  
+
+
+
+def journalCount (jPath, journalOffset):   # Returns the number of complete records after journalOffset
+    try:
+        with open(jPath, "rb") as journalFile:
+            journalFile.seek(journalOffset)
+            return journalFile.read().count(b"\n")
+    except FileNotFoundError:
+        return 0
+    # End Function  
+
+
+
+def journalCursorRead (jPath):   # Returns the journal cursor: offset replayed so far, failed attempts of the record(s) at the offset, and the offset up to which records are replayed one by one
+    try:
+        with open(jPath + ".cursor") as cursorFile:
+            journalCursor = json.load(cursorFile)
+    except FileNotFoundError:
+        journalCursor = {}
+    # End Loop
+    return {'offset': journalCursor.get('offset', 0), 'failedAttempts': journalCursor.get('failedAttempts', 0), 'isolateUntil': journalCursor.get('isolateUntil', 0)}
+    # End Function  
+
+
+
+def journalCursorWrite (jPath, journalCursor):   # Stores the journal cursor. Written to a temp file, fsynced and renamed, so a crash keeps the old or the new cursor.
+    with open(jPath + ".cursor.tmp", "w") as cursorFile:
+        json.dump(journalCursor, cursorFile)
+        cursorFile.flush()
+        os.fsync(cursorFile.fileno())
+    os.replace(jPath + ".cursor.tmp", jPath + ".cursor")
+    fsyncDirectory(jPath)    # Call function
+    # End Function  
+
+
+
+def journalCompact (jPath, journalOffset):   # Empties a fully replayed journal. Holds the append lock, so no record is appended in between.
+    fcntl = lazyImport('fcntl')
+    try:
+        journalFile = open(jPath, "ab")
+    except FileNotFoundError:
+        return
+    # End Loop
+    with journalFile:
+        fcntl.flock(journalFile, fcntl.LOCK_EX)
+        try:
+            journalFile.seek(0, os.SEEK_END)
+            if ((journalOffset > 0) and (journalFile.tell() == journalOffset)):
+                journalCursorWrite(jPath, {'offset': 0, 'failedAttempts': 0, 'isolateUntil': 0})    # Call function. Cursor first. A crash before the truncate only replays unchanged records.
+                journalFile.truncate(0)
+                os.fsync(journalFile.fileno())
+            # End Loop
+        finally:
+            fcntl.flock(journalFile, fcntl.LOCK_UN)
+        # End Loop
+    # End Loop
+    # End Function  
+
+
+
+def fsyncDirectory (filePath):   # fsyncs the folder of a file, so a created or renamed file survives a crash
+    directoryFd = os.open(os.path.dirname(os.path.abspath(filePath)), os.O_RDONLY)
+    try:
+        os.fsync(directoryFd)
+    finally:
+        os.close(directoryFd)
+    # End Function  
+
+
+
+def bulkHandler(context, inputs):   # Action entry function for a full-tenant sync. Set as the action entrypoint to seed or re-seed the Git project.
+    return bulkSync(context, inputs, "BULK_SYNC")    # Call function
+    # End Function  
+
+
+
+def reconcileHandler(context, inputs):   # Action entry function for drift reconciliation. Set as the action entrypoint and run periodically to repair missed or failed events.
+    return bulkSync(context, inputs, "RECONCILE")    # Call function
+    # End Function  
+
+
+
+def bulkSync(context, inputs, syncMode):   # Syncs all blueprints. BULK_SYNC fetches and compares every blueprint. RECONCILE fetches only blueprints changed since their manifest entry and also deletes blueprints removed from Assembly.
+
+    fn = {"BULK_SYNC": "bulkHandler -", "RECONCILE": "reconcileHandler -"}[syncMode]    # Funciton name 
+    metricsStart()    # Call function
+    deadlineStart()    # Call function
+    print("[ABX] "+fn+" Action started.")
+    print("[ABX] "+fn+" Function started.")
+    
+    
+    # ----- Inputs  ----- #     
+    
+    actionInputs = {}  
+    actionInputs['actionOptionRunOnBlueprintOption'] = inputs['actionOptionRunOnBlueprintOptionIn'].lower()
+    actionInputs['runOnBlueprintOption'] = inputs['runOnBlueprintOptionIn'].replace('"','').lower()
+    actionInputs['gitProjectFolder'] = inputs['gitProjectFolderIn']
+    actionInputs['gitProjectId'] = inputs['gitProjectIdIn']
+    actionInputs['bulkMaxWorkers'] = inputs.get('bulkMaxWorkersIn', bulkMaxWorkers)
+    actionInputs['bulkCommitChunkSize'] = inputs.get('bulkCommitChunkSizeIn', bulkCommitChunkSize)
+    actionInputs['eventType'] = syncMode
+    actionInputs['userName'] = "www.kaloferov.com"
+    actionInputs['invocationId'] = uuid.uuid4().hex
+    
+    actionInputsRead(inputs, actionInputs)    # Call function. Adds the secrets inputs, replaces empty values and parses blueprintExtraFieldsIn.
+    
+    actionInputs['bulkMaxWorkers'] = int(actionInputs['bulkMaxWorkers'] or bulkMaxWorkers)
+    actionInputs['bulkCommitChunkSize'] = int(actionInputs['bulkCommitChunkSize'] or bulkCommitChunkSize)
+    
+    
+    # ----- Secrets / CSP Token / Git  ----- #     
+    
+    # The blueprint listing and the Git tree listing and manifest read overlap. One recursive tree listing gives the blob sha of every file.
+    gFolder = actionInputs['gitProjectFolder']    # Root repo folder
+    blueprintListing = {}    # totalElements and complete of the blueprint listing
+    print("[ABX] "+fn+" Listing Blueprints and Git files...")
+    dagResults = dagRun({    # Call function
+        'secrets': ([], lambda dagResults: dagStep("secretFetch", actionGetSecrets, context, inputs, actionInputs)),
+        'cspToken': (['secrets'], lambda dagResults: dagStep("cspLogin", cspLogin, actionInputs)),
+        'blueprintList': (['cspToken'], lambda dagResults: dagStep("blueprintList", list, blueprintListAll(actionInputs, listing=blueprintListing))),
+        'gitProject': (['secrets'], lambda dagResults: dagStep("gitConnect", getGitlabProject, gitBaseUrl, str(actionInputs['gitPrivateToken']), actionInputs['gitProjectId'])),    # Get project. Cached across warm invocations.
+        'gitFiles': (['gitProject'], lambda dagResults: dagStep("gitListFiles", gitListFiles, dagResults['gitProject'], gFolder, gitDefaultBranch)),
+        'gitManifest': (['gitFiles'], lambda dagResults: gitManifestReadAll(dagResults['gitProject'], gFolder, gitDefaultBranch, dagResults['gitFiles'])),    # Only records changed since the last run are downloaded
+    })
+    
+    
+    # ----- Script ----- #
+    
+    gPproject = dagResults['gitProject']
+    gExistingFiles = dagResults['gitFiles']
+    gManifest, gManifestCommitIds = dagResults['gitManifest']
+    gManifestTexts = { blueprintId: gitManifestDump(gitManifestRecord(gManifest, blueprintId)) for blueprintId in gManifestCommitIds }
+    blueprintSummaries = dagResults['blueprintList']
+    blueprintIds = [ blueprintSummary['id'] for blueprintSummary in blueprintSummaries ]
+    
+    # RECONCILE: blueprints not updated since their manifest entry, whose file still matches the entry, are in sync. Their content is not fetched.
+    blueprintsUnchanged = []
+    blueprintIdsFetch = []
+    for blueprintSummary in blueprintSummaries:
+        gPreviousEntry = gManifest['blueprints'].get(blueprintSummary['id'])
+        if ((syncMode == "RECONCILE") and (gPreviousEntry is not None) and blueprintSummary.get('updatedAt') and (gPreviousEntry.get('updatedAt') == blueprintSummary['updatedAt']) and (gPreviousEntry['name'] == blueprintSummary.get('name')) and (gExistingFiles.get(gPreviousEntry['path']) == gPreviousEntry['contentSha'])):
+            blueprintsUnchanged.append(blueprintSummary['id'])
+        else:
+            blueprintIdsFetch.append(blueprintSummary['id'])
+    # End Loop
+    
+    # Get Blueprints
+    print("[ABX] "+fn+" Found "+str(len(blueprintIds))+" Blueprints. Getting content of "+str(len(blueprintIdsFetch))+" with "+str(actionInputs['bulkMaxWorkers'])+" workers...")
+    blueprints = []
+    blueprintsFailed = []
+    with metricsSpan("blueprintFetch"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=actionInputs['bulkMaxWorkers']) as executor:
+            futures = { executor.submit(blueprintGet, actionInputs, blueprintId): blueprintId for blueprintId in blueprintIdsFetch }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    blueprints.append(future.result())
+                except Exception as e:
+                    print("[ABX] "+fn+" Failed to get Blueprint "+futures[future]+": "+str(e))
+                    blueprintsFailed.append(futures[future])
+        # End Loop
+    # End Loop
+    blueprints.sort(key=lambda blueprintJson: blueprintJson['name'])    # Stable commit content order
+    
+    # Build commit actions. Only changed files get an action.
+    gitActions = []
+    blueprintsSkipped = []
+    blueprintsDeleted = []
+    for blueprintJson in blueprints:
+        blueprintYaml = lazyImport('yaml').safe_load(blueprintJson['content']) or {}    # Parsed once and not kept. Keeping the parsed trees of all blueprints would not fit memoryInMB on large tenants.
+        blueprintOptions = blueprintYaml.get('options') or {}
+        if ((actionInputs['actionOptionRunOnBlueprintOption'] == "true") and (runOnEvaluate(actionInputs['runOnBlueprintOption'], blueprintOptions) == False)):
+            blueprintsSkipped.append(blueprintJson['id'])
+            continue
+        # End Loop
+        gPreviousEntry = gManifest['blueprints'].get(blueprintJson['id'])
+        blueprintVersion = (gPreviousEntry or {}).get('version') or None    # Keep the version of the last synced release
+        gFilepath = gitBlueprintFilepath(gFolder, blueprintJson['name'])
+        blueprint = blueprintRewrite(blueprintJson['content'], blueprintVersion, blueprintJson['name'], actionInputs['blueprintExtraFields'])
+        gManifestEntry = gitManifestEntry(gFilepath, blueprintJson['name'], blueprintVersion or blueprintYaml.get('version'), blueprint, blueprintOptions, blueprintJson.get('updatedAt'))    # Call function
+        gManifest['blueprints'][blueprintJson['id']] = gManifestEntry
+        if ((gPreviousEntry is not None) and (gPreviousEntry['path'] != gFilepath) and (gPreviousEntry['path'] in gExistingFiles) and (gFilepath not in gExistingFiles)):    # Renamed
+            gitActions.append({'action': "move", 'file_path': gFilepath, 'previous_path': gPreviousEntry['path'], 'content': blueprint})
+            continue
+        elif (gExistingFiles.get(gFilepath) == gManifestEntry['contentSha']):
+            blueprintsUnchanged.append(blueprintJson['id'])
+            continue
+        # End Loop
+        gitActions.append({
+            'action': "update" if (gFilepath in gExistingFiles) else "create",
+            'file_path': gFilepath,
+            'content': blueprint,
+        })
+    # End Loop
+    
+    # RECONCILE: delete blueprints removed from Assembly, if their manifest entry has gitlabSyncDelete set. Only planned from a complete listing, as a blueprint missing from a partial listing would be deleted.
+    blueprintsDeleteCheck = ""
+    if (syncMode == "RECONCILE"):
+        if ((blueprintListing.get('complete') != True) or (blueprintListing.get('totalElements') != len(set(blueprintIds)))):
+            blueprintsDeleteCheck = "Listed "+str(len(set(blueprintIds)))+" of "+str(blueprintListing.get('totalElements'))+" blueprints. Deletes skipped."
+            print("[ABX] "+fn+" "+blueprintsDeleteCheck+" The listing changed while paging or is incomplete. Run again to delete.")
+        else:
+            blueprintsDeleteCheck = "passed"
+    # End Loop
+    if (blueprintsDeleteCheck == "passed"):
+        for blueprintId in sorted(set(gManifest['blueprints']) - set(blueprintIds)):
+            gPreviousEntry = gManifest['blueprints'][blueprintId]
+            if (gPreviousEntry['gitlabSyncDelete'] != True):
+                continue
+            # End Loop
+            del gManifest['blueprints'][blueprintId]
+            blueprintsDeleted.append(blueprintId)
+            if (gPreviousEntry['path'] in gExistingFiles):
+                gitActions.append({'action': "delete", 'file_path': gPreviousEntry['path']})
+        # End Loop
+    # End Loop
+    
+    gitFileActionCount = len(gitActions)
+    gitActions.extend(gitManifestActions(gFolder, gManifest, gManifestTexts, gManifestCommitIds))    # Call function. Last, so records are only written with or after their files.
+    
+    # Commit
+    print("[ABX] "+fn+" Git - Committing "+str(gitFileActionCount)+" file(s)...")
+    gitCommits = gitCommitActions(gPproject, gitActions, gitDefaultBranch, {"BULK_SYNC": 'Bulk synced by www.kaloferov.com', "RECONCILE": 'Reconciled by www.kaloferov.com'}[syncMode], actionInputs['bulkCommitChunkSize'])    # Call function
+    
+    
+    # ----- Outputs ----- #
+    
+    resp_bulkSync = {   # Set function response 
+        "blueprintsFound": len(blueprintIds),
+        "blueprintsFetched": len(blueprintIdsFetch),
+        "blueprintsSynced": gitFileActionCount - len(blueprintsDeleted),
+        "blueprintsSkipped": blueprintsSkipped,
+        "blueprintsUnchanged": blueprintsUnchanged,
+        "blueprintsDeleted": blueprintsDeleted,
+        "blueprintsDeleteCheck": blueprintsDeleteCheck,    # RECONCILE: passed, or why deletes were skipped
+        "blueprintsFailed": blueprintsFailed,
+        "gitActions": { gitAction: len([ action for action in gitActions[:gitFileActionCount] if (action['action'] == gitAction) ]) for gitAction in ["create", "update", "move", "delete"] },
+        "gitCommits": gitCommits,
+    }
+    outputs = {   # Set action outputs
+       "resp_"+fn.replace(" -", ""): resp_bulkSync,
+       "metrics": metricsResult(actionInputs),
+    }
+    print("[ABX] "+fn+" Function return: \n" + json.dumps(resp_bulkSync))    # Write function responce to console  
+    print("[ABX] "+fn+" Function completed.")     
+    print("[ABX] "+fn+" Action completed.")     
+    
+    return outputs    # Return outputs 
+    # End Function  
+
+
+
+def backfillHandler(context, inputs):   # Action entry function for the version history backfill. Set as the action entrypoint and run until backfillStatus is complete.
+    fn = "backfillHandler -"    # Funciton name 
+    metricsStart()    # Call function
+    deadlineStart()    # Call function
+    print("[ABX] "+fn+" Action started.")
+    print("[ABX] "+fn+" Function started.")
+    
+    
+    # ----- Inputs  ----- #     
+    
+    actionInputs = {}  
+    actionInputs['backfillBlueprintIds'] = inputs.get('backfillBlueprintIdsIn', "")
+    actionInputs['gitProjectFolder'] = inputs['gitProjectFolderIn']
+    actionInputs['gitProjectId'] = inputs['gitProjectIdIn']
+    actionInputs['eventType'] = "BACKFILL"
+    actionInputs['userName'] = "www.kaloferov.com"
+    actionInputs['invocationId'] = uuid.uuid4().hex
+    
+    actionInputsRead(inputs, actionInputs)    # Call function. Adds the secrets inputs, replaces empty values and parses blueprintExtraFieldsIn.
+    actionInputs['backfillBlueprintIds'] = [ blueprintId.strip() for blueprintId in actionInputs['backfillBlueprintIds'].split(",") if blueprintId.strip() ]    # Empty for all blueprints
+    
+    
+    # ----- Secrets / CSP Token / Git  ----- #     
+    
+    gFolder = actionInputs['gitProjectFolder']    # Root repo folder
+    dagResults = dagRun({    # Call function
+        'secrets': ([], lambda dagResults: dagStep("secretFetch", actionGetSecrets, context, inputs, actionInputs)),
+        'cspToken': (['secrets'], lambda dagResults: dagStep("cspLogin", cspLogin, actionInputs)),
+        'blueprintList': (['cspToken'], lambda dagResults: dagStep("blueprintList", list, blueprintListAll(actionInputs))),
+        'gitProject': (['secrets'], lambda dagResults: dagStep("gitConnect", getGitlabProject, gitBaseUrl, str(actionInputs['gitPrivateToken']), actionInputs['gitProjectId'])),
+        'gitFiles': (['gitProject'], lambda dagResults: dagStep("gitListFiles", gitListFiles, dagResults['gitProject'], gFolder + gitManifestFolder, gitDefaultBranch)),    # Manifest records only
+        'gitManifest': (['gitFiles'], lambda dagResults: gitManifestReadAll(dagResults['gitProject'], gFolder, gitDefaultBranch, dagResults['gitFiles'])),
+    })
+    gPproject = dagResults['gitProject']
+    gManifest, gManifestCommitIds = dagResults['gitManifest']
+    
+    
+    # ----- Script ----- #
+    
+    # The cursor of each blueprint (offset, last version id, complete) is kept in the manifest and committed with the version it points at, so a run resumes exactly where the last one stopped
+    blueprintSummaries = sorted([ blueprintSummary for blueprintSummary in dagResults['blueprintList'] if ((len(actionInputs['backfillBlueprintIds']) == 0) or (blueprintSummary['id'] in actionInputs['backfillBlueprintIds'])) ], key=lambda blueprintSummary: blueprintSummary['id'])
+    backfillCursors = dict(gManifest['backfill'])
+    pendingCursors = {}    # Cursors of versions that changed nothing in Git. Committed with the next version, or on their own at the end.
+    backfillStatus = "complete"
+    blueprintsFailed = []    # Blueprints whose versions could not be read. Their cursors stay incomplete.
+    versionsReplayed = 0
+    versionsUnchanged = 0
+    gitCommits = 0
+    
+    def planCursors (manifest, verifyFiles):   # Returns no file actions. Saves the pending cursors.
+        manifest['backfill'].update(pendingCursors)
+        return [], "backfillCursor"
+        # End Function  
+    
+    for blueprintSummary in blueprintSummaries:
+        blueprintId = blueprintSummary['id']
+        backfillCursor = backfillCursors.get(blueprintId) or {'offset': 0}
+        if (backfillCursor.get('complete') == True):
+            continue
+        print("[ABX] "+fn+" Backfilling blueprint "+blueprintId+" from version offset "+str(backfillCursor['offset'])+"...")
+        gFilepath = gitBlueprintFilepath(gFolder, blueprintSummary['name'])    # Current name, so renames do not move the history around
+        deadlineReached = False
+        blueprintVersions = blueprintVersionsAll(actionInputs, blueprintId, backfillCursor['offset'])    # Call function
+        while True:
+            try:
+                versionOffset, blueprintVersion = next(blueprintVersions)
+            except StopIteration:
+                break
+            except Exception as e:    # The cursor keeps the versions committed so far. The next run continues from it.
+                print("[ABX] "+fn+" Failed to read the versions of blueprint "+blueprintId+": "+type(e).__name__+": "+str(e))
+                blueprintsFailed.append(blueprintId)
+                break
+            # End Loop
+            if ((deadlineRemaining() is not None) and (deadlineRemaining() < backfillStopSeconds)):
+                deadlineReached = True
+                break
+            blueprint = blueprintRewrite(blueprintVersion['content'], str(blueprintVersion['version']), blueprintSummary['name'], actionInputs['blueprintExtraFields'])    # Call function
+            blueprintOptions = (lazyImport('yaml').safe_load(blueprintVersion['content']) or {}).get('options') or {}
+            gManifestEntry = gitManifestEntry(gFilepath, blueprintSummary['name'], blueprintVersion['version'], blueprint, blueprintOptions)    # Call function
+            backfillCursor = {'offset': versionOffset + 1, 'versionId': blueprintVersion.get('id', "")}
+            pendingCursors[blueprintId] = backfillCursor
+            
+            def planVersion (manifest, verifyFiles):   # Returns the file actions of one version. Updates the manifest entry and the cursors.
+                previousEntry = manifest['blueprints'].get(blueprintId)
+                manifest['blueprints'][blueprintId] = gManifestEntry
+                manifest['backfill'].update(pendingCursors)
+                gitActions, gitSyncStatus = gitPlanBlueprintActions(gPproject, gitDefaultBranch, previousEntry, gManifestEntry, blueprint, verifyFiles)
+                return gitActions, ("backfilled" if (len(gitActions) > 0) else "unchanged")
+                # End Function  
+            
+            previousEntry = gManifest['blueprints'].get(blueprintId)
+            if ((previousEntry is not None) and (previousEntry['path'] == gFilepath) and (previousEntry['contentSha'] == gManifestEntry['contentSha'])):
+                versionsUnchanged += 1
+                continue
+            # End Loop
+            gitSyncStatus, gitCommitId = gitManifestCommit(gPproject, gFolder, gitDefaultBranch, sorted(pendingCursors), planVersion, actionInputs['userName'], {'version': blueprintVersion['version'], 'createdAt': blueprintVersion.get('createdAt', "")})    # Call function
+            gManifest['blueprints'][blueprintId] = gManifestEntry
+            pendingCursors.clear()
+            versionsReplayed += 1
+            gitCommits += 1 if gitCommitId else 0
+        # End Loop
+        if (deadlineReached):
+            print("[ABX] "+fn+" Deadline reached. Saving cursor. Run again to continue.")
+            backfillStatus = "pending"
+            break
+        elif (blueprintId in blueprintsFailed):
+            backfillStatus = "pending"
+            continue
+        # End Loop
+        pendingCursors[blueprintId] = backfillCursors[blueprintId] = dict(backfillCursor, complete=True)
+        print("[ABX] "+fn+" Blueprint "+blueprintId+" history complete.")
+    # End Loop
+    
+    if (len(pendingCursors) > 0):    # Cursors of unchanged versions and completed blueprints
+        gitSyncStatus, gitCommitId = gitManifestCommit(gPproject, gFolder, gitDefaultBranch, sorted(pendingCursors), planCursors, actionInputs['userName'])    # Call function
+        gitCommits += 1 if gitCommitId else 0
+    # End Loop
+    
+    
+    # ----- Outputs ----- #
+    
+    resp_backfillHandler = {   # Set function response 
+        "backfillStatus": backfillStatus,    # complete / pending
+        "blueprintsComplete": len([ blueprintSummary for blueprintSummary in blueprintSummaries if (backfillCursors.get(blueprintSummary['id'], {}).get('complete') == True) ]),
+        "blueprintsFound": len(blueprintSummaries),
+        "blueprintsFailed": blueprintsFailed,
+        "versionsReplayed": versionsReplayed,
+        "versionsUnchanged": versionsUnchanged,
+        "gitCommits": gitCommits,
+    }
+    outputs = {   # Set action outputs
+       "resp_backfillHandler": resp_backfillHandler,
+       "metrics": metricsResult(actionInputs),
+    }
+    print("[ABX] "+fn+" Function return: \n" + json.dumps(resp_backfillHandler))    # Write function responce to console  
+    print("[ABX] "+fn+" Function completed.")     
+    print("[ABX] "+fn+" Action completed.")     
+    
+    return outputs    # Return outputs 
+    # End Function  
+
+
+
+def eventClassify (inputs):   # Returns (eventType, eventTopicId) read from the event payload fields
+    if ('eventType' not in inputs):
+        eventType = "TEST"
+    elif (inputs['eventType'] in eventHandlers):
+        eventType = inputs['eventType']
+    else:
+        eventType = "UNSUPPORTED"
+    # End Loop
+    
+    eventTopicId = inputs.get('eventTopicId', (inputs.get('__metadata') or {}).get('eventTopicId'))
+    if (eventTopicId is None):
+        eventTopicId = "TEST"
+    elif (eventTopicId not in [ eventHandler['eventTopicId'] for eventHandler in eventHandlers.values() ]):
+        eventTopicId = "UNSUPPORTED"
+    # End Loop
+    
+    return eventType, eventTopicId
+    # End Function  
+
+
+
+def eventRegisterHandler (eventType, eventTopicId, payloadFunction):   # Registers a supported event type. payloadFunction(inputs) returns the blueprintId / blueprintVersion / blueprintName / userName found in the payload.
+    eventHandlers[eventType] = {
+        'eventTopicId': eventTopicId,
+        'payload': payloadFunction,
+    }
+    # End Function  
+
+
+
+def eventPayloadCreateBlueprintVersion (inputs):   # Payload fields of a CREATE_BLUEPRINT_VERSION event
+    return {
+        'blueprintId': inputs['blueprintId'],
+        'blueprintVersion': inputs['version'],
+        'blueprintName': inputs['blueprintName'],
+        'userName': inputs['__metadata']['userName'],
+    }
+    # End Function  
+
+
+
+def eventPayloadDeleteBlueprint (inputs):   # Payload fields of a DELETE_BLUEPRINT event
+    return {
+        'blueprintId': inputs['id'],
+        'blueprintVersion': "",
+        'blueprintName': inputs['name'],
+        'userName': inputs['__metadata']['userName'],
+    }
+    # End Function  
+
+
+
+def eventPayloadTest (inputs):   # TEST events use the action inputs
+    return {}
+    # End Function  
+
+
+
+def runOnCompile (runOnRule):   # Compiles a runOn rule. Terms are "key: value" or "value", joined with && and ||. Keys and values support * ? [] wildcards.
+    compiledRule = runOnRuleCache.get(runOnRule)
+    if (compiledRule is not None):
+        return compiledRule
+    # End Loop
+    
+    compiledRule = []    # Any of [ all of [ (keyRegex, valueRegex) ] ]
+    for ruleOrTerm in runOnRule.split('||'):
+        compiledAndTerms = []
+        for ruleAndTerm in ruleOrTerm.split('&&'):
+            ruleAndTerm = ruleAndTerm.replace('"','').strip().lower()
+            if (ruleAndTerm == ""):
+                continue
+            if (": " in ruleAndTerm):
+                keyPattern, valuePattern = ruleAndTerm.split(": ", 1)
+                compiledAndTerms.append((re.compile(fnmatch.translate(keyPattern.strip())), re.compile(fnmatch.translate(valuePattern.strip()))))
+            else:
+                compiledAndTerms.append((None, re.compile(fnmatch.translate(ruleAndTerm))))    # Matches any key or value
+        # End Loop
+        if (len(compiledAndTerms) > 0):
+            compiledRule.append(compiledAndTerms)
+    # End Loop
+    
+    runOnRuleCache[runOnRule] = compiledRule
+    return compiledRule
+    # End Function  
+
+
+
+def runOnEvaluate (runOnRule, runOnMatch):   # True when the parsed structure (payload, blueprint options) matches the runOn rule. An empty rule always matches.
+    compiledRule = runOnCompile(runOnRule)
+    if (len(compiledRule) == 0):
+        return True
+    matchPairs = list(runOnFlatten(runOnMatch))
+    for compiledAndTerms in compiledRule:
+        if all(runOnTermMatches(compiledTerm, matchPairs) for compiledTerm in compiledAndTerms):
+            return True
+    # End Loop
+    return False
+    # End Function  
+
+
+
+def runOnTermMatches (compiledTerm, matchPairs):   # True when any (key, value) pair matches a compiled rule term
+    keyRegex, valueRegex = compiledTerm
+    for matchKey, matchValue in matchPairs:
+        if (keyRegex is None):
+            if (valueRegex.match(matchKey) or valueRegex.match(matchValue)):
+                return True
+        elif (keyRegex.match(matchKey) and valueRegex.match(matchValue)):
+            return True
+    # End Loop
+    return False
+    # End Function  
+
+
+
+def runOnFlatten (runOnMatch, parentKey=""):   # Yields lowercase (key, value) pairs for every scalar in a parsed structure
+    if isinstance(runOnMatch, dict):
+        for key, value in runOnMatch.items():
+            for matchPair in runOnFlatten(value, str(key).lower()):
+                yield matchPair
+    elif isinstance(runOnMatch, (list, tuple)):
+        for value in runOnMatch:
+            for matchPair in runOnFlatten(value, parentKey):
+                yield matchPair
+    elif isinstance(runOnMatch, bool):
+        yield (parentKey, str(runOnMatch).lower())
+    elif (runOnMatch is None):
+        yield (parentKey, "")
+    else:
+        yield (parentKey, str(runOnMatch).lower())
+    # End Loop
+    # End Function  
+
+
+
+def runOnParseMatchString (runOnMatchString):   # Parses "key: value" pairs from an action input (one per line or comma separated) into a dict
+    runOnMatch = {}
+    for matchTerm in re.split(r'[,\n]', str(runOnMatchString)):
+        if (": " in matchTerm):
+            key, value = matchTerm.split(": ", 1)
+            runOnMatch[key.replace('"','').strip().lower()] = value.replace('"','').strip().lower()
+        elif (matchTerm.strip() != ""):
+            runOnMatch[matchTerm.replace('"','').strip().lower()] = ""
+    # End Loop
+    return runOnMatch
+    # End Function  
+
+
+
+def actionInputsRead (inputs, actionInputs):   # Completes the actionInputs of an entrypoint. Adds the secrets and metrics inputs the entrypoint did not set, replaces empty, optional, "" and '' values with "" and parses blueprintExtraFieldsIn.
+    actionInputs.setdefault('actionOptionUseAwsSecretsManager', inputs['actionOptionUseAwsSecretsManagerIn'].lower())
+    actionInputs.setdefault('awsSmCspTokenSecretId', inputs['awsSmCspTokenSecretIdIn'])
+    actionInputs.setdefault('awsSmGitTokenSecretId', inputs['awsSmGitTokenSecretIdIn'])
+    actionInputs.setdefault('awsSmRegionName', inputs['awsSmRegionNameIn'])
+    actionInputs.setdefault('secretsProvider', inputs.get('secretsProviderIn', "aws"))
+    actionInputs.setdefault('actionOptionMetricsLog', inputs.get('actionOptionMetricsLogIn', "False").lower())
+    actionInputs.setdefault('cspRefreshToken', inputs['cspRefreshTokenIn'])
+    actionInputs.setdefault('gitPrivateToken', inputs['gitPrivateTokenIn'])
+    
+    # replace any emptry , optional, "" or '' inputs with empty value 
+    for key, value in actionInputs.items(): 
+        if (("Optional".lower() in str(value).lower()) or ("empty".lower() in str(value).lower()) or ('""' in str(value).lower())  or ("''" in str(value).lower())):
+            actionInputs[key] = ""
+    # End Loop
+    actionInputs['blueprintExtraFields'] = actionInputsJson(inputs, 'blueprintExtraFieldsIn', dict) or {}    # Top-level fields added to synced blueprints. Read after the replace, as JSON may hold "" or "empty" values.
+    return actionInputs
+    # End Function  
+
+
+
+def actionInputsJson (inputs, inputName, jsonType):   # Returns the parsed JSON object (jsonType dict) or list (jsonType list) of an input. None if the input does not start with { or [ (empty, or a placeholder such as <Optional>). Raises ValueError on invalid JSON.
+    inputJson = str(inputs.get(inputName, "")).strip()
+    if (not inputJson.startswith({dict: "{", list: "["}[jsonType])):
+        return None
+    try:
+        return json.loads(inputJson)
+    except ValueError as e:
+        raise ValueError(inputName+" is not valid JSON: "+str(e))
+    # End Function  
+
+
+
+def actionGetSecrets (context, inputs, actionInputs):   # Sets cspRefreshToken and gitPrivateToken in actionInputs from the configured secrets source
+    fn = "actionGetSecrets -"    # Holds the funciton name. 
+    if (actionInputs['actionOptionUseAwsSecretsManager'] == "true"):
+        secretsProvider = actionInputs.get('secretsProvider') or "aws"
+        print("[ABX] "+fn+" Auth/Secrets source: "+("AWS Secrets Manager" if (secretsProvider == "aws") else secretsProvider))
+        awsSecretId_csp = actionInputs['awsSmCspTokenSecretId']
+        awsSecretId_git = actionInputs['awsSmGitTokenSecretId']
+        secrets = secretsGet(secretsProvider, [awsSecretId_csp, awsSecretId_git], {'region': actionInputs['awsSmRegionName']})    # Call function
+        actionInputs['cspRefreshToken'] = secrets[awsSecretId_csp]
+        actionInputs['gitPrivateToken'] = secrets[awsSecretId_git]
+    else:
+        # use action inputs
+        print("[ABX] "+fn+" Auth/Secrets source: Action Inputs")
+    # End Loop
+    # End Function  
+
+
+
+def blueprintListAll (actionInputs, pageSize=100, listing=None):   # Yields all blueprint summaries page by page. Raises if a page fails. listing, if given, gets totalElements and complete (True once the last page was read).
+    pageSkip = 0
+    while True:
+        resp_listBlueprints_callUrl = cspBaseApiUrl + '/blueprint/api/blueprints?$top='+str(pageSize)+'&$skip='+str(pageSkip)+'&apiVersion=2019-09-12'
+        resp_listBlueprints_call = cspApiGet(actionInputs, resp_listBlueprints_callUrl)    # Call function
+        resp_listBlueprints_call.raise_for_status()    # An error body is not an empty page
+        resp_listBlueprints_json = json.loads(resp_listBlueprints_call.text)
+        blueprintPage = resp_listBlueprints_json.get('content', [])
+        if (listing is not None):
+            listing['totalElements'] = resp_listBlueprints_json.get('totalElements')
+        for blueprintSummary in blueprintPage:
+            yield blueprintSummary
+        if (len(blueprintPage) < pageSize):
+            break
+        pageSkip += pageSize
+    # End Loop
+    if (listing is not None):
+        listing['complete'] = True
+    # End Function  
+
+
+
+def blueprintVersionsAll (actionInputs, blueprintId, startOffset=0, pageSize=backfillPageSize):   # Yields (offset, version) for the versions of a blueprint, oldest first, page by page from startOffset. Raises if a page or version fails.
+    pageSkip = startOffset
+    while True:
+        resp_listVersions_callUrl = cspBaseApiUrl + '/blueprint/api/blueprints/'+blueprintId+'/versions?$top='+str(pageSize)+'&$skip='+str(pageSkip)+'&$orderby=createdAt%20asc&apiVersion=2019-09-12'
+        resp_listVersions_call = cspApiGet(actionInputs, resp_listVersions_callUrl)    # Call function
+        resp_listVersions_call.raise_for_status()    # An error body is not an empty page
+        versionPage = json.loads(resp_listVersions_call.text).get('content', [])
+        for pageIndex, blueprintVersion in enumerate(versionPage):
+            if ('content' not in blueprintVersion):    # Listings without content
+                resp_getVersion_callUrl = cspBaseApiUrl + '/blueprint/api/blueprints/'+blueprintId+'/versions/'+str(blueprintVersion['version'])+'?apiVersion=2019-09-12'
+                resp_getVersion_call = cspApiGet(actionInputs, resp_getVersion_callUrl)    # Call function
+                resp_getVersion_call.raise_for_status()
+                blueprintVersion = json.loads(resp_getVersion_call.text)
+            yield pageSkip + pageIndex, blueprintVersion
+        # End Loop
+        if (len(versionPage) < pageSize):
+            break
+        pageSkip += pageSize
+    # End Loop
+    # End Function  
+
+
+
+def blueprintGet (actionInputs, blueprintId):   # Returns the blueprint including its content. Fetched at most once per invocation, revalidated with ETag across warm invocations.
+    fn = "blueprintGet -"    # Holds the funciton name. 
+    cachedBlueprint = blueprintCache.get(blueprintId)
+    if ((cachedBlueprint is not None) and (cachedBlueprint['invocationId'] == actionInputs['invocationId'])):
+        return cachedBlueprint['json']
+    # End Loop
+    
+    resp_getBlueprint_callUrl = cspBaseApiUrl + '/blueprint/api/blueprints/'+blueprintId+'?$select=*&apiVersion=2019-09-12'
+    extraHeaders = {}
+    if ((cachedBlueprint is not None) and cachedBlueprint['etag']):
+        extraHeaders['If-None-Match'] = cachedBlueprint['etag']
+    resp_getBlueprint_call = cspApiGet(actionInputs, resp_getBlueprint_callUrl, extraHeaders)    # Call function
+    
+    if ((resp_getBlueprint_call.status_code == 304) and (cachedBlueprint is not None)):
+        print("[ABX] "+fn+" Blueprint "+blueprintId+" not modified. Using cached Blueprint.")
+        cachedBlueprint['invocationId'] = actionInputs['invocationId']
+        return cachedBlueprint['json']
+    # End Loop
+    resp_getBlueprint_call.raise_for_status()
+    
+    cachedBlueprint = {
+        'invocationId': actionInputs['invocationId'],
+        'etag': resp_getBlueprint_call.headers.get('ETag'),
+        'json': json.loads(resp_getBlueprint_call.text),
+        'bytes': len(resp_getBlueprint_call.text),
+    }
+    with blueprintCacheLock:
+        blueprintCacheSize['bytes'] -= blueprintCache.pop(blueprintId, {}).get('bytes', 0)
+        while ((len(blueprintCache) > 0) and (blueprintCacheSize['bytes'] + cachedBlueprint['bytes'] > blueprintCacheMaxBytes)):
+            blueprintCacheSize['bytes'] -= blueprintCache.pop(next(iter(blueprintCache)))['bytes']    # Evict oldest. A blueprint larger than the cap is kept alone.
+        # End Loop
+        blueprintCache[blueprintId] = cachedBlueprint
+        blueprintCacheSize['bytes'] += cachedBlueprint['bytes']
+    # End Loop
+    
+    return cachedBlueprint['json']
+    # End Function  
+
+
+
+def blueprintGetYaml (actionInputs, blueprintId):   # Returns the parsed blueprint content. Parsed at most once per invocation.
+    blueprintJson = blueprintGet(actionInputs, blueprintId)
+    with blueprintCacheLock:
+        if (blueprintYamlCache['invocationId'] != actionInputs['invocationId']):    # Trees of earlier invocations are dropped
+            blueprintYamlCache['invocationId'] = actionInputs['invocationId']
+            blueprintYamlCache['yaml'] = {}
+        # End Loop
+        blueprintYaml = blueprintYamlCache['yaml'].get(blueprintId)
+    # End Loop
+    if (blueprintYaml is not None):
+        return blueprintYaml
+    blueprintYaml = lazyImport('yaml').safe_load(blueprintJson['content']) or {}
+    blueprintYamlCache['yaml'][blueprintId] = blueprintYaml
+    return blueprintYaml
+    # End Function  
+
+
+
+def blueprintRewrite (blueprint, blueprintVersion, blueprintName, extraFields=None):   # Overrides the top-level blueprint version and name values in one pass. A version of None leaves the version as is. extraFields are set or added as top-level fields.
+    fields = {}
+    fields.update(extraFields or {})
+    if (blueprintVersion is not None):
+        fields['version'] = blueprintVersion
+    fields['name'] = blueprintName
+    
+    # Single pass over the column 0 keys. Nested keys (e.g. resource name:) are indented and never match.
+    pieces = []
+    fieldsSet = set()
+    insertAt = None    # Missing extra fields are added after the first overridden field
+    position = 0
+    firstLinePattern, linePattern = blueprintFieldPattern(tuple(sorted(fields)))
+    firstLineMatch = firstLinePattern.match(blueprint)
+    fieldMatches = linePattern.finditer(blueprint, firstLineMatch.end() if (firstLineMatch is not None) else 0)    # Searches for line breaks followed by a key. Much faster than ^ with re.MULTILINE.
+    if (firstLineMatch is not None):
+        fieldMatches = itertools.chain([firstLineMatch], fieldMatches)
+    for match in fieldMatches:
+        fieldKey = match.group('key')
+        if (fieldKey in fieldsSet):    # Duplicate top-level key. Only the first one is overridden.
+            continue
+        # End Loop
+        fieldsSet.add(fieldKey)
+        pieces.append(blueprint[position:match.start('key')])
+        pieces.append(fieldKey + ": " + blueprintFieldValue(fields[fieldKey]) + "    # Value overridden by ABX Action")
+        position = match.end()
+        if (insertAt is None):
+            insertAt = len(pieces)
+    # End Loop
+    pieces.append(blueprint[position:])
+    
+    fieldsMissing = [ fieldKey for fieldKey in (extraFields or {}) if fieldKey not in fieldsSet ]
+    if (len(fieldsMissing) > 0):
+        lineBreak = "\r\n" if ("\r\n" in blueprint[:4096]) else "\n"
+        fieldsText = "".join( fieldKey + ": " + blueprintFieldValue(fields[fieldKey]) + "    # Value overridden by ABX Action" + lineBreak for fieldKey in fieldsMissing )
+        if (insertAt is not None):
+            pieces.insert(insertAt, lineBreak + fieldsText.rstrip("\r\n"))
+        elif (blueprint.startswith("---")):    # After the document start marker
+            documentStart, separator, documentRest = blueprint.partition("\n")
+            pieces = [documentStart + separator + fieldsText + documentRest]
+        else:
+            pieces.insert(0, fieldsText)
+        # End Loop
+    # End Loop
+    
+    return "".join(pieces)
+    # End Function  
+
+
+
+def blueprintFieldPattern (fieldKeys):   # Returns the compiled top-level field patterns (first line, following lines) for a tuple of keys. Cached per key tuple.
+    fieldPatterns = blueprintFieldPatterns.get(fieldKeys)
+    if (fieldPatterns is None):
+        # key: value at column 0, plus the indented continuation lines of multi-line values (e.g. name: >). Line breaks (\n or \r\n) are kept.
+        fieldPattern = r'(?P<key>' + "|".join(re.escape(fieldKey) for fieldKey in fieldKeys) + r')[ \t]*:(?:[ \t][^\r\n]*)?(?:\r?\n(?:[ \t]*\r?\n)*[ \t]+\S[^\r\n]*)*'
+        fieldPatterns = (re.compile(fieldPattern), re.compile(r'\n' + fieldPattern))
+        blueprintFieldPatterns[fieldKeys] = fieldPatterns
+    return fieldPatterns
+    # End Function  
+
+
+
+def blueprintFieldValue (value):   # Returns a YAML value for blueprintRewrite. Strings are written as is, other values as JSON (valid YAML flow style).
+    if (isinstance(value, str)):
+        return value
+    return json.dumps(value)
+    # End Function  
+
+
+
+def gitBlueprintFilepath (gitProjectFolder, blueprintName):   # Returns the Git file path for a blueprint name
+    gFilename = "/blueprint.yaml"    # Blueprint name
+    gBlueprintNameFolder = blueprintName.lower().replace(" ",'-').replace("(",'-').replace(")",'-').replace("{",'-').replace("}",'-').replace("_",'-').replace("=",'-').replace("+",'-').replace(".",'-').replace(",",'-').replace("--",'-').replace("--",'-') # convert to path [a-z\-]
+    return gitProjectFolder + gBlueprintNameFolder + gFilename
+    # End Function  
+
+
+
+def awsSessionManagerGetSecret (context, inputs, awsSecretId_csp, awsSecretId_git, awsRegionName):  # Retrieves AWS Secrets Manager Secrets
+    # Ref: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/secretsmanager.html
+    fn = "awsSessionManagerGetSecret -"    # Holds the funciton name. 
+    print("[ABX] "+fn+" Function started.")
+    
+    
+    # ----- Script ----- #
+    
+    # Get Secrets. Both secrets in one call, cached across warm invocations.
+    print("[ABX] "+fn+" AWS Secrets Manager - Getting secret(s)...")
+    awsSecrets = secretsGet("aws", [awsSecretId_csp, awsSecretId_git], {'region': awsRegionName})    # Call function
+    
+    # ----- Outputs ----- #
+    
+    response = {   # Set action outputs
+        "awsSecret_csp" : str(awsSecrets[awsSecretId_csp]),
+        "awsSecret_git": str(awsSecrets[awsSecretId_git]),
+        }
+    print("[ABX] "+fn+" Function completed.")  
+    
+    return response    # Return response 
+    # End Function  
+
+
+
+def secretsGet (secretsProvider, secretIds, providerOptions):   # Returns {secretId: secret} from a secrets provider. Cached secrets are reused, missing ones are fetched in one batch.
+    fn = "secretsGet -"    # Holds the funciton name. 
+    secrets = {}
+    secretIdsMissing = []
+    for secretId in secretIds:
+        cacheKey = (secretsProvider, str(providerOptions.get('region', '')), secretId)
+        cachedSecret = secretCache.get(cacheKey)
+        if ((cachedSecret is not None) and (cachedSecret['expiresAt'] > time.time())):
+            secrets[secretId] = cachedSecret['value']
+        elif (secretId not in secretIdsMissing):
+            secretIdsMissing.append(secretId)
+    # End Loop
+    
+    if (len(secretIdsMissing) > 0):
+        print("[ABX] "+fn+" Getting "+str(len(secretIdsMissing))+" secret(s) from provider "+secretsProvider+"...")
+        secretStrings = secretProviders[secretsProvider](secretIdsMissing, providerOptions)    # Call function
+        for secretId in secretIdsMissing:
+            secrets[secretId] = secretParse(secretId, secretStrings[secretId])
+            cacheKey = (secretsProvider, str(providerOptions.get('region', '')), secretId)
+            secretCache[cacheKey] = {
+                'value': secrets[secretId],
+                'expiresAt': time.time() + secretCacheTtlSeconds,
+            }
+        # End Loop
+    else:
+        print("[ABX] "+fn+" Using cached secret(s).")
+    # End Loop
+    
+    return secrets    # Return response 
+    # End Function  
+
+
+
+def secretParse (secretId, secretString):   # Returns the secret value. JSON secrets are read from the key named after the secret id, or from their only key.
+    try:
+        secretJson = json.loads(secretString)
+    except ValueError:
+        return secretString    # Plain text secret
+    # End Loop
+    if (isinstance(secretJson, dict) and (secretId in secretJson)):
+        return str(secretJson[secretId])
+    elif (isinstance(secretJson, dict) and (len(secretJson) == 1)):
+        return str(list(secretJson.values())[0])
+    else:
+        return secretString
+    # End Loop
+    # End Function  
+
+
+
+def secretRegisterProvider (secretsProvider, providerFunction):   # Registers a secrets provider. providerFunction(secretIds, providerOptions) returns {secretId: secretString}.
+    secretProviders[secretsProvider] = providerFunction
+    # End Function  
+
+
+
+def secretProviderAws (secretIds, providerOptions):   # AWS Secrets Manager provider. One BatchGetSecretValue call, concurrent GetSecretValue calls as fallback.
+    fn = "secretProviderAws -"    # Holds the funciton name. 
+    smClient = awsSmGetClient(providerOptions.get('region'))
+    secretStrings = {}
+    try:
+        resp_batchGetSecretValue = smClient.batch_get_secret_value(SecretIdList=secretIds)
+        for secretValue in resp_batchGetSecretValue['SecretValues']:
+            for secretId in secretIds:
+                if (secretId in [secretValue.get('Name'), secretValue.get('ARN')]):
+                    secretStrings[secretId] = secretValue['SecretString']
+        # End Loop
+    except Exception as e:    # Older boto3 or no secretsmanager:BatchGetSecretValue permission
+        print("[ABX] "+fn+" AWS Secrets Manager - Batch get not available ("+type(e).__name__+"). Getting secret(s) concurrently...")
+    # End Loop
+    
+    secretIdsMissing = [ secretId for secretId in secretIds if (secretId not in secretStrings) ]
+    if (len(secretIdsMissing) > 0):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(secretIdsMissing)) as executor:
+            resp_awsSecrets = executor.map(lambda secretId: smClient.get_secret_value(SecretId=secretId), secretIdsMissing)
+            for secretId, resp_awsSecret in zip(secretIdsMissing, resp_awsSecrets):
+                secretStrings[secretId] = resp_awsSecret['SecretString']
+        # End Loop
+    # End Loop
+    
+    return secretStrings
+    # End Function  
+
+
+
+def secretProviderFile (secretIds, providerOptions):   # Offline provider. Reads {secretId: secretString} from the JSON file in ABX_SECRETS_FILE.
+    with open(providerOptions.get('secretsFile') or os.environ['ABX_SECRETS_FILE']) as secretsFile:
+        fileSecrets = json.load(secretsFile)
+    return { secretId: (fileSecrets[secretId] if isinstance(fileSecrets[secretId], str) else json.dumps(fileSecrets[secretId])) for secretId in secretIds }
+    # End Function  
+
+
+
+def secretProviderMemory (secretIds, providerOptions):   # Offline provider. Reads secrets from memorySecrets.
+    return { secretId: memorySecrets[secretId] for secretId in secretIds }
+    # End Function  
+
+
+
+def awsSmGetClient (awsRegionName):   # Returns the Secrets Manager client for a region. Created once per container.
+    smClient = awsSmClients.get(awsRegionName)
+    if (smClient is None):
+        with clientRegistryLock:
+            smClient = awsSmClients.get(awsRegionName)
+            if (smClient is None):
+                session = lazyImport('boto3').session.Session()
+                smClient = session.client(
+                    service_name='secretsmanager',
+                    region_name=awsRegionName,
+                    config=lazyImport('botocore.config').Config(connect_timeout=httpConnectTimeoutSeconds, read_timeout=httpReadTimeoutSeconds, retries={'max_attempts': httpRetryAttempts, 'mode': "standard"})    # Bounded timeouts. botocore retries with its own jittered backoff.
+                )
+                smClient.meta.events.register('after-call.secrets-manager', metricsBotoAfterCall)
+                awsSmClients[awsRegionName] = smClient
+        # End Loop
+    # End Loop
+    return smClient
+    # End Function  
+
+
+
+def cspLogin (actionInputs):   # Sets the CSP bearer token and request headers in actionInputs
+    bearerToken = cspGetBearerToken(actionInputs['cspRefreshToken'])   # Call function
+    actionInputs['cspBearerToken'] = bearerToken
+    actionInputs['cspRequestsHeaders'] = cspRequestsHeaders(bearerToken)
+    return bearerToken
+    # End Function  
+
+
+
+def cspGetBearerToken (refreshToken, forceRefresh=False):   # Returns a CSP bearer token. Reuses the cached token while it is valid.
+    fn = "cspGetBearerToken -"    # Holds the funciton name. 
+    
+    
+    # ----- Script ----- #
+    
+    # Check the cache
+    cacheKey = tokenHash(refreshToken)
+    cachedToken = cspTokenCache.get(cacheKey)
+    if ((forceRefresh == False) and (cachedToken is not None) and ((cachedToken['expiresAt'] - cspTokenSafetyMarginSeconds) > time.time())):
+        print("[ABX] "+fn+" Using cached CSP Bearer Token.")
+        return cachedToken['token']
+    # End Loop
+    
+    # Get Token
+    getRefreshToken_apiUrl = cspBaseApiUrl + "/iaas/api/login"  # Set API URL
+    body = {    # Set call body
+        "refreshToken": refreshToken
+    }
+    print("[ABX] "+fn+" Getting CSP Bearer Token.")
+    getRefreshToken_postCall = getHttpSession().post(url = getRefreshToken_apiUrl, data=json.dumps(body))   # Call 
+    getRefreshToken_responseJson = json.loads(getRefreshToken_postCall.text)    # Get call response
+    bearerToken = getRefreshToken_responseJson["token"]   # Set response
+    cspTokenCache[cacheKey] = {
+        'token': bearerToken,
+        'expiresAt': cspTokenExpiry(bearerToken),
+    }
+    
+    return bearerToken    # Return response 
+    # End Function  
+
+
+
+def cspInvalidateBearerToken (refreshToken):   # Drops the cached bearer token for a refresh token
+    cspTokenCache.pop(tokenHash(refreshToken), None)
+    # End Function  
+
+
+
+def tokenHash (token):   # Cache key for a token or secret. Tokens are never used as keys in clear text.
+    return hashlib.sha256(str(token).encode('utf-8')).hexdigest()
+    # End Function  
+
+
+
+def cspTokenExpiry (bearerToken):   # Returns the bearer token expiry (epoch seconds) from the JWT exp claim
+    try:
+        jwtPayload = bearerToken.split('.')[1]
+        jwtPayload += '=' * (-len(jwtPayload) % 4)    # Restore base64 padding
+        jwtClaims = json.loads(base64.urlsafe_b64decode(jwtPayload.encode('utf-8')).decode('utf-8'))
+        return float(jwtClaims['exp'])
+    except Exception:
+        return time.time() + cspTokenDefaultTtlSeconds    # Not a JWT or no exp claim
+    # End Function  
+
+
+
+def cspRequestsHeaders (bearerToken):   # Returns the request headers for CSP API calls
+    requestsHeaders= {
+        'Accept':'application/json',
+        'Content-Type':'application/json',
+        'Authorization': 'Bearer {}'.format(bearerToken),
+        # 'encoding': 'utf-8'
+    }
+    return requestsHeaders
+    # End Function  
+
+
+
+def cspApiGet (actionInputs, apiUrl, extraHeaders=None):   # GET call to the CSP API. On 401 the bearer token is refreshed and the call is retried once.
+    fn = "cspApiGet -"    # Holds the funciton name. 
+    body = {}
+    resp_call = getHttpSession().get(apiUrl, data=json.dumps(body), verify=False, headers=dict(actionInputs['cspRequestsHeaders'], **(extraHeaders or {})))
+    if (resp_call.status_code == 401):
+        print("[ABX] "+fn+" CSP Bearer Token rejected. Refreshing token and retrying...")
+        cspInvalidateBearerToken(actionInputs['cspRefreshToken'])
+        bearerToken = cspGetBearerToken(actionInputs['cspRefreshToken'], forceRefresh=True)
+        actionInputs['cspBearerToken'] = bearerToken
+        actionInputs['cspRequestsHeaders'] = cspRequestsHeaders(bearerToken)
+        resp_call = getHttpSession().get(apiUrl, data=json.dumps(body), verify=False, headers=dict(actionInputs['cspRequestsHeaders'], **(extraHeaders or {})))
+    # End Loop
+    
+    return resp_call    # Return response 
+    # End Function  
+
+
+
+def metricsStart ():   # Resets the invocation metrics
+    with invocationMetricsLock:
+        invocationMetrics.clear()
+        invocationMetrics.update({
+            'startTime': time.perf_counter(),
+            'phases': {},
+            'httpCalls': 0,
+            'httpBytesSent': 0,
+            'httpBytesReceived': 0,
+            'httpRetries': 0,
+        })
+    # End Function  
+
+
+
+@contextlib.contextmanager
+def metricsSpan (phaseName):   # Times a phase. Repeated phases add up.
+    spanStart = time.perf_counter()
+    try:
+        yield
+    finally:
+        spanMs = (time.perf_counter() - spanStart) * 1000
+        with invocationMetricsLock:
+            phases = invocationMetrics.setdefault('phases', {})
+            phases[phaseName] = phases.get(phaseName, 0.0) + spanMs
+    # End Function  
+
+
+
+def metricsCountHttp (bytesSent, bytesReceived):   # Counts one HTTP call
+    with invocationMetricsLock:
+        invocationMetrics['httpCalls'] = invocationMetrics.get('httpCalls', 0) + 1
+        invocationMetrics['httpBytesSent'] = invocationMetrics.get('httpBytesSent', 0) + bytesSent
+        invocationMetrics['httpBytesReceived'] = invocationMetrics.get('httpBytesReceived', 0) + bytesReceived
+    # End Function  
+
+
+
+def metricsCount (counterName):   # Adds one to an invocation counter
+    with invocationMetricsLock:
+        invocationMetrics[counterName] = invocationMetrics.get(counterName, 0) + 1
+    # End Function  
+
+
+
+def metricsBotoAfterCall (http_response=None, **kwargs):   # boto3 after-call event handler. Counts Secrets Manager calls.
+    requestBody = ((kwargs.get('context') or {}).get('request_body')) or b""    # Not always available
+    metricsCountHttp(len(requestBody), len((http_response.content if (http_response is not None) else b"") or b""))
+    # End Function  
+
+
+
+def metricsResult (actionInputs):   # Returns the compact invocation metrics. Also written as one JSON log line when actionOptionMetricsLogIn=True.
+    with invocationMetricsLock:
+        metrics = {
+            'totalMs': round((time.perf_counter() - invocationMetrics.get('startTime', time.perf_counter())) * 1000, 1),
+            'phasesMs': { phaseName: round(phaseMs, 1) for phaseName, phaseMs in invocationMetrics.get('phases', {}).items() },
+            'httpCalls': invocationMetrics.get('httpCalls', 0),
+            'httpBytesSent': invocationMetrics.get('httpBytesSent', 0),
+            'httpBytesReceived': invocationMetrics.get('httpBytesReceived', 0),
+            'httpRetries': invocationMetrics.get('httpRetries', 0),
+        }
+    if (actionInputs.get('actionOptionMetricsLog') == "true"):
+        print(json.dumps({'abxMetrics': metrics, 'eventType': actionInputs.get('eventType', ""), 'blueprintId': actionInputs.get('blueprintId', "")}, sort_keys=True))
+    return metrics
+    # End Function  
+
+
+
+def dagRun (dagSteps, maxWorkers=None):   # Runs {stepName: ([dependencies], stepFunction(dagResults))} as a dependency graph. Each step runs on a worker thread as soon as its dependencies are done, so independent calls overlap. Returns {stepName: result}. A failed step raises once the running steps finished.
+    dagResults = {}
+    stepsPending = dict(dagSteps)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=(maxWorkers or len(dagSteps) or 1)) as executor:
+        stepFutures = {}
+        while ((len(stepsPending) > 0) or (len(stepFutures) > 0)):
+            for stepName, (stepDependencies, stepFunction) in list(stepsPending.items()):
+                if (all((stepDependency in dagResults) for stepDependency in stepDependencies)):
+                    stepFutures[executor.submit(stepFunction, dict(dagResults))] = stepName
+                    del stepsPending[stepName]
+            # End Loop
+            if (len(stepFutures) == 0):
+                raise ValueError("Steps with unknown or circular dependencies: " + ", ".join(sorted(stepsPending)))
+            stepsDone, stepsRunning = concurrent.futures.wait(stepFutures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for stepFuture in stepsDone:
+                dagResults[stepFutures.pop(stepFuture)] = stepFuture.result()    # Raises the step exception
+            # End Loop
+        # End Loop
+    # End Loop
+    
+    return dagResults
+    # End Function  
+
+
+
+def dagStep (phaseName, stepFunction, *args):   # Runs a dagRun step timed as a metrics phase
+    with metricsSpan(phaseName):
+        return stepFunction(*args)
+    # End Function  
+
+
+
+def lazyImport (moduleName):   # Returns a heavy dependency, importing it on first use
+    module = lazyModules.get(moduleName)
+    if (module is None):
+        module = importlib.import_module(moduleName)
+        lazyModules[moduleName] = module
+    return module
+    # End Function  
+
+
+
+def deadlineStart (timeoutSeconds=None):   # Starts the invocation deadline and resets the retry budget
+    with httpTransportLock:
+        invocationDeadline['deadline'] = time.monotonic() + (timeoutSeconds or actionTimeoutSeconds) - actionDeadlineMarginSeconds
+        invocationDeadline['retriesLeft'] = httpRetryBudget
+    # End Function  
+
+
+
+def deadlineRemaining ():   # Returns the seconds left before the invocation deadline. None if no deadline was started.
+    if (invocationDeadline['deadline'] is None):
+        return None
+    return invocationDeadline['deadline'] - time.monotonic()
+    # End Function  
+
+
+
+class HttpDeadlineAdapter:   # Transport adapter mounted on the shared session, so it applies to CSP and GitLab calls. Adds deadline timeouts, retries, rate limit handling and a per host circuit breaker to a requests HTTPAdapter.
+    
+    def __init__ (self, httpAdapter):
+        self.httpAdapter = httpAdapter
+        # End Function  
+    
+    def close (self):
+        self.httpAdapter.close()
+        # End Function  
+    
+    def send (self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):   # Sends with retries. Idempotent methods are retried on connection errors, timeouts and 429 / 502 / 503 / 504. Other methods only on connect timeouts and 429.
+        fn = "HttpDeadlineAdapter -"    # Holds the funciton name. 
+        requests = lazyImport('requests')
+        httpHost = requests.utils.urlparse(request.url).netloc
+        idempotent = (request.method in httpIdempotentMethods)
+        requestBytes = len(request.body) if isinstance(request.body, (bytes, str)) else 0
+        attempt = 0
+        while True:
+            attempt += 1
+            httpHostBeforeSend(httpHost)    # Call function. Fails fast if the host circuit is open.
+            try:
+                response = self.httpAdapter.send(request, stream=stream, timeout=httpCallTimeout(timeout), verify=verify, cert=cert, proxies=proxies)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                metricsCountHttp(requestBytes, 0)    # Call function. Every attempt is counted, retried ones included.
+                httpHostAfterSend(httpHost, False, {})
+                waitSeconds = httpRetryWait(attempt, {})
+                if ((not (idempotent or isinstance(e, requests.exceptions.ConnectTimeout))) or (httpRetryAllowed(attempt, waitSeconds) != "")):
+                    raise
+                print("[ABX] "+fn+" "+request.method+" "+httpHost+" failed ("+type(e).__name__+"). Retrying in "+str(round(waitSeconds, 2))+"s...")
+                time.sleep(waitSeconds)
+                continue
+            # End Loop
+            metricsCountHttp(requestBytes, int(response.headers.get('Content-Length') or 0) if stream else len(response.content or b""))    # Call function. Streamed bodies are not read here.
+            
+            httpHostAfterSend(httpHost, (response.status_code < 500), response.headers)
+            if ((response.status_code != 429) and ((idempotent == False) or (response.status_code not in httpRetryStatuses))):
+                return response
+            waitSeconds = httpRetryWait(attempt, response.headers)
+            retryRefused = httpRetryAllowed(attempt, waitSeconds)
+            if (retryRefused == "attempts"):
+                return response
+            elif (retryRefused != ""):    # Out of time or retry budget. Raised, so no caller sleeps past the deadline.
+                raise requests.exceptions.RetryError("HTTP "+str(response.status_code)+" from "+httpHost+". Not retried: "+retryRefused+" exhausted.", request=request, response=response)
+            # End Loop
+            print("[ABX] "+fn+" "+request.method+" "+httpHost+" returned "+str(response.status_code)+". Retrying in "+str(round(waitSeconds, 2))+"s...")
+            response.close()
+            time.sleep(waitSeconds)
+        # End Loop
+        # End Function  
+    
+    # End Class
+
+
+
+def httpCallTimeout (timeout):   # Returns the (connect, read) timeout of a call, clamped to the time left before the invocation deadline
+    if (isinstance(timeout, tuple)):
+        connectTimeout, readTimeout = timeout
+    elif (isinstance(timeout, (int, float))):
+        connectTimeout, readTimeout = timeout, timeout
+    else:
+        connectTimeout, readTimeout = None, None
+    # End Loop
+    connectTimeout = min(connectTimeout or httpConnectTimeoutSeconds, httpConnectTimeoutSeconds)
+    readTimeout = readTimeout or httpReadTimeoutSeconds
+    
+    remainingSeconds = deadlineRemaining()
+    if (remainingSeconds is not None):
+        if (remainingSeconds <= 0):
+            raise lazyImport('requests').exceptions.Timeout("Invocation deadline reached. Request not sent.")
+        connectTimeout = min(connectTimeout, remainingSeconds)
+        readTimeout = min(readTimeout, remainingSeconds)
+    # End Loop
+    return (connectTimeout, readTimeout)
+    # End Function  
+
+
+
+def httpRetryWait (attempt, headers):   # Returns the seconds to wait before a retry. Jittered exponential backoff, or longer if Retry-After / RateLimit-Reset say so.
+    waitSeconds = random.uniform(0, min(httpRetryBackoffMaxSeconds, httpRetryBackoffSeconds * (2 ** (attempt - 1))))
+    resetSeconds = httpRateLimitResetSeconds(headers)
+    if (resetSeconds is not None):
+        waitSeconds = max(waitSeconds, resetSeconds)
+    return waitSeconds
+    # End Function  
+
+
+
+def httpRateLimitResetSeconds (headers):   # Returns the seconds until the rate limit resets, from Retry-After (seconds or HTTP date) or GitLab RateLimit-Reset (epoch or seconds). None if not given.
+    retryAfter = headers.get('Retry-After')
+    if (retryAfter):
+        try:
+            return max(0.0, float(retryAfter))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(retryAfter).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+        # End Loop
+    # End Loop
+    rateLimitReset = headers.get('RateLimit-Reset')
+    if (rateLimitReset):
+        try:
+            rateLimitReset = float(rateLimitReset)
+        except ValueError:
+            return None
+        if (rateLimitReset > 1000000000):    # Epoch seconds (GitLab)
+            rateLimitReset = rateLimitReset - time.time()
+        return max(0.0, rateLimitReset)
+    # End Loop
+    return None
+    # End Function  
+
+
+
+def httpRetryAllowed (attempt, waitSeconds):   # Returns "" if a retry is allowed and takes one from the retry budget. Otherwise returns what ran out: attempts, deadline or budget.
+    if (attempt >= httpRetryAttempts):
+        return "attempts"
+    remainingSeconds = deadlineRemaining()
+    if ((remainingSeconds is not None) and (waitSeconds >= remainingSeconds - httpConnectTimeoutSeconds)):
+        return "deadline"
+    with httpTransportLock:
+        if (invocationDeadline['retriesLeft'] <= 0):
+            return "budget"
+        invocationDeadline['retriesLeft'] -= 1
+    # End Loop
+    metricsCount('httpRetries')    # Call function
+    return ""
+    # End Function  
+
+
+
+def httpHostBeforeSend (httpHost):   # Fails fast while the host circuit is open, and waits out an exhausted GitLab rate limit
+    requests = lazyImport('requests')
+    now = time.monotonic()
+    with httpTransportLock:
+        hostState = httpHosts.setdefault(httpHost, {'failures': 0, 'openUntil': 0.0, 'rateLimitResetAt': 0.0})
+        if (hostState['openUntil'] > now):
+            raise requests.exceptions.ConnectionError("Circuit open for "+httpHost+" after "+str(hostState['failures'])+" consecutive failures. Failing fast for "+str(round(hostState['openUntil'] - now, 1))+"s.")
+        elif (hostState['failures'] >= httpCircuitFailureThreshold):    # Half open. Let this call through as the trial and keep the others failing fast until it completes.
+            hostState['openUntil'] = now + httpCircuitOpenSeconds
+        # End Loop
+        rateLimitWaitSeconds = hostState['rateLimitResetAt'] - now
+    # End Loop
+    if (rateLimitWaitSeconds > 0):
+        remainingSeconds = deadlineRemaining()
+        if ((remainingSeconds is not None) and (rateLimitWaitSeconds >= remainingSeconds)):
+            raise requests.exceptions.RetryError("Rate limit of "+httpHost+" resets after the invocation deadline. Request not sent.")
+        time.sleep(rateLimitWaitSeconds)
+    # End Loop
+    # End Function  
+
+
+
+def httpHostAfterSend (httpHost, succeeded, headers):   # Records a call result for the host circuit breaker and rate limit
+    now = time.monotonic()
+    with httpTransportLock:
+        hostState = httpHosts.setdefault(httpHost, {'failures': 0, 'openUntil': 0.0, 'rateLimitResetAt': 0.0})
+        if (succeeded):
+            hostState['failures'] = 0
+            hostState['openUntil'] = 0.0
+        else:
+            hostState['failures'] += 1
+            if (hostState['failures'] >= httpCircuitFailureThreshold):
+                hostState['openUntil'] = now + httpCircuitOpenSeconds
+        # End Loop
+        if (headers.get('RateLimit-Remaining') == "0"):
+            hostState['rateLimitResetAt'] = now + (httpRateLimitResetSeconds(headers) or 0.0)
+        # End Loop
+    # End Loop
+    # End Function  
+
+
+
+def getHttpSession ():   # Returns the shared keep-alive HTTP session. Created once per container.
+    if (clientRegistry['httpSession'] is None):
+        with clientRegistryLock:
+            if (clientRegistry['httpSession'] is None):
+                requests = lazyImport('requests')
+                urllib3 = lazyImport('urllib3')
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)   # Warned when making an unverified HTTPS request.
+                urllib3.disable_warnings(urllib3.exceptions.DependencyWarning)   # Warned when an attempt is made to import a module with missing optional dependencies. 
+                httpSession = requests.Session()
+                httpAdapter = HttpDeadlineAdapter(requests.adapters.HTTPAdapter(pool_connections=httpPoolConnections, pool_maxsize=httpPoolMaxSize))
+                httpSession.mount('https://', httpAdapter)
+                httpSession.mount('http://', httpAdapter)
+                clientRegistry['httpSession'] = httpSession
+            # End Loop
+    # End Loop
+    
+    return clientRegistry['httpSession']
+    # End Function  
+
+
+
+def getGitlabProject (gitUrl, gitPrivateToken, gitProjectId):   # Returns a cached GitLab project handle per (url, token, project id)
+    fn = "getGitlabProject -"    # Holds the funciton name. 
+    registryKey = (gitUrl, tokenHash(gitPrivateToken), str(gitProjectId))
+    gitlabProject = clientRegistry['gitlabProjects'].get(registryKey)
+    if (gitlabProject is None):
+        httpSession = getHttpSession()    # Outside the lock. getHttpSession takes it too.
+        with clientRegistryLock:
+            projectLock = clientRegistry['gitlabProjectLocks'].setdefault(registryKey, threading.Lock())
+        with projectLock:    # Connects once per project. The project GET runs outside clientRegistryLock, so other targets connect concurrently.
+            gitlabProject = clientRegistry['gitlabProjects'].get(registryKey)
+            if (gitlabProject is None):
+                print("[ABX] "+fn+" Git - Connecting to project "+str(gitProjectId)+"...")
+                gl = lazyImport('gitlab').Gitlab(gitUrl, private_token=gitPrivateToken, api_version=4, session=httpSession)   # Auth to Gitlab
+                gitlabProject = gl.projects.get(gitProjectId)    # Get project
+                with clientRegistryLock:
+                    clientRegistry['gitlabProjects'][registryKey] = gitlabProject
+            # End Loop
+    else:
+        print("[ABX] "+fn+" Git - Using cached project "+str(gitProjectId)+".")
+    # End Loop
+    
+    return gitlabProject
+    # End Function  
+
+
+
+def gitFileHead (gitProject, gitFilepath, gitRef):   # Returns the file metadata headers without downloading the file. None if the file does not exist.
+    try:
+        return gitProject.files.head(gitFilepath, ref=gitRef)
+    except lazyImport('gitlab').exceptions.GitlabHeadError as e:
+        if (e.response_code == 404):
+            return None
+        raise
+    # End Function  
+
+
+
+def gitSyncBlueprint (gitProject, gitProjectFolder, gitBranch, blueprintId, content, manifestEntry, userName):   # Creates, updates or moves (renamed blueprints) a blueprint file and updates the manifest in the same commit. Returns created, updated, moved or unchanged.
+    fn = "gitSyncBlueprint -"    # Holds the funciton name. 
+    
+    
+    # ----- Script ----- #
+    
+    # Skip if the cached manifest record already has this entry. No API call needed.
+    cachedRecord = gitManifestCache.get(gitBlobShaCacheKey(gitProject, gitBranch, gitManifestPath(gitProjectFolder, blueprintId)))
+    if ((cachedRecord is not None) and (json.loads(cachedRecord['text']).get('blueprint') == manifestEntry)):
+        print("[ABX] "+fn+" Git - Content matches cached manifest record. Skipping write.")
+        return "unchanged"
+    # End Loop
+    
+    def planSync (manifest, verifyFiles):   # Returns the file actions and status. Updates the manifest entry.
+        previousEntry = manifest['blueprints'].get(blueprintId)
+        manifest['blueprints'][blueprintId] = manifestEntry
+        return gitPlanBlueprintActions(gitProject, gitBranch, previousEntry, manifestEntry, content, verifyFiles)
+        # End Function  
+    
+    gitSyncStatus, gitCommitId = gitManifestCommit(gitProject, gitProjectFolder, gitBranch, [blueprintId], planSync, userName)    # Call function
+    
+    return gitSyncStatus    # Return response 
+    # End Function  
+
+
+
+def gitDeleteBlueprint (gitProject, gitProjectFolder, gitBranch, blueprintId, userName):   # Deletes a blueprint file if its manifest entry has gitlabSyncDelete set and removes the entry in the same commit. Returns (deleted / skipped / notFound, file path).
+    deletePlan = {'gitFilepath': ""}
+    
+    def planDelete (manifest, verifyFiles):   # Returns the file actions and status. Removes the manifest entry.
+        gitActions, gitSyncStatus, deletePlan['gitFilepath'] = gitPlanDeleteActions(gitProject, gitBranch, manifest, blueprintId, verifyFiles)
+        return gitActions, gitSyncStatus
+        # End Function  
+    
+    gitSyncStatus, gitCommitId = gitManifestCommit(gitProject, gitProjectFolder, gitBranch, [blueprintId], planDelete, userName)    # Call function
+    
+    return gitSyncStatus, deletePlan['gitFilepath']    # Return response 
+    # End Function  
+
+
+
+def gitPlanBlueprintActions (gitProject, gitBranch, previousEntry, manifestEntry, content, verifyFiles):   # Returns (file actions, created / updated / moved / unchanged) to sync a blueprint file. Trusts the manifest unless verifyFiles is set or the blueprint has no manifest entry.
+    gitFilepath = manifestEntry['path']
+    
+    if ((previousEntry is not None) and (verifyFiles == False)):
+        if (previousEntry['path'] != gitFilepath):    # Renamed
+            return [{'action': "move", 'file_path': gitFilepath, 'previous_path': previousEntry['path'], 'content': content}], "moved"
+        elif (previousEntry['contentSha'] == manifestEntry['contentSha']):
+            return [], "unchanged"
+        return [{'action': "update", 'file_path': gitFilepath, 'content': content}], "updated"
+    # End Loop
+    
+    # No manifest entry (synced before the manifest was added) or retrying after a conflict. Check the files with HEAD requests.
+    with metricsSpan("gitExistenceCheck"):
+        fileHead = gitFileHead(gitProject, gitFilepath, gitBranch)
+        previousFileHead = None
+        if ((previousEntry is not None) and (previousEntry['path'] != gitFilepath)):
+            previousFileHead = gitFileHead(gitProject, previousEntry['path'], gitBranch)
+    # End Loop
+    if ((previousFileHead is not None) and (fileHead is None)):
+        return [{'action': "move", 'file_path': gitFilepath, 'previous_path': previousEntry['path'], 'content': content}], "moved"
+    gitActions = []
+    if (previousFileHead is not None):    # Both names exist. Remove the old one.
+        gitActions.append({'action': "delete", 'file_path': previousEntry['path']})
+    if (fileHead is None):
+        gitActions.append({'action': "create", 'file_path': gitFilepath, 'content': content})
+        return gitActions, "created"
+    elif (fileHead.get('X-Gitlab-Blob-Id') == manifestEntry['contentSha']):
+        return gitActions, "unchanged"
+    gitActions.append({'action': "update", 'file_path': gitFilepath, 'content': content})
+    return gitActions, "updated"
+    # End Function  
+
+
+
+def gitPlanDeleteActions (gitProject, gitBranch, manifest, blueprintId, verifyFiles):   # Returns (file actions, deleted / skipped / notFound, file path) to delete a blueprint file. Removes the manifest entry if gitlabSyncDelete is set.
+    manifestEntry = manifest['blueprints'].get(blueprintId)
+    if (manifestEntry is None):
+        return [], "notFound", ""
+    if (manifestEntry['gitlabSyncDelete'] != True):
+        return [], "skipped", manifestEntry['path']
+    del manifest['blueprints'][blueprintId]
+    if (verifyFiles and (gitFileHead(gitProject, manifestEntry['path'], gitBranch) is None)):    # Already deleted in Git. Only the manifest entry is removed.
+        return [], "deleted", manifestEntry['path']
+    return [{'action': "delete", 'file_path': manifestEntry['path']}], "deleted", manifestEntry['path']
+    # End Function  
+
+
+
+def gitPlanDeleteFileActions (gitProject, gitBranch, gitFilepath):   # Returns (file actions, deleted / skipped / notFound) to delete a blueprint file without a manifest entry by name. Deleted only if the file has gitlabSyncDelete set.
+    try:
+        with metricsSpan("gitExistenceCheck"):
+            gitFile = gitProject.files.get(file_path=gitFilepath, ref=gitBranch)
+    except lazyImport('gitlab').exceptions.GitlabGetError as e:
+        if (e.response_code == 404):
+            return [], "notFound"
+        raise
+    # End Loop
+    if ("gitlabSyncDelete: true".lower() not in gitFile.decode().decode('utf-8').lower()):
+        return [], "skipped"
+    return [{'action': "delete", 'file_path': gitFilepath}], "deleted"
+    # End Function  
+
+
+
+def gitManifestPath (gitProjectFolder, blueprintId):   # Returns the Git file path of the manifest record of a blueprint
+    return gitProjectFolder + gitManifestFolder + blueprintId + ".json"
+    # End Function  
+
+
+
+def gitManifestEntry (gitFilepath, blueprintName, blueprintVersion, content, blueprintOptions, blueprintUpdatedAt=None):   # Returns the manifest entry of a synced blueprint
+    return {
+        'path': gitFilepath,
+        'name': blueprintName,
+        'version': str(blueprintVersion or ""),
+        'updatedAt': blueprintUpdatedAt or "",    # Assembly updatedAt of the synced content. Lets reconcileHandler skip unchanged blueprints.
+        'contentSha': gitBlobSha(content),
+        'gitlabSyncDelete': (str((blueprintOptions or {}).get('gitlabSyncDelete', "")).lower() == "true"),
+        'gitlabSyncEnable': (str((blueprintOptions or {}).get('gitlabSyncEnable', "")).lower() == "true"),
+    }
+    # End Function  
+
+
+
+def gitManifestRecord (manifest, blueprintId):   # Returns the manifest record of a blueprint: its entry and backfill cursor. Empty if it has neither.
+    manifestRecord = {}
+    if (blueprintId in manifest['blueprints']):
+        manifestRecord['blueprint'] = manifest['blueprints'][blueprintId]
+    if (blueprintId in manifest['backfill']):
+        manifestRecord['backfill'] = manifest['backfill'][blueprintId]
+    return manifestRecord
+    # End Function  
+
+
+
+def gitManifestRead (gitProject, gitProjectFolder, gitRef, blueprintIds, maxAgeSeconds=0, recordBlobShas=None):   # Returns (manifest, {blueprintId: record last commit id}) with the records of blueprintIds. The commit id is None for blueprints without a record yet.
+    readRecord = lambda blueprintId: gitManifestReadRecord(gitProject, gitManifestPath(gitProjectFolder, blueprintId), gitRef, maxAgeSeconds, (recordBlobShas or {}).get(blueprintId))
+    with metricsSpan("gitManifestRead"):
+        if (len(blueprintIds) > 1):    # Batches (coalescing, drain, bulk) read their records concurrently
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(bulkMaxWorkers, len(blueprintIds))) as executor:
+                cachedRecords = list(executor.map(readRecord, blueprintIds))
+        else:
+            cachedRecords = [ readRecord(blueprintId) for blueprintId in blueprintIds ]
+        # End Loop
+    # End Loop
+    
+    manifest = {'blueprints': {}, 'backfill': {}}
+    manifestCommitIds = {}
+    for blueprintId, cachedRecord in zip(blueprintIds, cachedRecords):
+        manifestRecord = json.loads(cachedRecord['text'])
+        if ('blueprint' in manifestRecord):
+            manifest['blueprints'][blueprintId] = manifestRecord['blueprint']
+        if ('backfill' in manifestRecord):
+            manifest['backfill'][blueprintId] = manifestRecord['backfill']
+        manifestCommitIds[blueprintId] = cachedRecord['lastCommitId']
+    # End Loop
+    return manifest, manifestCommitIds
+    # End Function  
+
+
+
+def gitManifestReadAll (gitProject, gitProjectFolder, gitRef, gitFiles):   # Returns (manifest, {blueprintId: record last commit id}) with all records. The records and their blob shas come from a gitListFiles listing, so only changed records are downloaded.
+    recordFolder = gitProjectFolder + gitManifestFolder
+    recordBlobShas = { gitFilepath[len(recordFolder):-len(".json")]: blobSha for gitFilepath, blobSha in gitFiles.items() if (gitFilepath.startswith(recordFolder) and gitFilepath.endswith(".json")) }
+    return gitManifestRead(gitProject, gitProjectFolder, gitRef, sorted(recordBlobShas), 0, recordBlobShas)    # Call function
+    # End Function  
+
+
+
+def gitManifestReadRecord (gitProject, recordPath, gitRef, maxAgeSeconds, recordBlobSha=None):   # Returns the cached manifest record {blobSha, lastCommitId, text}. Revalidated with a HEAD request unless revalidated less than maxAgeSeconds ago or recordBlobSha is known from a listing, and downloaded only when it changed.
+    cacheKey = gitBlobShaCacheKey(gitProject, gitRef, recordPath)
+    cachedRecord = gitManifestCache.get(cacheKey)
+    if (recordBlobSha is None):
+        if ((cachedRecord is not None) and (time.monotonic() - cachedRecord['validatedAt'] < maxAgeSeconds)):
+            return cachedRecord
+        recordHead = gitFileHead(gitProject, recordPath, gitRef)
+        if (recordHead is None):
+            cachedRecord = {'blobSha': None, 'lastCommitId': None, 'text': gitManifestDump({})}
+        else:
+            recordBlobSha = recordHead.get('X-Gitlab-Blob-Id')
+            if ((cachedRecord is not None) and (cachedRecord['blobSha'] == recordBlobSha)):
+                cachedRecord = dict(cachedRecord, lastCommitId=recordHead.get('X-Gitlab-Last-Commit-Id', cachedRecord['lastCommitId']))
+        # End Loop
+    # End Loop
+    if ((recordBlobSha is not None) and ((cachedRecord is None) or (cachedRecord['blobSha'] != recordBlobSha))):    # New or changed record
+        recordFile = gitProject.files.get(file_path=recordPath, ref=gitRef)
+        cachedRecord = {
+            'blobSha': recordFile.blob_id,
+            'lastCommitId': recordFile.last_commit_id,
+            'text': recordFile.decode().decode('utf-8'),
+        }
+    # End Loop
+    cachedRecord = dict(cachedRecord, validatedAt=time.monotonic())
+    gitManifestCache[cacheKey] = cachedRecord
+    return cachedRecord
+    # End Function  
+
+
+
+def gitManifestDump (manifestRecord):   # Returns the manifest record file content. Stable key order, so unchanged records compare equal.
+    return json.dumps(manifestRecord, indent=2, sort_keys=True) + "\n"
+    # End Function  
+
+
+
+def gitManifestActions (gitProjectFolder, manifest, manifestTexts, manifestCommitIds):   # Returns the commit actions writing the manifest records changed since manifestTexts {blueprintId: record text}. Updates and deletes only apply if a record is still at its last commit id.
+    manifestActions = []
+    for blueprintId in sorted(set(manifestTexts) | set(manifest['blueprints']) | set(manifest['backfill'])):
+        manifestRecord = gitManifestRecord(manifest, blueprintId)
+        manifestText = gitManifestDump(manifestRecord)
+        if (manifestText == manifestTexts.get(blueprintId, gitManifestDump({}))):
+            continue
+        # End Loop
+        manifestCommitId = manifestCommitIds.get(blueprintId)
+        if (len(manifestRecord) == 0):    # No entry and no cursor left
+            manifestAction = {'action': "delete", 'file_path': gitManifestPath(gitProjectFolder, blueprintId)}
+        else:
+            manifestAction = {'action': "create" if (manifestCommitId is None) else "update", 'file_path': gitManifestPath(gitProjectFolder, blueprintId), 'content': manifestText}
+        if (manifestCommitId is not None):
+            manifestAction['last_commit_id'] = manifestCommitId
+        manifestActions.append(manifestAction)
+    # End Loop
+    return manifestActions
+    # End Function  
+
+
+
+def gitManifestCommit (gitProject, gitProjectFolder, gitBranch, blueprintIds, planFunction, userName, messageFields=None):   # Commits the file actions of planFunction(manifest, verifyFiles) and the updated manifest records of blueprintIds in one commit. messageFields fill {field} placeholders of the commit message. Returns (status, commit id or None).
+    fn = "gitManifestCommit -"    # Holds the funciton name. 
+    
+    
+    # ----- Script ----- #
+    
+    # A record update only applies if nobody else changed the record since it was read. On conflict, plan again on fresh records and check the files. Syncs of other blueprints touch other records and never conflict.
+    for attempt in range(gitManifestCommitAttempts):
+        manifest, manifestCommitIds = gitManifestRead(gitProject, gitProjectFolder, gitBranch, blueprintIds, gitManifestMaxAgeSeconds if (attempt == 0) else 0)    # Call function. Reuses records prefetched by handler. A stale record only costs a retry.
+        manifestTexts = { blueprintId: gitManifestDump(gitManifestRecord(manifest, blueprintId)) for blueprintId in blueprintIds }
+        gitActions, gitSyncStatus = planFunction(manifest, (attempt > 0))
+        manifestActions = gitManifestActions(gitProjectFolder, manifest, manifestTexts, manifestCommitIds)    # Call function
+        gitActions.extend(manifestActions)
+        if (len(gitActions) == 0):
+            return gitSyncStatus, None
+        # End Loop
+        
+        commitData = {
+            'branch': gitBranch,
+            'commit_message': gitCommitMessages.get(gitSyncStatus, 'Synced by www.kaloferov.com').format(**dict(messageFields or {}, userName=userName)),
+            'actions': gitActions,
+        }
+        if (gitSyncStatus == "created"):
+            commitData['author_email'] = "www.kaloferov.com"   # TODO: replace with actionInputs['userName'] to add email 
+            commitData['author_name'] = "www.kaloferov.com"   # TODO: replace with actionInputs['userName'] to add email 
+        # End Loop
+        try:
+            with metricsSpan("gitWrite"):
+                gitCommit = gitProject.commits.create(commitData)
+        except lazyImport('gitlab').exceptions.GitlabCreateError as e:
+            # 400: conflict. 502 / 503 / 504: the commit may or may not have been applied. Both are safe to plan again, as a record update only applies once.
+            if ((e.response_code not in [400, 502, 503, 504]) or (attempt == gitManifestCommitAttempts - 1)):
+                raise
+            print("[ABX] "+fn+" Git - Commit failed ("+str(e.response_code)+" "+str(e.error_message)+"). Retrying on fresh manifest records...")
+            time.sleep(httpRetryWait(attempt + 1, {}))
+            continue
+        # End Loop
+        
+        for manifestAction in manifestActions:
+            gitManifestCache[gitBlobShaCacheKey(gitProject, gitBranch, manifestAction['file_path'])] = {
+                'blobSha': gitBlobSha(manifestAction['content']) if ('content' in manifestAction) else None,
+                'lastCommitId': gitCommit.id if ('content' in manifestAction) else None,
+                'text': manifestAction.get('content', gitManifestDump({})),
+                'validatedAt': time.monotonic(),
+            }
+        # End Loop
+        return gitSyncStatus, gitCommit.id
+    # End Loop
+    # End Function  
+
+
+
+def gitBlobSha (content):   # Returns the Git blob sha of the content, as Git and GitLab compute it
+    contentBytes = content.encode('utf-8')
+    return hashlib.sha1(b"blob " + str(len(contentBytes)).encode('ascii') + b"\0" + contentBytes).hexdigest()
+    # End Function  
+
+
+
+def gitBlobShaCacheKey (gitProject, gitBranch, gitFilepath):   # Cache key for per file caches (gitManifestCache). Project ids are only unique per GitLab instance.
+    return (gitProject.manager.gitlab.url, str(gitProject.get_id()), gitBranch, gitFilepath)
+    # End Function  
+
+
+
+def gitListFiles (gitProject, gitProjectFolder, gitRef):   # Returns {file path: blob sha} for all files under a folder with one recursive tree listing
+    try:
+        treeItems = gitProject.repository_tree(path=(gitProjectFolder.rstrip('/') or None), ref=gitRef, recursive=True, get_all=True, per_page=100)    # Largest page size, fewest calls
+    except lazyImport('gitlab').exceptions.GitlabGetError as e:
+        if (e.response_code == 404):
+            return {}    # Folder or branch does not exist yet
+        raise
+    # End Loop
+    
+    return { treeItem['path']: treeItem['id'] for treeItem in treeItems if (treeItem['type'] == "blob") }
+    # End Function  
+
+
+
+def gitCommitActions (gitProject, gitActions, gitBranch, commitMessage, chunkSize=gitCommitChunkSize):   # Commits file actions as multi-action commits of at most chunkSize actions. Returns the commit ids.
+    fn = "gitCommitActions -"    # Holds the funciton name. 
+    gitCommits = []
+    for chunkStart in range(0, len(gitActions), chunkSize):
+        chunkActions = gitActions[chunkStart:chunkStart+chunkSize]
+        print("[ABX] "+fn+" Git - Committing actions "+str(chunkStart+1)+"-"+str(chunkStart+len(chunkActions))+" of "+str(len(gitActions))+"...")
+        with metricsSpan("gitWrite"):
+            gitCommit = gitProject.commits.create({
+                'branch': gitBranch,
+                'commit_message': commitMessage,
+                'actions': chunkActions,
+            })
+        gitCommits.append(gitCommit.id)
+    # End Loop
+    
+    return gitCommits
+    # End Function  
+
+
+
+def storagePathShared (storagePath):   # Returns True if storagePath is set and not in a container-local folder (storageLocalFolders)
+    if (not storagePath):
+        return False
+    storagePath = os.path.realpath(storagePath)
+    for localFolder in storageLocalFolders:
+        if (os.path.commonpath([storagePath, os.path.realpath(localFolder)]) == os.path.realpath(localFolder)):
+            return False
+    # End Loop
+    return True
+    # End Function  
+
+
+
+def spoolUpdate (actionInputs, updateFunction):   # Runs updateFunction(spoolEntries) atomically on the spool of the Git project folder. spoolEntries is {blueprintId: entry}. Returns its result.
+    spoolKey = str(actionInputs['gitProjectId']) + ":" + actionInputs['gitProjectFolder']
+    return spoolBackends[actionInputs['coalesceBackend']](spoolKey, updateFunction, {'spoolPath': actionInputs['coalesceSpoolPath']})
+    # End Function  
+
+
+
+def spoolRegisterBackend (spoolBackend, backendFunction):   # Registers a spool backend. backendFunction(spoolKey, updateFunction, backendOptions) runs updateFunction on the spool entries of spoolKey atomically and returns its result.
+    spoolBackends[spoolBackend] = backendFunction
+    # End Function  
+
+
+
+def spoolBackendFile (spoolKey, updateFunction, backendOptions):   # JSON file spool on storage shared by the action containers. Updates hold an exclusive flock and replace the file atomically.
+    fn = "spoolBackendFile -"    # Holds the funciton name. 
+    fcntl = lazyImport('fcntl')
+    spoolPath = backendOptions['spoolPath']
+    with open(spoolPath + ".lock", "a") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(spoolPath) as spoolFile:
+                    spool = json.load(spoolFile)
+            except FileNotFoundError:
+                spool = {}
+            except ValueError:
+                print("[ABX] "+fn+" Unreadable spool "+spoolPath+". Starting a new one.")
+                spool = {}
+            # End Loop
+            spoolText = json.dumps(spool, sort_keys=True)
+            spoolEntries = spool.setdefault(spoolKey, {})
+            result = updateFunction(spoolEntries)
+            if (len(spoolEntries) == 0):
+                del spool[spoolKey]
+            if (json.dumps(spool, sort_keys=True) != spoolText):
+                with open(spoolPath + ".tmp", "w") as spoolFile:
+                    json.dump(spool, spoolFile, sort_keys=True)
+                os.replace(spoolPath + ".tmp", spoolPath)
+            # End Loop
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+        # End Loop
+    # End Loop
+    
+    return result
+    # End Function  
+
+
+
+def spoolBackendMemory (spoolKey, updateFunction, backendOptions):   # In-process spool. Stand-in for the file spool in single process runs and benchmarks. Separate ABX invocations never share it.
+    with memorySpoolLock:
+        spoolEntries = memorySpool.setdefault(spoolKey, {})
+        result = updateFunction(spoolEntries)
+        if (len(spoolEntries) == 0):
+            del memorySpool[spoolKey]
+    # End Loop
+    
+    return result
+    # End Function  
+
+
+# ----- Event Handlers ----- #  
+
+eventRegisterHandler("CREATE_BLUEPRINT_VERSION", "blueprint.version.configuration", eventPayloadCreateBlueprintVersion)
+eventRegisterHandler("DELETE_BLUEPRINT", "blueprint.configuration", eventPayloadDeleteBlueprint)
+eventRegisterHandler("TEST", "TEST", eventPayloadTest)
+
+
+
+# ----- Secret Providers ----- #  
+
+secretRegisterProvider("aws", secretProviderAws)
+secretRegisterProvider("file", secretProviderFile)
+secretRegisterProvider("memory", secretProviderMemory)
+
+
+
+# ----- Spool Backends ----- #  
+
+spoolRegisterBackend("file", spoolBackendFile)
+spoolRegisterBackend("memory", spoolBackendMemory)